@@ -0,0 +1,72 @@
+"""Measure cold start: package import, create_app and first request latency.
+
+Each sample runs in a fresh interpreter so nothing is already imported,
+configured or connected:
+
+    python -m benchmarks.cold_start --dsn $SQLALCHEMY_DATABASE_URI --samples 10
+    python -m benchmarks.cold_start --dsn $SQLALCHEMY_DATABASE_URI --no-warmup
+
+The JSON report holds the median and maximum of every phase.
+"""
+import argparse, json, os, statistics, subprocess, sys
+
+PROBE = r"""
+import json, sys, time
+started = time.perf_counter()
+from flask_app import create_app
+imported = time.perf_counter()
+app = create_app()
+created = time.perf_counter()
+client = app.test_client()
+client.get(sys.argv[1])
+first = time.perf_counter()
+client.get(sys.argv[1])
+second = time.perf_counter()
+print(json.dumps({
+    'import': imported - started,
+    'create_app': created - imported,
+    'first_request': first - created,
+    'second_request': second - first,
+    'total': first - started,
+}))
+"""
+
+
+def sample(path, env):
+    output = subprocess.check_output([sys.executable, '-c', PROBE, path], env=env)
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dsn', default=os.environ.get('SQLALCHEMY_DATABASE_URI'))
+    parser.add_argument('--samples', type=int, default=5)
+    parser.add_argument('--path', default='/courses/1')
+    parser.add_argument('--no-warmup', action='store_true')
+    parser.add_argument('--with-migrations', action='store_true')
+    args = parser.parse_args(argv)
+    env = dict(
+        os.environ,
+        SQLALCHEMY_DATABASE_URI=args.dsn or '',
+        WARMUP_ENABLED='0' if args.no_warmup else '1',
+        MIGRATIONS_ENABLED='1' if args.with_migrations else '0',
+    )
+    samples = [sample(args.path, env) for _ in range(args.samples)]
+    report = {
+        'settings': {
+            'samples': args.samples,
+            'path': args.path,
+            'warmup': not args.no_warmup,
+            'migrations': args.with_migrations,
+        },
+        'seconds': {
+            phase: {
+                'median': statistics.median(s[phase] for s in samples),
+                'max': max(s[phase] for s in samples),
+            }
+            for phase in samples[0]
+        },
+    }
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,60 @@
+"""Compare two load test reports produced by benchmarks.load_test.
+
+    python -m benchmarks.compare before.json after.json --threshold 10
+
+Prints the change in p50/p95/p99 latency, throughput and queries per request
+for every endpoint present in both reports, and exits with status 1 when any
+p95 latency or mean query count regressed by more than the threshold percent.
+"""
+import argparse, json, sys
+
+METRICS = (
+    ('p50 ms', lambda e: e['latency_ms']['p50']),
+    ('p95 ms', lambda e: e['latency_ms']['p95']),
+    ('p99 ms', lambda e: e['latency_ms']['p99']),
+    ('rps', lambda e: e['throughput_rps']),
+    ('queries', lambda e: e['queries_per_request']['mean']),
+)
+GUARDED = ('p95 ms', 'queries')
+
+
+def change(before, after):
+    if before is None or after is None:
+        return None
+    if before == 0:
+        return 0.0 if after == 0 else float('inf')
+    return (after - before) / before * 100
+
+def fmt(value):
+    return '-' if value is None else f"{value:.2f}"
+
+def compare(before, after, threshold):
+    """Return printable rows and whether any guarded metric regressed"""
+    rows = []
+    regressed = False
+    for name in sorted(set(before['endpoints']) & set(after['endpoints'])):
+        for label, metric in METRICS:
+            old, new = metric(before['endpoints'][name]), metric(after['endpoints'][name])
+            delta = change(old, new)
+            flag = ''
+            if label in GUARDED and delta is not None and delta > threshold:
+                flag = 'REGRESSION'
+                regressed = True
+            rows.append((name, label, old, new, delta, flag))
+    return rows, regressed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=10.0)
+    args = parser.parse_args(argv)
+    with open(args.before) as before, open(args.after) as after:
+        rows, regressed = compare(json.load(before), json.load(after), args.threshold)
+    for name, label, old, new, delta, flag in rows:
+        delta = '' if delta is None else f"{delta:+.1f}%"
+        print(f"{name:40} {label:8} {fmt(old):>10} {fmt(new):>10} {delta:>9} {flag}")
+    return 1 if regressed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,212 @@
+"""Seeded synthetic dataset generator for load tests and benchmarks.
+
+Rows are streamed straight into Postgres with COPY, so the default volumes
+(50k courses, 200k users, 20M rounds) load in minutes rather than hours.
+Ids are laid out deterministically so the load driver can address rows
+without reading the database first:
+
+    tee ids    (course_id - 1) * TEES_PER_COURSE + n,    n = 1 .. tees on course
+    hole ids   (course_id - 1) * HOLES_PER_COURSE + number
+    rounds     round r belongs to user ((r - 1) % users) + 1
+
+Usage:
+    python -m benchmarks.generate --dsn postgresql://test:password@db:5432/testdb
+"""
+import argparse, datetime, io, os, random, sys, time
+
+TEES_PER_COURSE = 4
+HOLES_PER_COURSE = 18
+TEE_COLOURS = ('black', 'blue', 'white', 'red')
+TEE_LENGTH = {'black': 1.1, 'blue': 1.0, 'white': 0.92, 'red': 0.8}
+HOLE_YARDS = {3: (120, 220), 4: (300, 460), 5: (460, 580)}
+EIGHTEEN_HOLE_PARS = [3] * 4 + [4] * 10 + [5] * 4
+NINE_HOLE_PARS = [3] * 2 + [4] * 5 + [5] * 2
+
+
+def tee_id(course_id, n=1):
+    return (course_id - 1) * TEES_PER_COURSE + n
+
+def hole_id(course_id, number):
+    return (course_id - 1) * HOLES_PER_COURSE + number
+
+def round_user(round_id, users):
+    return ((round_id - 1) % users) + 1
+
+
+class RowStream(io.TextIOBase):
+    """File-like adaptor which lets COPY read rows from a generator"""
+
+    def __init__(self, rows):
+        self._rows = rows
+        self._buffer = ''
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += next(self._rows)
+            except StopIteration:
+                break
+        if size < 0:
+            size = len(self._buffer)
+        chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+        return chunk
+
+
+def copy_rows(cursor, table, columns, rows):
+    """COPY tab separated rows produced by a generator into table"""
+    cursor.copy_expert(
+        f"COPY {table} ({', '.join(columns)}) FROM STDIN",
+        RowStream(rows),
+        size=1 << 16
+    )
+
+def pg_array(values):
+    return '{' + ','.join(str(v) for v in values) + '}'
+
+
+class CourseLayout(object):
+    """The generated shape of every course, kept so rounds can reference it"""
+
+    def __init__(self, rng, courses):
+        self.pars = []
+        self.tees = []
+        for _ in range(courses):
+            pars = list(EIGHTEEN_HOLE_PARS if rng.random() < 0.9 else NINE_HOLE_PARS)
+            rng.shuffle(pars)
+            self.pars.append(pars)
+            self.tees.append(rng.randint(2, TEES_PER_COURSE))
+
+
+def course_rows(rng, courses):
+    for course_id in range(1, courses + 1):
+        yield f"{course_id}\tCourse {course_id}\tLocation {rng.randint(1, 5000)}\n"
+
+def tee_rows(rng, layout):
+    for index, tee_count in enumerate(layout.tees):
+        course_id = index + 1
+        slope_base = rng.randint(110, 135)
+        for n in range(1, tee_count + 1):
+            colour = TEE_COLOURS[n - 1]
+            rating = round(68 + 4 * TEE_LENGTH[colour] + rng.uniform(-1.5, 1.5), 1)
+            slope = slope_base + int(10 * (TEE_LENGTH[colour] - 1))
+            yield f"{tee_id(course_id, n)}\t{course_id}\t{colour}\t{rating}\t{slope}\n"
+
+def hole_rows(layout):
+    for index, pars in enumerate(layout.pars):
+        course_id = index + 1
+        for number, par in enumerate(pars, start=1):
+            yield f"{hole_id(course_id, number)}\t{course_id}\t{number}\t{par}\n"
+
+def yardage_rows(rng, layout):
+    for index, pars in enumerate(layout.pars):
+        course_id = index + 1
+        for number, par in enumerate(pars, start=1):
+            low, high = HOLE_YARDS[par]
+            base = rng.randint(low, high)
+            for n in range(1, layout.tees[index] + 1):
+                yardage = int(base * TEE_LENGTH[TEE_COLOURS[n - 1]])
+                yield f"{tee_id(course_id, n)}\t{hole_id(course_id, number)}\t{yardage}\n"
+
+def user_rows(rng, users, start):
+    for user_id in range(1, users + 1):
+        joined = start + datetime.timedelta(days=rng.randint(0, 365))
+        yield f"{user_id}\tPlayer {user_id}\t{joined.isoformat()}\n"
+
+def round_rows(rng, layout, users, rounds, start, days):
+    skill = [rng.uniform(-0.2, 1.6) for _ in range(users)]
+    courses = len(layout.pars)
+    for round_id in range(1, rounds + 1):
+        user_id = round_user(round_id, users)
+        index = rng.randrange(courses)
+        pars = layout.pars[index]
+        n = rng.randint(1, layout.tees[index])
+        played = start + datetime.timedelta(days=rng.randrange(days))
+        mean_over = skill[user_id - 1]
+        scores = [max(1, par + int(round(rng.gauss(mean_over, 1.0)))) for par in pars]
+        putts = [min(score, rng.choice((1, 2, 2, 2, 3))) for score in scores]
+        yield (
+            f"{round_id}\t{user_id}\t{index + 1}\t{tee_id(index + 1, n)}\t"
+            f"{played.isoformat()}\t{pg_array(scores)}\t{pg_array(putts)}\n"
+        )
+
+
+def reset_sequences(cursor, tables):
+    for table in tables:
+        cursor.execute(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+            f"COALESCE((SELECT MAX(id) FROM {table}), 0) + 1, false)"
+        )
+
+def load(connection, courses, users, rounds, seed=0, years=3, end=None, log=print):
+    """Load a complete synthetic dataset through a raw DBAPI connection.
+    The same seed and end date always produce the same rows."""
+    rng = random.Random(seed)
+    end = end or datetime.date.today()
+    start = end - datetime.timedelta(days=365 * years)
+    layout = CourseLayout(rng, courses)
+    steps = (
+        ('courses', ('id', 'name', 'location'), course_rows(rng, courses)),
+        ('tees', ('id', 'course_id', 'colour', 'course_rating', 'slope_rating'),
+            tee_rows(rng, layout)),
+        ('holes', ('id', 'course_id', 'number', 'par'), hole_rows(layout)),
+        ('yardages', ('tee_id', 'hole_id', 'yardage'), yardage_rows(rng, layout)),
+        ('users', ('id', 'name', 'date_joined'), user_rows(rng, users, start)),
+        ('rounds', ('id', 'user_id', 'course_id', 'tee_id', 'date', 'score_by_hole', 'putts'),
+            round_rows(rng, layout, users, rounds, start, 365 * years)),
+    )
+    cursor = connection.cursor()
+    for table, columns, rows in steps:
+        started = time.perf_counter()
+        copy_rows(cursor, table, columns, rows)
+        log(f"loaded {table} in {time.perf_counter() - started:.1f}s")
+    reset_sequences(cursor, ('courses', 'tees', 'holes', 'users', 'rounds'))
+    connection.commit()
+    old_isolation = connection.isolation_level
+    connection.set_isolation_level(0)
+    cursor.execute("ANALYZE")
+    connection.set_isolation_level(old_isolation)
+    return layout
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dsn', default=os.environ.get('SQLALCHEMY_DATABASE_URI'))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--courses', type=int, default=50000)
+    parser.add_argument('--users', type=int, default=200000)
+    parser.add_argument('--rounds', type=int, default=20000000)
+    parser.add_argument('--years', type=int, default=3)
+    parser.add_argument('--end-date', type=datetime.date.fromisoformat, default=None,
+        help='last possible round date, defaults to today')
+    parser.add_argument('--reset', action='store_true',
+        help='drop and recreate the schema before loading')
+    args = parser.parse_args(argv)
+    if not args.dsn:
+        parser.error('--dsn or SQLALCHEMY_DATABASE_URI is required')
+
+    os.environ['SQLALCHEMY_DATABASE_URI'] = args.dsn
+    from flask_app import create_app, db, partitions
+    app = create_app()
+    with app.app_context():
+        if args.reset:
+            db.drop_all()
+        db.create_all()
+        # monthly rounds partitions for the whole span, not just the default
+        end = args.end_date or datetime.date.today()
+        partitions.create_partitions(
+            db.engine, start=end - datetime.timedelta(days=365 * args.years), today=end
+        )
+        connection = db.engine.raw_connection()
+        try:
+            load(
+                connection, args.courses, args.users, args.rounds,
+                seed=args.seed, years=args.years, end=args.end_date
+            )
+        finally:
+            connection.close()
+
+if __name__ == '__main__':
+    sys.exit(main())
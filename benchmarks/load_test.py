@@ -0,0 +1,275 @@
+"""Load driver which exercises the API endpoints and reports latency figures.
+
+Run it against a server loaded by benchmarks.generate with the same sizes:
+
+    python -m benchmarks.load_test --base-url http://localhost:5000 \\
+        --concurrency 16 --duration 60 --output results.json
+
+The report is JSON: per endpoint request counts, errors, p50/p95/p99 latency,
+throughput and queries per request (read from the X-DB-Query-Count header),
+plus the git commit and run settings so reports can be compared with
+benchmarks.compare.
+"""
+import argparse, datetime, json, math, platform, random, subprocess, sys, threading, time
+import urllib.error, urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.generate import hole_id, round_user, tee_id
+
+QUERY_COUNT_HEADER = 'X-DB-Query-Count'
+DB_TIME_HEADER = 'X-DB-Time-Ms'
+
+
+class Target(object):
+    """One endpoint of the API and how to build a request for it"""
+
+    def __init__(self, name, method, build, weight=1, write=False):
+        self.name = name
+        self.method = method
+        self.build = build
+        self.weight = weight
+        self.write = write
+
+
+def _course(rng, sizes):
+    return rng.randint(1, sizes.courses)
+
+def _scores(rng):
+    return [rng.randint(3, 6) for _ in range(18)]
+
+def _round_path(rng, sizes):
+    round_id = rng.randint(1, sizes.rounds)
+    return f"/users/{round_user(round_id, sizes.users)}/rounds/{round_id}"
+
+def courses_page(rng, sizes):
+    return f"/courses?page={rng.randint(1, 50)}", None
+
+def course(rng, sizes):
+    return f"/courses/{_course(rng, sizes)}", None
+
+def holes(rng, sizes):
+    return f"/courses/{_course(rng, sizes)}/holes", None
+
+def hole(rng, sizes):
+    course_id = _course(rng, sizes)
+    return f"/courses/{course_id}/holes/{hole_id(course_id, rng.randint(1, 9))}", None
+
+def tees(rng, sizes):
+    return f"/courses/{_course(rng, sizes)}/tees", None
+
+def tee(rng, sizes):
+    course_id = _course(rng, sizes)
+    return f"/courses/{course_id}/tees/{tee_id(course_id)}", None
+
+def rounds(rng, sizes):
+    return f"/users/{rng.randint(1, sizes.users)}/rounds", None
+
+def rounds_last_year(rng, sizes):
+    start = datetime.date.today() - datetime.timedelta(days=365)
+    return f"/users/{rng.randint(1, sizes.users)}/rounds?from={start}", None
+
+def round_detail(rng, sizes):
+    return _round_path(rng, sizes), None
+
+def new_course(rng, sizes):
+    return "/courses", {'name': 'Load test course', 'location': 'nowhere'}
+
+def new_tee(rng, sizes):
+    return f"/courses/{_course(rng, sizes)}/tees", {'colour': f"load-{rng.getrandbits(48):x}"}
+
+def update_tee(rng, sizes):
+    path, _ = tee(rng, sizes)
+    return path, {'course_rating': round(rng.uniform(68, 74), 1)}
+
+def update_hole(rng, sizes):
+    course_id = _course(rng, sizes)
+    body = {'tees': [{'colour': 'blue', 'yardage': rng.randint(300, 450)}]}
+    return f"/courses/{course_id}/holes/{hole_id(course_id, 1)}", body
+
+def new_round(rng, sizes):
+    course_id = _course(rng, sizes)
+    user_id = rng.randint(1, sizes.users)
+    body = {'course_id': course_id, 'tee_id': tee_id(course_id), 'score_by_hole': _scores(rng)}
+    return f"/users/{user_id}/rounds", body
+
+def update_round(rng, sizes):
+    return _round_path(rng, sizes), {'score_by_hole': _scores(rng)}
+
+# users.user_detail is left out as the view is not implemented yet.
+TARGETS = (
+    Target('courses.retrieve_courses', 'GET', courses_page, weight=2),
+    Target('courses.course_detail', 'GET', course, weight=3),
+    Target('courses.retrieve_holes', 'GET', holes, weight=2),
+    Target('courses.hole_detail', 'GET', hole, weight=3),
+    Target('courses.retrieve_tees', 'GET', tees, weight=2),
+    Target('courses.tee_detail', 'GET', tee, weight=2),
+    Target('users.retrieve_rounds', 'GET', rounds, weight=4),
+    Target('users.retrieve_rounds[from]', 'GET', rounds_last_year, weight=2),
+    Target('users.round_detail', 'GET', round_detail, weight=3),
+    Target('courses.retrieve_courses[POST]', 'POST', new_course, write=True),
+    Target('courses.retrieve_tees[POST]', 'POST', new_tee, write=True),
+    Target('courses.tee_detail[PATCH]', 'PATCH', update_tee, write=True),
+    Target('courses.hole_detail[PATCH]', 'PATCH', update_hole, write=True),
+    Target('users.retrieve_rounds[POST]', 'POST', new_round, weight=2, write=True),
+    Target('users.round_detail[PATCH]', 'PATCH', update_round, write=True),
+)
+
+
+class Recorder(object):
+    """Thread safe collection of per endpoint samples"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+
+    def add(self, name, latency, status, queries, db_time):
+        with self.lock:
+            self.samples.setdefault(name, []).append((latency, status, queries, db_time))
+
+
+def percentile(sorted_values, fraction):
+    """Nearest rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+def send(base_url, method, path, body, timeout):
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(base_url + path, data=data, method=method)
+    if data is not None:
+        req.add_header('Content-Type', 'application/json')
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as res:
+            res.read()
+            return res.status, res.headers
+    except urllib.error.HTTPError as ex:
+        ex.read()
+        return ex.code, ex.headers
+    except (urllib.error.URLError, OSError):
+        return 0, {}
+
+def worker(args, targets, weights, recorder, deadline, seed):
+    rng = random.Random(seed)
+    sent = 0
+    while time.monotonic() < deadline and (not args.requests or sent < args.requests):
+        target = rng.choices(targets, weights)[0]
+        path, body = target.build(rng, args)
+        started = time.perf_counter()
+        status, headers = send(args.base_url, target.method, path, body, args.timeout)
+        latency = time.perf_counter() - started
+        queries = headers.get(QUERY_COUNT_HEADER)
+        db_time = headers.get(DB_TIME_HEADER)
+        recorder.add(
+            target.name, latency, status,
+            int(queries) if queries is not None else None,
+            float(db_time) if db_time is not None else None
+        )
+        sent += 1
+
+def summarise(samples, elapsed):
+    latencies = sorted(sample[0] * 1000 for sample in samples)
+    queries = sorted(sample[2] for sample in samples if sample[2] is not None)
+    db_times = [sample[3] for sample in samples if sample[3] is not None]
+    errors = sum(1 for sample in samples if sample[1] == 0 or sample[1] >= 500)
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'status_codes': {
+            str(code): sum(1 for sample in samples if sample[1] == code)
+            for code in sorted(set(sample[1] for sample in samples))
+        },
+        'throughput_rps': len(samples) / elapsed if elapsed else None,
+        'latency_ms': {
+            'mean': sum(latencies) / len(latencies) if latencies else None,
+            'p50': percentile(latencies, 0.50),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'max': latencies[-1] if latencies else None,
+        },
+        'queries_per_request': {
+            'mean': sum(queries) / len(queries) if queries else None,
+            'p95': percentile(queries, 0.95),
+            'max': queries[-1] if queries else None,
+        },
+        'db_time_ms_mean': sum(db_times) / len(db_times) if db_times else None,
+    }
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(args):
+    targets = [
+        target for target in TARGETS
+        if (args.include_writes or not target.write)
+        and (not args.endpoints or target.name in args.endpoints)
+    ]
+    if not targets:
+        raise SystemExit('no endpoints selected')
+    weights = [target.weight for target in targets]
+    recorder = Recorder()
+    started = time.perf_counter()
+    deadline = time.monotonic() + args.duration
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = [
+            pool.submit(worker, args, targets, weights, recorder, deadline, args.seed + n)
+            for n in range(args.concurrency)
+        ]
+        for future in futures:
+            future.result()
+    elapsed = time.perf_counter() - started
+    all_samples = [sample for samples in recorder.samples.values() for sample in samples]
+    return {
+        'commit': git_commit(),
+        'timestamp': datetime.datetime.utcnow().isoformat() + 'Z',
+        'python': platform.python_version(),
+        'settings': {
+            'base_url': args.base_url,
+            'concurrency': args.concurrency,
+            'duration': args.duration,
+            'requests_per_worker': args.requests,
+            'seed': args.seed,
+            'include_writes': args.include_writes,
+            'courses': args.courses,
+            'users': args.users,
+            'rounds': args.rounds,
+        },
+        'elapsed_s': elapsed,
+        'total': summarise(all_samples, elapsed),
+        'endpoints': {
+            name: summarise(samples, elapsed)
+            for name, samples in sorted(recorder.samples.items())
+        },
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--base-url', default='http://localhost:5000')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=30,
+        help='seconds to run for')
+    parser.add_argument('--requests', type=int, default=0,
+        help='stop each worker after this many requests, 0 for no limit')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--courses', type=int, default=50000)
+    parser.add_argument('--users', type=int, default=200000)
+    parser.add_argument('--rounds', type=int, default=20000000)
+    parser.add_argument('--include-writes', action='store_true')
+    parser.add_argument('--endpoints', nargs='*',
+        help='only exercise these endpoint names')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args(argv)
+    report = json.dumps(run(args), indent=2)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(report + '\n')
+    else:
+        print(report)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,147 @@
+"""Measure partition pruning on the rounds table.
+
+Runs date bounded queries against the partitioned rounds table and against
+an unpartitioned copy of the same rows, reporting latency, buffers read and
+the number of tables each plan touches. Load a multi-year dataset first:
+
+    python -m benchmarks.generate --dsn $DSN --reset --years 5
+    python -m benchmarks.partition_bench --dsn $DSN --prepare --output partitions.json
+
+--prepare (re)creates the rounds_flat copy with the same indexes, later
+runs can reuse it.
+"""
+import argparse, datetime, json, os, random, statistics, sys, time
+import psycopg2
+
+FLAT_TABLE = 'rounds_flat'
+INDEXES = (
+    ('user_id', 'date'),
+    ('course_id', 'tee_id'),
+    ('tee_id',),
+)
+QUERIES = {
+    'user_rounds_quarter': (
+        "SELECT id, date, score_by_hole FROM {table} "
+        "WHERE user_id = %(user_id)s AND date >= %(start)s AND date < %(end)s "
+        "ORDER BY date LIMIT 10",
+        90
+    ),
+    'rounds_in_month': (
+        "SELECT count(*) FROM {table} WHERE date >= %(start)s AND date < %(end)s",
+        30
+    ),
+    'course_tee_usage_week': (
+        "SELECT tee_id, count(*) FROM {table} "
+        "WHERE course_id = %(course_id)s AND date >= %(start)s AND date < %(end)s "
+        "GROUP BY tee_id",
+        7
+    ),
+}
+
+
+def prepare(cursor):
+    cursor.execute(f"DROP TABLE IF EXISTS {FLAT_TABLE}")
+    cursor.execute(f"CREATE TABLE {FLAT_TABLE} AS SELECT * FROM rounds")
+    cursor.execute(f"ALTER TABLE {FLAT_TABLE} ADD PRIMARY KEY (id)")
+    for columns in INDEXES:
+        cursor.execute(f"CREATE INDEX ON {FLAT_TABLE} ({', '.join(columns)})")
+    cursor.execute(f"ANALYZE {FLAT_TABLE}")
+
+def parameters(rng, first, last, days, users, courses):
+    start = first + datetime.timedelta(days=rng.randrange(max((last - first).days - days, 1)))
+    return {
+        'start': start,
+        'end': start + datetime.timedelta(days=days),
+        'user_id': rng.randint(1, users),
+        'course_id': rng.randint(1, courses),
+    }
+
+def relations(plan):
+    found = set()
+    if 'Relation Name' in plan:
+        found.add(plan['Relation Name'])
+    for child in plan.get('Plans', ()):
+        found |= relations(child)
+    return found
+
+def measure(cursor, statement, samples):
+    latencies, buffers, touched = [], [], 0
+    for params in samples:
+        started = time.perf_counter()
+        cursor.execute(statement, params)
+        cursor.fetchall()
+        latencies.append(time.perf_counter() - started)
+    cursor.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + statement, samples[0])
+    plan = cursor.fetchone()[0]
+    plan = json.loads(plan) if isinstance(plan, str) else plan
+    root = plan[0]['Plan']
+    buffers = root.get('Shared Hit Blocks', 0) + root.get('Shared Read Blocks', 0)
+    touched = len(relations(root))
+    latencies.sort()
+    return {
+        'median_ms': round(statistics.median(latencies) * 1000, 3),
+        'p95_ms': round(latencies[max(int(len(latencies) * 0.95) - 1, 0)] * 1000, 3),
+        'buffers': buffers,
+        'tables_scanned': touched,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dsn', default=os.environ.get('SQLALCHEMY_DATABASE_URI'))
+    parser.add_argument('--samples', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--prepare', action='store_true',
+        help=f'create the unpartitioned {FLAT_TABLE} copy to compare against')
+    parser.add_argument('--output')
+    args = parser.parse_args(argv)
+    if not args.dsn:
+        parser.error('--dsn or SQLALCHEMY_DATABASE_URI is required')
+
+    connection = psycopg2.connect(args.dsn)
+    connection.autocommit = True
+    cursor = connection.cursor()
+    if args.prepare:
+        prepare(cursor)
+    cursor.execute("SELECT min(date), max(date) FROM rounds")
+    first, last = cursor.fetchone()
+    cursor.execute("SELECT max(id) FROM users")
+    users = cursor.fetchone()[0]
+    cursor.execute("SELECT max(id) FROM courses")
+    courses = cursor.fetchone()[0]
+    cursor.execute(
+        "SELECT count(*) FROM pg_inherits WHERE inhparent = to_regclass('rounds')"
+    )
+    partitions = cursor.fetchone()[0]
+
+    rng = random.Random(args.seed)
+    results = {}
+    for name, (statement, days) in QUERIES.items():
+        samples = [
+            parameters(rng, first, last, days, users, courses) for _ in range(args.samples)
+        ]
+        partitioned = measure(cursor, statement.format(table='rounds'), samples)
+        flat = measure(cursor, statement.format(table=FLAT_TABLE), samples)
+        results[name] = {
+            'partitioned': partitioned,
+            'unpartitioned': flat,
+            'speedup': round(flat['median_ms'] / partitioned['median_ms'], 2)
+                if partitioned['median_ms'] else None,
+        }
+    report = {
+        'settings': {
+            'samples': args.samples,
+            'seed': args.seed,
+            'first_date': str(first),
+            'last_date': str(last),
+            'partitions': partitions,
+        },
+        'queries': results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,112 @@
+"""Measure the CPU the statement cache saves per request.
+
+Drives the primary key lookup endpoints of course_views.py and
+user_views.py in-process through the test client, in three modes:
+
+    query     Model.query.get() on every call, the behaviour before the cache
+    baked     cached statements, sent as plain SQL
+    prepared  cached statements, prepared on the server
+
+and reports the median process CPU time and wall time per request of each,
+and the CPU saved against `query`. Load a dataset first:
+
+    python -m benchmarks.generate --dsn $DSN --reset --courses 1000 --users 1000 --rounds 100000
+    python -m benchmarks.statement_bench --dsn $DSN --courses 1000 --users 1000 --rounds 100000
+"""
+import argparse, json, os, random, statistics, sys, time
+from benchmarks.generate import hole_id, round_user, tee_id
+
+MODES = ('query', 'baked', 'prepared')
+
+
+def plain_get(model, id, options=()):
+    return model.query.options(*options).get(id) if id is not None else None
+
+def paths(rng, samples, courses, users, rounds):
+    """The same request paths for every mode, by endpoint"""
+    picked = {'course_detail': [], 'hole_detail': [], 'tee_detail': [], 'round_detail': []}
+    for _ in range(samples):
+        course_id = rng.randint(1, courses)
+        round_id = rng.randint(1, rounds)
+        picked['course_detail'].append(f"/courses/{course_id}")
+        picked['hole_detail'].append(f"/courses/{course_id}/holes/{hole_id(course_id, 1)}")
+        picked['tee_detail'].append(f"/courses/{course_id}/tees/{tee_id(course_id)}")
+        picked['round_detail'].append(f"/users/{round_user(round_id, users)}/rounds/{round_id}")
+    return picked
+
+def measure(dsn, picked, warmup):
+    """Median CPU and wall time per request of every mode and endpoint. The
+    modes take turns request by request, so drift in the machine's load
+    affects them all alike."""
+    from flask_app import create_app, statements
+    cached = statements.get
+    clients = {
+        mode: create_app({
+            'TEST_DB_URI': dsn,
+            'WARMUP_ENABLED': False,
+            'PREPARED_STATEMENTS_ENABLED': mode == 'prepared',
+        }).test_client()
+        for mode in MODES
+    }
+    results = {mode: {} for mode in MODES}
+    try:
+        for endpoint, urls in picked.items():
+            cpu = {mode: [] for mode in MODES}
+            wall = {mode: [] for mode in MODES}
+            for number, url in enumerate(urls):
+                for mode, client in clients.items():
+                    statements.get = plain_get if mode == 'query' else cached
+                    cpu_started, wall_started = time.process_time(), time.perf_counter()
+                    res = client.get(url)
+                    elapsed_cpu = time.process_time() - cpu_started
+                    elapsed_wall = time.perf_counter() - wall_started
+                    if res.status_code != 200:
+                        raise SystemExit(f"GET {url} returned {res.status_code}, load the dataset first.")
+                    if number >= warmup:
+                        cpu[mode].append(elapsed_cpu)
+                        wall[mode].append(elapsed_wall)
+            for mode in MODES:
+                results[mode][endpoint] = {
+                    'cpu_us': round(statistics.median(cpu[mode]) * 1e6, 1),
+                    'wall_us': round(statistics.median(wall[mode]) * 1e6, 1),
+                }
+    finally:
+        statements.get = cached
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dsn', default=os.environ.get('SQLALCHEMY_DATABASE_URI'))
+    parser.add_argument('--samples', type=int, default=2000)
+    parser.add_argument('--warmup', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--courses', type=int, default=50000)
+    parser.add_argument('--users', type=int, default=200000)
+    parser.add_argument('--rounds', type=int, default=20000000)
+    parser.add_argument('--output')
+    args = parser.parse_args(argv)
+    if not args.dsn:
+        parser.error('--dsn or SQLALCHEMY_DATABASE_URI is required')
+
+    picked = paths(random.Random(args.seed), args.samples, args.courses, args.users, args.rounds)
+    modes = measure(args.dsn, picked, args.warmup)
+    for endpoint in picked:
+        baseline = modes['query'][endpoint]['cpu_us']
+        for mode in MODES[1:]:
+            modes[mode][endpoint]['cpu_saved_us'] = round(baseline - modes[mode][endpoint]['cpu_us'], 1)
+    report = {
+        'settings': {
+            'samples': args.samples,
+            'warmup': args.warmup,
+            'seed': args.seed,
+        },
+        'modes': modes,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+
+if __name__ == '__main__':
+    sys.exit(main())
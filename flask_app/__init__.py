@@ -1,27 +1,45 @@
+import time
+IMPORT_STARTED = time.perf_counter()
+
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
 from flask_cors import CORS
-from flask_app.errors import bad_request, not_found, not_authorized
+from flask_app.config import env_flag
+from flask_app.routing import RoutingSQLAlchemy
+from flask_app.errors import (
+    bad_request, not_found, not_authorized, conflict, unprocessable, service_unavailable
+)
 import os
 
-db = SQLAlchemy()
-migrate = Migrate()
+db = RoutingSQLAlchemy()
 
 def create_app(test_config=None):
     """Initialize flask application"""
+    started = time.perf_counter()
     app = Flask(__name__)
     if test_config: #TODO clean this up 
         app.config["SQLALCHEMY_DATABASE_URI"] = test_config["TEST_DB_URI"]
         app.config["TESTING"] = True
+        app.config.update(
+            {key: value for key, value in test_config.items() if key != "TEST_DB_URI"}
+        )
     else:
         app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get('SQLALCHEMY_DATABASE_URI')
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config.setdefault("MIGRATIONS_ENABLED", env_flag("MIGRATIONS_ENABLED", True))
     db.app = app
     db.init_app(app)
-    migrate.init_app(app, db)
+    if app.config["MIGRATIONS_ENABLED"]:
+        # Alembic is only needed by the `flask db` commands, serving-only
+        # deployments set MIGRATIONS_ENABLED=0 to keep it off the import path.
+        from flask_migrate import Migrate
+        Migrate(app, db)
     CORS(app)
 
+    from flask_app import metrics
+    metrics.init_app(app)
+    from flask_app import admission
+    admission.init_app(app)
+
     @app.after_request
     def after_request(response):
         response.headers.add('Access-Control-Allow-Headers', 'Content-Type, Authorization')
@@ -31,13 +49,46 @@ def create_app(test_config=None):
     app.register_error_handler(404, not_found)
     app.register_error_handler(400, bad_request)
     app.register_error_handler(401, not_authorized)
+    app.register_error_handler(409, conflict)
+    app.register_error_handler(422, unprocessable)
+    app.register_error_handler(503, service_unavailable)
 
-    from flask_app.course_views import course_bp
+    from flask_app.course_views import course_bp, tee_bp
     app.register_blueprint(course_bp)
+    app.register_blueprint(tee_bp)
     from flask_app.user_views import user_bp
     app.register_blueprint(user_bp)
+    from flask_app.event_views import event_bp
+    app.register_blueprint(event_bp)
+    from flask_app.competition_views import competition_bp
+    app.register_blueprint(competition_bp)
+    from flask_app.sync_views import sync_bp
+    app.register_blueprint(sync_bp)
+
+    from flask_app import (
+        changes, idempotency, leaderboard, partitions, profiling, repository, shards,
+        similarity, sketches, slow_queries, snapshot, statements, stats
+    )
+    changes.init_app(app)
+    idempotency.init_app(app)
+    leaderboard.init_app(app)
+    partitions.init_app(app)
+    profiling.init_app(app)
+    repository.init_app(app)
+    shards.init_app(app)
+    similarity.init_app(app)
+    sketches.init_app(app)
+    slow_queries.init_app(app)
+    snapshot.init_app(app)
+    statements.init_app(app)
+    stats.init_app(app)
+
+    from flask_app import warmup
+    warmup.init_app(app, IMPORT_SECONDS, time.perf_counter() - started)
 
     return app
 
+IMPORT_SECONDS = time.perf_counter() - IMPORT_STARTED
+
 
     
\ No newline at end of file
@@ -0,0 +1,191 @@
+"""Admission control in front of the database pool.
+
+Requests are admitted into one of two budgets, read (GET, HEAD, OPTIONS)
+and write (everything else), each a concurrency limit with a bounded queue
+of waiting requests. By default the two limits split the pool's capacity,
+pool_size + max_overflow, two thirds to reads and one third to writes, so
+a burst of round submissions cannot take the connections cheap reads need.
+ADMISSION_ENDPOINT_LIMITS adds tighter limits for single endpoints, e.g.
+
+    ADMISSION_ENDPOINT_LIMITS="users.retrieve_rounds=4,courses.hole_detail=8"
+
+A request that finds its queue full, waits longer than
+ADMISSION_QUEUE_TIMEOUT_MS for a slot, or is admitted while every pooled
+connection is checked out anyway (by background work, say) is answered at
+once with 503 and a Retry-After header rather than waiting for a connection.
+With sharding that check covers the pool of the database the request will
+use: a /users/<id> request the default pool and its user's shard, any other
+request every pool, since it may gather from or write to each shard.
+"""
+import os, threading, time
+from flask import current_app, g, request
+from sqlalchemy.pool import QueuePool
+from werkzeug.exceptions import ServiceUnavailable
+from flask_app import db, shards
+from flask_app.config import env_flag, env_int
+from flask_app.metrics import (
+    ADMISSION_IN_FLIGHT, ADMISSION_QUEUED, ADMISSION_REJECTED, ADMISSION_WAIT
+)
+
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+EXEMPT_ENDPOINTS = ('metrics.metrics', 'static')
+
+
+class Budget(object):
+    """A concurrency limit with a bounded queue of waiting requests"""
+
+    def __init__(self, name, limit, queue_size):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.in_flight = 0
+        self.waiting = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, timeout):
+        """Take a slot, waiting at most timeout seconds for one. Returns None
+        once admitted, otherwise why the request was turned away."""
+        with self._condition:
+            if self.in_flight < self.limit and not self.waiting:
+                self._admit()
+                return None
+            if self.waiting >= self.queue_size:
+                return 'queue_full'
+            self.waiting += 1
+            ADMISSION_QUEUED.labels(self.name).set(self.waiting)
+            deadline = time.monotonic() + timeout
+            try:
+                while self.in_flight >= self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return 'timeout'
+                    self._condition.wait(remaining)
+                self._admit()
+                return None
+            finally:
+                self.waiting -= 1
+                ADMISSION_QUEUED.labels(self.name).set(self.waiting)
+
+    def _admit(self):
+        self.in_flight += 1
+        ADMISSION_IN_FLIGHT.labels(self.name).set(self.in_flight)
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            ADMISSION_IN_FLIGHT.labels(self.name).set(self.in_flight)
+            self._condition.notify()
+
+
+def pool_capacity(pool):
+    """Most connections the pool will hand out at once, None if unbounded"""
+    if not isinstance(pool, QueuePool) or pool._max_overflow < 0:
+        return None
+    return pool.size() + pool._max_overflow
+
+def pool_saturated(pool):
+    capacity = pool_capacity(pool)
+    return capacity is not None and pool.checkedout() >= capacity
+
+def parse_limits(value):
+    """Endpoint limits from "endpoint=limit,endpoint=limit" """
+    limits = {}
+    for item in filter(None, (part.strip() for part in (value or '').split(','))):
+        endpoint, limit = item.split('=')
+        limits[endpoint.strip()] = int(limit)
+    return limits
+
+
+class AdmissionController(object):
+    """The read, write and per endpoint budgets of one application"""
+
+    def __init__(self, config, capacity):
+        queue_size = config['ADMISSION_QUEUE_SIZE']
+        capacity = capacity or 15
+        write_limit = config['ADMISSION_WRITE_CONCURRENCY'] or max(capacity // 3, 1)
+        read_limit = config['ADMISSION_READ_CONCURRENCY'] or max(capacity - write_limit, 1)
+        self.timeout = config['ADMISSION_QUEUE_TIMEOUT_MS'] / 1000
+        self.retry_after = config['ADMISSION_RETRY_AFTER_SECONDS']
+        self.budgets = {
+            'read': Budget('read', read_limit, queue_size),
+            'write': Budget('write', write_limit, queue_size),
+        }
+        self.endpoint_budgets = {
+            endpoint: Budget(endpoint, limit, queue_size)
+            for endpoint, limit in config['ADMISSION_ENDPOINT_LIMITS'].items()
+        }
+
+    def budgets_for(self, endpoint, method):
+        budgets = [self.budgets['read' if method in READ_METHODS else 'write']]
+        if endpoint in self.endpoint_budgets:
+            budgets.insert(0, self.endpoint_budgets[endpoint])
+        return budgets
+
+    def admit(self, endpoint, method, pools):
+        """Acquire every budget the request needs within one deadline, and
+        return them. Raises ServiceUnavailable when the request is shed."""
+        started = time.monotonic()
+        admitted = []
+        for budget in self.budgets_for(endpoint, method):
+            remaining = self.timeout - (time.monotonic() - started)
+            reason = budget.acquire(max(remaining, 0))
+            ADMISSION_WAIT.labels(budget.name).observe(time.monotonic() - started)
+            if reason is not None:
+                self.release(admitted)
+                self.reject(budget, reason)
+            admitted.append(budget)
+        if any(pool_saturated(pool) for pool in pools):
+            self.release(admitted)
+            self.reject(admitted[-1], 'pool_saturated')
+        return admitted
+
+    def reject(self, budget, reason):
+        ADMISSION_REJECTED.labels(budget.name, reason).inc()
+        raise ServiceUnavailable(
+            f"Too many concurrent requests ({reason}), retry shortly.",
+            retry_after=self.retry_after
+        )
+
+    def release(self, budgets):
+        for budget in budgets:
+            budget.release()
+
+
+def request_pools():
+    """Pools the request may check connections out of"""
+    names = shards.names()
+    user_id = (request.view_args or {}).get('id') if request.blueprint == 'users' else None
+    if names and user_id is not None:
+        names = [shards.shard_for(user_id)]
+    return [db.engine.pool] + [db.get_engine(bind=name).pool for name in names]
+
+def _admit():
+    endpoint = request.endpoint
+    if endpoint is None or endpoint in EXEMPT_ENDPOINTS:
+        return
+    controller = current_app.extensions['admission']
+    g.admitted = controller.admit(endpoint, request.method, request_pools())
+
+def _release(exception):
+    admitted = g.pop('admitted', None)
+    if admitted:
+        current_app.extensions['admission'].release(admitted)
+
+def init_app(app):
+    """Put the admission budgets in front of every request"""
+    app.config.setdefault('ADMISSION_ENABLED', env_flag('ADMISSION_ENABLED', True))
+    app.config.setdefault('ADMISSION_READ_CONCURRENCY', env_int('ADMISSION_READ_CONCURRENCY', 0))
+    app.config.setdefault('ADMISSION_WRITE_CONCURRENCY', env_int('ADMISSION_WRITE_CONCURRENCY', 0))
+    app.config.setdefault('ADMISSION_QUEUE_SIZE', env_int('ADMISSION_QUEUE_SIZE', 32))
+    app.config.setdefault('ADMISSION_QUEUE_TIMEOUT_MS', env_int('ADMISSION_QUEUE_TIMEOUT_MS', 500))
+    app.config.setdefault('ADMISSION_RETRY_AFTER_SECONDS', env_int('ADMISSION_RETRY_AFTER_SECONDS', 1))
+    app.config.setdefault(
+        'ADMISSION_ENDPOINT_LIMITS', parse_limits(os.environ.get('ADMISSION_ENDPOINT_LIMITS'))
+    )
+    if not app.config['ADMISSION_ENABLED']:
+        return
+    with app.app_context():
+        capacity = pool_capacity(db.engine.pool)
+    app.extensions['admission'] = AdmissionController(app.config, capacity)
+    app.before_request(_admit)
+    app.teardown_request(_release)
@@ -0,0 +1,76 @@
+"""Change log behind the /sync delta feed.
+
+Every course, hole, tee, yardage and round a flush creates, modifies or
+deletes is noted, and the notes are written with one insert per log table
+just before the transaction commits, so an entry exists exactly when its
+change does. Statements that bypass the ORM, like the hole score UPDATE,
+call round_changed() themselves.
+
+Log ids come from a sequence and so are not in commit order: a transaction
+can take id 10 and commit before the one holding id 9. Each entry also
+stores its transaction's txid_current(), and readers only return entries
+of transactions older than the oldest one still running, walking them in
+(txid, id) order. Everything below that horizon has finished, so a cursor
+never moves past an entry that commits later. A long running transaction
+holds the feed back until it ends.
+"""
+from sqlalchemy import event, inspect
+from flask_app import db, shards
+from flask_app.models import ChangeLog, RoundChange
+from flask_app.routing import RoutingSession
+
+TRACKED = ('courses', 'holes', 'tees', 'yardages')
+UPSERT = 'upsert'
+DELETE = 'delete'
+
+
+def entity_key(instance):
+    """Primary key of a row as stored in the log, e.g. "3" or "3:7" """
+    values = inspect(instance).mapper.primary_key_from_instance(instance)
+    return ':'.join(str(value) for value in values)
+
+def pending(session):
+    return session.info.setdefault('changes', {'reference': [], 'rounds': []})
+
+def round_changed(round_id, user_id, op=UPSERT):
+    """Log a change to a round made without the ORM"""
+    pending(db.session)['rounds'].append({'round_id': round_id, 'user_id': user_id, 'op': op})
+
+def _collect(session, flush_context):
+    modified = [
+        instance for instance in session.dirty
+        if session.is_modified(instance, include_collections=False)
+    ]
+    changes = pending(session)
+    for instances, op in ((session.new, UPSERT), (modified, UPSERT), (session.deleted, DELETE)):
+        for instance in instances:
+            name = instance.__table__.name
+            if name in TRACKED:
+                changes['reference'].append({'entity': name, 'key': entity_key(instance), 'op': op})
+            elif name == 'rounds':
+                changes['rounds'].append(
+                    {'round_id': instance.id, 'user_id': instance.user_id, 'op': op}
+                )
+
+def _write(session):
+    session.flush()
+    changes = session.info.pop('changes', None)
+    if not changes:
+        return
+    if changes['reference']:
+        session.execute(ChangeLog.__table__.insert(), changes['reference'])
+    by_shard = {}
+    for change in changes['rounds']:
+        by_shard.setdefault(shards.shard_for(change['user_id']), []).append(change)
+    for shard, rows in by_shard.items():
+        with shards.routed(shard):
+            session.execute(RoundChange.__table__.insert(), rows)
+
+def _forget(session, previous_transaction):
+    session.info.pop('changes', None)
+
+def init_app(app):
+    if not event.contains(RoutingSession, 'after_flush', _collect):
+        event.listen(RoutingSession, 'after_flush', _collect)
+        event.listen(RoutingSession, 'before_commit', _write)
+        event.listen(RoutingSession, 'after_soft_rollback', _forget)
@@ -0,0 +1,226 @@
+import math
+import numpy as np
+from flask import Blueprint, jsonify, request, abort
+from flask_app.models import Hole, Round, Tee, User
+from flask_app import db, scoring, shards
+from flask_app.handicap import handicap_indexes, playing_handicaps
+from flask_app.loaders import fetch_by_ids, id_in
+from sqlalchemy import func
+
+MAX_ENTRIES = 1000
+MAX_ROUNDS = 5000
+competition_bp = Blueprint('competitions', __name__, url_prefix='/competitions')
+
+def tee_ratings(tee_ids):
+    """Rating, slope and course par of each tee in a single query"""
+    course_par = db.session.query(func.sum(Hole.par)).filter(
+        Hole.course_id == Tee.course_id
+    ).correlate(Tee).as_scalar().label('par')
+    rows = db.session.query(
+        Tee.id, Tee.course_id, Tee.course_rating, Tee.slope_rating, course_par
+    ).filter(id_in(Tee.id, list(dict.fromkeys(tee_ids))))
+    return {row.id: row for row in rows}
+
+def parse_entries(data):
+    entries = data.get('entries')
+    if not isinstance(entries, list) or not entries:
+        abort(400, "entries must be a list of user_id and tee_id pairs.")
+    if len(entries) > MAX_ENTRIES:
+        abort(400, f"At most {MAX_ENTRIES} entries may be given at once.")
+    pairs = []
+    for entry in entries:
+        user_id = entry.get('user_id') if isinstance(entry, dict) else None
+        tee_id = entry.get('tee_id') if isinstance(entry, dict) else None
+        if not isinstance(user_id, int) or not isinstance(tee_id, int):
+            abort(400, "Every entry needs an integer user_id and tee_id.")
+        pairs.append((user_id, tee_id))
+    return pairs
+
+def optional(value):
+    return None if math.isnan(value) else int(value)
+
+@competition_bp.route('/handicaps', methods=["POST"])
+def competition_handicaps():
+    """Course and playing handicaps for a field, e.g. {"allowance": 95,
+    "entries": [{"user_id": 1, "tee_id": 3}, ...]}. Users, handicap indexes
+    and tee ratings with course pars are each loaded with one query."""
+    data = request.get_json(force=True)
+    if not isinstance(data, dict):
+        abort(400, "The request body must be a JSON object.")
+    allowance = data.get('allowance', 100)
+    if not isinstance(allowance, (int, float)) or not 0 < allowance <= 100:
+        abort(400, "allowance must be a percentage between 0 and 100.")
+    pairs = parse_entries(data)
+    users = shards.gather(
+        lambda ids: fetch_by_ids(User, ids), [user_id for user_id, tee_id in pairs]
+    )
+    tees = tee_ratings([tee_id for user_id, tee_id in pairs])
+    missing_users = sorted({user_id for user_id, tee_id in pairs if user_id not in users})
+    missing_tees = sorted({tee_id for user_id, tee_id in pairs if tee_id not in tees})
+    if missing_users or missing_tees:
+        abort(400, f"Unknown users: {missing_users}, unknown tees: {missing_tees}.")
+    indexes = handicap_indexes(users.keys())
+    course, playing = playing_handicaps(
+        [indexes[user_id] for user_id, tee_id in pairs],
+        [tees[tee_id].slope_rating for user_id, tee_id in pairs],
+        [tees[tee_id].course_rating for user_id, tee_id in pairs],
+        [tees[tee_id].par for user_id, tee_id in pairs],
+        allowance
+    )
+    return jsonify({
+        'allowance': allowance,
+        'entries': [
+            {
+                'user_id': user_id,
+                'name': users[user_id].name,
+                'tee_id': tee_id,
+                'handicap_index': indexes[user_id],
+                'course_handicap': optional(course_handicap),
+                'playing_handicap': optional(playing_handicap)
+            }
+            for (user_id, tee_id), course_handicap, playing_handicap in zip(pairs, course, playing)
+        ]
+    }), 200
+
+def parse_scoring(data):
+    """Round ids, handicaps given by round id and match pairs of a scoring
+    request"""
+    round_ids = data.get('round_ids')
+    if not isinstance(round_ids, list) or not round_ids or not all(type(id) is int for id in round_ids):
+        abort(400, "round_ids must be a list of round ids.")
+    if len(round_ids) > MAX_ROUNDS:
+        abort(400, f"At most {MAX_ROUNDS} rounds may be scored at once.")
+    if len(set(round_ids)) != len(round_ids):
+        abort(400, "round_ids must not repeat a round.")
+    handicaps = data.get('handicaps', {})
+    try:
+        handicaps = {int(id): value for id, value in handicaps.items()}
+    except (AttributeError, ValueError):
+        handicaps = None
+    if handicaps is None or not all(type(value) is int for value in handicaps.values()):
+        abort(400, "handicaps must map round ids to playing handicaps.")
+    matches = data.get('matches', [])
+    if not isinstance(matches, list) or not all(
+        isinstance(match, list) and len(match) == 2 and match[0] != match[1]
+        and all(id in round_ids for id in match)
+        for match in matches
+    ):
+        abort(400, "matches must be pairs of two of the round ids.")
+    return round_ids, handicaps, matches
+
+def load_rounds(round_ids):
+    """Rounds by id with only the columns scoring needs, from every shard"""
+    rounds = {}
+    for shard in shards.each():
+        rows = db.session.query(
+            Round.id, Round.user_id, Round.course_id, Round.tee_id, Round.score_by_hole
+        ).filter(id_in(Round.id, round_ids))
+        rounds.update((row.id, row) for row in rows)
+    return rounds
+
+def field_handicaps(rounds, given, allowance):
+    """Playing handicap of each round, the given one or else worked out from
+    the player's handicap index and the tee played, 0 without an index or
+    tee ratings"""
+    handicaps = np.array([given.get(row.id, 0) for row in rounds], dtype=int)
+    needed = [number for number, row in enumerate(rounds) if row.id not in given]
+    if not needed:
+        return handicaps
+    indexes = handicap_indexes([rounds[number].user_id for number in needed])
+    tees = tee_ratings([rounds[number].tee_id for number in needed])
+    rated = [tees.get(rounds[number].tee_id) for number in needed]
+    course, playing = playing_handicaps(
+        [indexes.get(rounds[number].user_id) for number in needed],
+        [tee.slope_rating if tee else None for tee in rated],
+        [tee.course_rating if tee else None for tee in rated],
+        [tee.par if tee else None for tee in rated],
+        allowance
+    )
+    handicaps[needed] = np.nan_to_num(playing)
+    return handicaps
+
+@competition_bp.route('/scores', methods=["POST"])
+def competition_scores():
+    """Gross, net, Stableford, skins and match play results for a field of
+    rounds on one course, e.g. {"round_ids": [1, 2, 3], "allowance": 95,
+    "handicaps": {"3": 12}, "matches": [[1, 2]]}. Playing handicaps not given
+    are worked out from the players' handicap indexes."""
+    data = request.get_json(force=True)
+    if not isinstance(data, dict):
+        abort(400, "The request body must be a JSON object.")
+    allowance = data.get('allowance', 100)
+    if not isinstance(allowance, (int, float)) or not 0 < allowance <= 100:
+        abort(400, "allowance must be a percentage between 0 and 100.")
+    round_ids, given, matches = parse_scoring(data)
+    found = load_rounds(round_ids)
+    missing = [id for id in round_ids if id not in found]
+    if missing:
+        abort(400, f"Unknown rounds: {missing}.")
+    rounds = [found[id] for id in round_ids]
+    if len({row.course_id for row in rounds}) != 1:
+        abort(400, "All rounds must be played on the same course.")
+    if len({len(row.score_by_hole) for row in rounds}) != 1:
+        abort(400, "All rounds must have the same number of holes.")
+    course_id, hole_count = rounds[0].course_id, len(rounds[0].score_by_hole)
+    if not hole_count:
+        abort(400, "Rounds without any holes cannot be scored.")
+    holes = Hole.query.filter(Hole.course_id == course_id, Hole.number <= hole_count).order_by(Hole.number).all()
+    if [hole.number for hole in holes] != list(range(1, hole_count + 1)):
+        abort(400, f"Course with id: {course_id} does not have holes 1 to {hole_count}.")
+
+    handicaps = field_handicaps(rounds, given, allowance)
+    stroke_indexes = [hole.stroke_index for hole in holes]
+    if None in stroke_indexes:
+        if handicaps.any():
+            abort(400, "Every hole needs a stroke_index to give handicap strokes.")
+        stroke_indexes = [hole.number for hole in holes]
+    pars = np.array([hole.par for hole in holes])
+    scores = scoring.score_matrix([row.score_by_hole for row in rounds])
+    strokes = scoring.strokes_received(handicaps, stroke_indexes)
+    net = scores - strokes
+    gross, played = scoring.totals(scores)
+    net_total, _ = scoring.totals(net)
+    par_played = np.where(np.isnan(scores), 0, pars[None, :]).sum(axis=1)
+    points = scoring.stableford(scores, pars, strokes)
+    skins, won, carried = scoring.skins(net)
+    position = {id: number for number, id in enumerate(round_ids)}
+    first = [position[a] for a, b in matches]
+    second = [position[b] for a, b in matches]
+    margins, left = scoring.match_play(net[first], net[second])
+
+    return jsonify({
+        'course_id': course_id,
+        'holes': hole_count,
+        'allowance': allowance,
+        'players': [
+            {
+                'round_id': row.id,
+                'user_id': row.user_id,
+                'tee_id': row.tee_id,
+                'playing_handicap': int(handicaps[number]),
+                'thru': int(played[number]),
+                'gross': int(gross[number]),
+                'net': int(net_total[number]),
+                'to_par': int(gross[number] - par_played[number]),
+                'net_to_par': int(net_total[number] - par_played[number]),
+                'stableford': int(points[number]),
+                'skins': int(skins[number]),
+            }
+            for number, row in enumerate(rounds)
+        ],
+        'skins': {
+            'won': [
+                {'hole': hole + 1, 'round_id': round_ids[winner], 'skins': value}
+                for hole, winner, value in won
+            ],
+            'carried': carried,
+        },
+        'matches': [
+            {
+                'round_ids': [a, b],
+                'winner': None if margin == 0 else (a if margin > 0 else b),
+                'result': scoring.match_result(int(margin), int(holes_left)),
+            }
+            for (a, b), margin, holes_left in zip(matches, margins.tolist(), left.tolist())
+        ],
+    }), 200
@@ -1,36 +1,42 @@
 from flask import Blueprint, jsonify, request, abort, Response, url_for
-from flask_app.models import Course, Hole, Yardage, Tee
-from flask_app import db
-from sqlalchemy.exc import DBAPIError
+from flask_app.models import Course, Tee
+from flask_app import leaderboard, similarity, sketches
+from flask_app.idempotency import idempotent
+from flask_app.loaders import ordered_batch, parse_ids, parse_include
+from flask_app.repository import RepositoryError, repository
 import traceback
 
 PAGE_SIZE = 10
 course_bp = Blueprint('courses', __name__, url_prefix='/courses')
+tee_bp = Blueprint('tees', __name__, url_prefix='/tees')
 
 @course_bp.route('', methods=["POST", "GET"])
+@idempotent
 def retrieve_courses():
     """Endpoint for courses, GET will return all courses in db by default,
-    POST allows user to add a course to the database."""
+    or the courses listed in ?ids=1,2,3 with a single query, POST allows
+    user to add a course to the database, retries sending the same
+    Idempotency-Key header get the first response back."""
     if request.method == 'POST':
         data = request.get_json(force=True)
         try:
-            new_course = Course(**data)
-            db.session.add(new_course)
-            db.session.commit()
-        except DBAPIError as ex:
-            db.session.rollback() 
+            course_id = repository().create_course(data)
+        except RepositoryError as ex:
             abort(400, str(ex))
         return Response(
-            headers={'Location': url_for('courses.course_detail', id=new_course.id)},
+            headers={'Location': url_for('courses.course_detail', id=course_id)},
             status=201
         )
 
     if request.method == 'GET':
+        if 'ids' in request.args:
+            ids = parse_ids(request.args['ids'])
+            courses = repository().courses_by_ids(ids)
+            return jsonify(ordered_batch(ids, courses, Course.detail_format)), 200
         page = request.args.get('page', 1, type=int)
         start = PAGE_SIZE * (page - 1)
-        end = start + PAGE_SIZE 
-        courses = Course.query.all()
-        formatted_courses = [course.format() for course in courses[start:end]]
+        courses = repository().list_courses(start, PAGE_SIZE)
+        formatted_courses = [course.format() for course in courses]
         return jsonify(formatted_courses), 200
 
 @course_bp.route('/<int:id>', methods=["GET", "PATCH"])
@@ -38,7 +44,7 @@ def course_detail(id):
     """Course detail endpoint, retrieve data for course with GET, update 
     course with PATCH"""
     if request.method == 'GET':
-        course = Course.query.get(id)
+        course = repository().get_course(id)
         if course:
             return jsonify(course.detail_format()), 200
         abort(404, f"Course with id: {id} does not exist.")
@@ -48,10 +54,11 @@ def course_detail(id):
         
 @course_bp.route('/<int:id>/holes', methods=["GET", "POST"])
 def retrieve_holes(id):
-    """Retrieves holes for course with given id, you can also add holes
+    """Retrieves holes for course with given id, ?include=yardages embeds each
+    hole's yardages using one query for the whole course, you can also add holes
     for a course with a POST request, one at a time, or in bulk."""
 
-    course = Course.query.get(id)
+    course = repository().get_course(id)
     if not course:
         return abort(404, f"Course with id: {id}, does not exist.")
 
@@ -61,45 +68,43 @@ def retrieve_holes(id):
                 404,
                 "No holes for this course currently in the database"
             )
+        include = parse_include(('yardages',))
         formatted_holes = [hole.format() for hole in course.holes]
+        if 'yardages' in include:
+            yardages = repository().yardages_by_hole(course.holes)
+            for hole, hole_dict in zip(course.holes, formatted_holes):
+                hole_dict['tees'] = [yardage.format() for yardage in yardages[hole.id]]
         return jsonify(formatted_holes), 200
         
     if request.method == 'POST':
         data = request.get_json(force=True)
+        tees_by_colour = {tee.colour: tee for tee in course.tees}
+        items = []
         for hole_item in data:
-            try:
-                tees_list = []
-                if 'tees' in hole_item.keys():
-                    tees_list = hole_item.pop('tees')
-                hole = Hole(course=course, **hole_item)
-                db.session.add(hole)
-                for tee_item in tees_list:
-                    tee = Tee.query.filter_by(course=course, colour=tee_item['colour']).first()
-                    yardage = Yardage(hole=hole, tee=tee, yardage=tee_item['yardage'])
-                    db.session.add(yardage)
-            except DBAPIError as ex:
-                db.session.rollback()
-                abort(400, f"""The following exception was 
-                    raise while attempting to add holes to the database.
-                    {str(ex)}""")
+            tees_list = []
+            if 'tees' in hole_item.keys():
+                tees_list = hole_item.pop('tees')
+            items.append((hole_item, [
+                (tees_by_colour.get(tee_item['colour']), tee_item['yardage'])
+                for tee_item in tees_list
+            ]))
         try:
-            db.session.commit()
-        except DBAPIError as ex:
-            db.session.rollback()
+            repository().create_holes(course, items)
+        except RepositoryError as ex:
             abort(400, f"""The following exception was 
                 raise while attempting to add holes to the database.
                 {str(ex)}""")
-        
+        leaderboard.registry().discard_course(id)
         return Response(headers={'Location': url_for('courses.retrieve_holes', id=id)}, status=201)
 
 @course_bp.route('/<int:id>/holes/<int:hole_id>', methods=["GET", "PATCH"])
 def hole_detail(id, hole_id):
     """Endpoint for hole detail, update a hole record with a PATCH request, 
     retrieve course data with a GET request."""
-    course = Course.query.get(id)
+    course = repository().get_course(id)
     if not course:
         abort(404, f"Cource with id: {id} was not found.")
-    hole = Hole.query.get(hole_id)
+    hole = repository().get_hole(hole_id)
     if not hole:
         abort(404, f"Hole with id: {hole_id} was not found.")
         
@@ -110,57 +115,41 @@ def hole_detail(id, hole_id):
     if request.method == "PATCH":
         data = request.get_json(force=True)
         tee_items = data.pop('tees', None)
+        yardages = []
         if tee_items:
+            tees_by_colour = {tee.colour: tee for tee in course.tees}
             for tee_item in tee_items: 
-                tee = Tee.query.filter_by(
-                    course=course,
-                    colour=tee_item['colour']
-                ).first() #TODO handle potential key error
+                tee = tees_by_colour.get(tee_item['colour']) #TODO handle potential key error
                 if not tee:
                     abort(400, "Bad request tee does not exist")
-                yardage = Yardage.query.get((hole.id, tee.id))
-                try:
-                    if not yardage:
-                        yardage = Yardage(tee=tee, hole=hole, yardage=0)
-                    yardage.yardage = tee_item['yardage']
-                    db.session.add(yardage)
-                    db.session.commit()
-                except DBAPIError as ex:
-                    db.session.rollback()
-                    abort(400, f"""The following exception occurred when attempting
-                    to update the hole record in the database. {str(ex)}""")
+                yardages.append((tee, tee_item['yardage']))
                 
         try:
-            for key in data.keys():
-                setattr(hole, key, data[key])
-            db.session.commit()
-        except DBAPIError as ex:
-            db.session.rollback()
+            repository().update_hole(hole, data, yardages)
+        except RepositoryError as ex:
             abort(400, f"""The following exception occurred
                 when attempting to update the hole object: {ex}""")
+        if 'par' in data:
+            leaderboard.registry().discard_course(id)
         return jsonify({}), 201 #TODO something better here 
 
 @course_bp.route("/<int:id>/tees", methods=["GET", "POST"])
 def retrieve_tees(id):
     """Endpoint for the tees of a course, retrieve all tees with a GET, 
     add a new tee to the course with a POST"""
-    course = Course.query.get(id)
+    course = repository().get_course(id)
     if not course:
         abort(404, f"Course with id: {id}, does not exist.")
 
     if request.method == "POST":
         data = request.get_json(force=True)
         try:
-            tee = Tee(course=course, **data)
-            db.session.add(tee)
-            db.session.commit()
-            tee_id = tee.id
-        except DBAPIError as ex:
-            db.session.rollback()
+            tee_id = repository().create_tee(course, data)
+        except RepositoryError as ex:
             abort(400, f"""The following error occurred when attempting 
                 to add the scorecard to the database. {str(ex)}""")
         return Response(
-            headers={'Location': url_for('courses.tee_detail', id=course.id, tee_id=tee_id)},
+            headers={'Location': url_for('courses.tee_detail', id=id, tee_id=tee_id)},
             status=201
         )
 
@@ -175,8 +164,8 @@ def retrieve_tees(id):
 def tee_detail(id, tee_id):
     """Endpoint for tee detail, retrieve detailed tee data with a GET, 
     update tee detail with a PATCH"""
-    course = Course.query.get(id)
-    tee = Tee.query.get(tee_id)
+    course = repository().get_course(id)
+    tee = repository().get_tee(tee_id)
     if not course or not tee:
         abort(404, "Tee does not exist") #TODO a little wonky change tee's primary key probably
     
@@ -188,11 +177,81 @@ def tee_detail(id, tee_id):
         if 'colour' in data.keys():
             abort(400, "Error, you cannot change a tee's colour.")
         try:
-            for key in data.keys():
-                setattr(tee, key, data[key])
-            db.session.commit()
-        except DBAPIError as ex:
-            db.session.rollback()
+            repository().update_tee(tee, data)
+        except RepositoryError as ex:
             abort(400, f"""The following exception occurred
                 when attempting to update the tee object: {ex}""")
-        return jsonify({}), 201 #TODO something better here 
\ No newline at end of file
+        return jsonify({}), 201 #TODO something better here 
+
+def score_sketch(id):
+    """Sketch named by ?tee_id= and ?holes=, merged over every tee of the
+    course when no tee is given"""
+    holes = request.args.get('holes', 18, type=int)
+    if holes not in sketches.HOLE_COUNTS:
+        abort(400, "holes must be 9 or 18.")
+    sketch = sketches.load(id, holes, request.args.get('tee_id', type=int))
+    if not sketch.total:
+        abort(404, f"No completed {holes} hole rounds for course with id: {id}.")
+    return sketch
+
+@course_bp.route('/<int:id>/scores/distribution')
+def score_distribution(id):
+    """Distribution of completed round totals at a course, answered from the
+    stored per tee histograms rather than by scanning rounds"""
+    sketch = score_sketch(id)
+    return jsonify(dict(
+        sketch.format(), course_id=id, tee_id=request.args.get('tee_id', type=int)
+    )), 200
+
+@course_bp.route('/<int:id>/scores/percentile')
+def score_percentile(id):
+    """How a ?score= compares with the completed rounds at a course, e.g.
+    an 82 beating 64% of rounds from the blue tees"""
+    score = request.args.get('score', type=int)
+    if score is None:
+        abort(400, "score is required.")
+    sketch = score_sketch(id)
+    below, ties, above = sketch.rank(score)
+    return jsonify({
+        'course_id': id,
+        'tee_id': request.args.get('tee_id', type=int),
+        'holes': sketch.holes,
+        'score': score,
+        'rounds': sketch.total,
+        'lower': below,
+        'ties': ties,
+        'higher': above,
+        'beats': round(100 * above / sketch.total, 1),
+        'percentile': sketch.percentile(score)
+    }), 200
+
+@course_bp.route('/<int:id>/similar')
+def similar_courses(id):
+    """The ?k= courses most like this one by par, length, ratings and mix of
+    hole pars, closest first, from the in-memory course index"""
+    k = request.args.get('k', similarity.DEFAULT_K, type=int)
+    if not 0 < k <= similarity.MAX_K:
+        abort(400, f"k must be between 1 and {similarity.MAX_K}.")
+    index = similarity.index()
+    index.refresh()
+    nearest = index.nearest([id], k)[0]
+    if nearest is None:
+        abort(404, f"Course with id: {id} does not exist.")
+    courses = repository().courses_by_ids([course_id for course_id, _ in nearest])
+    return jsonify({
+        'course_id': id,
+        'similar': [
+            dict(courses[course_id].format(), distance=round(distance, 4))
+            for course_id, distance in nearest if course_id in courses
+        ]
+    }), 200
+
+@tee_bp.route('', methods=["GET"])
+def retrieve_tees_batch():
+    """Retrieve detailed data for the tees listed in ?ids=1,2,3 with a single
+    query, in the order requested, along with any ids that do not exist."""
+    if 'ids' not in request.args:
+        abort(400, "ids of the tees to retrieve are required.")
+    ids = parse_ids(request.args['ids'])
+    tees = repository().tees_by_ids(ids)
+    return jsonify(ordered_batch(ids, tees, Tee.detail_format)), 200
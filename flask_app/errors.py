@@ -8,4 +8,13 @@ def not_found(msg):
     return msg, 404
 
 def not_authorized(msg):
-    return msg, 401
\ No newline at end of file
+    return msg, 401
+
+def conflict(msg):
+    return msg, 409
+
+def unprocessable(msg):
+    return msg, 422
+
+def service_unavailable(msg):
+    return msg, 503
\ No newline at end of file
@@ -0,0 +1,80 @@
+from flask import Blueprint, jsonify, request, abort, Response, url_for, current_app
+from flask_app.models import Course, Event
+from flask_app import db, leaderboard
+from sqlalchemy.exc import DBAPIError
+
+LEADERBOARD_SIZE = 10
+MAX_LEADERBOARD_SIZE = 100
+event_bp = Blueprint('events', __name__, url_prefix='/events')
+
+def get_event(id):
+    event = Event.query.get(id)
+    if not event:
+        abort(404, f"Event with id: {id} does not exist.")
+    return event
+
+def parse_order():
+    order = request.args.get('order', 'net')
+    if order not in leaderboard.ORDERS:
+        abort(400, f"Cannot order by {order}, choose from: {', '.join(leaderboard.ORDERS)}.")
+    return order
+
+@event_bp.route('', methods=["POST"])
+def create_event():
+    """Add an event, rounds are entered into it with their event_id"""
+    data = request.get_json(force=True)
+    if not Course.query.get(data.get('course_id')):
+        abort(400, "Invalid course data provided.")
+    try:
+        new_event = Event(**data)
+        db.session.add(new_event)
+        db.session.flush()
+        event_id = new_event.id
+        db.session.commit()
+    except (DBAPIError, TypeError) as ex:
+        db.session.rollback()
+        abort(400, f"Error adding event to database. {str(ex)}")
+    return Response(
+        headers={'Location': url_for('events.event_detail', id=event_id)},
+        status=201
+    )
+
+@event_bp.route('/<int:id>')
+def event_detail(id):
+    return jsonify(get_event(id).format()), 200
+
+@event_bp.route('/<int:id>/leaderboard')
+def event_leaderboard(id):
+    """Leaderboard of an event, ?order=net|gross|to_par and ?limit=k return
+    the top k, ?around=<round_id>&radius=r the entries either side of a round."""
+    order = parse_order()
+    board = leaderboard.registry().get(get_event(id))
+    if 'around' in request.args:
+        radius = min(request.args.get('radius', 5, type=int), MAX_LEADERBOARD_SIZE)
+        entries = board.around(order, request.args.get('around', type=int), max(radius, 0))
+        if entries is None:
+            abort(404, f"Round is not part of event with id: {id}.")
+    else:
+        limit = min(request.args.get('limit', LEADERBOARD_SIZE, type=int), MAX_LEADERBOARD_SIZE)
+        entries = board.top(order, max(limit, 0))
+    return jsonify({
+        'event_id': id,
+        'order': order,
+        'version': board.version,
+        'size': len(board),
+        'entries': entries
+    }), 200
+
+@event_bp.route('/<int:id>/leaderboard/stream')
+def event_leaderboard_stream(id):
+    """Server-sent events stream of leaderboard changes, starting with a
+    snapshot of the top ?limit= entries in ?order= order"""
+    order = parse_order()
+    limit = min(request.args.get('limit', LEADERBOARD_SIZE, type=int), MAX_LEADERBOARD_SIZE)
+    board = leaderboard.registry().get(get_event(id))
+    keepalive = current_app.config['LEADERBOARD_KEEPALIVE_SECONDS']
+    return Response(
+        leaderboard.stream(board, order, max(limit, 0), keepalive),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
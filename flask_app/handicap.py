@@ -0,0 +1,106 @@
+import math
+import numpy as np
+from sqlalchemy import func
+from flask_app import db, shards
+from flask_app.loaders import id_in
+from flask_app.models import Round, Tee
+
+RECENT_ROUNDS = 20
+MAX_INDEX = 54.0
+STANDARD_SLOPE = 113
+# number of differentials in the window -> (how many of the lowest are
+# averaged, adjustment added to the average)
+BEST_OF = {
+    3: (1, -2.0), 4: (1, -1.0), 5: (1, 0.0), 6: (2, -1.0), 7: (2, 0.0), 8: (2, 0.0),
+    9: (3, 0.0), 10: (3, 0.0), 11: (3, 0.0), 12: (4, 0.0), 13: (4, 0.0), 14: (4, 0.0),
+    15: (5, 0.0), 16: (5, 0.0), 17: (6, 0.0), 18: (6, 0.0), 19: (7, 0.0), 20: (8, 0.0),
+}
+
+
+def differential(score, course_rating, slope_rating):
+    """Score differential of an 18 hole round"""
+    return (STANDARD_SLOPE / slope_rating) * (score - course_rating)
+
+def course_handicap(index, slope_rating, course_rating, par):
+    """Number of strokes a player with the given handicap index receives
+    playing a course from a tee"""
+    if index is None or not slope_rating or course_rating is None:
+        return 0
+    return int(math.floor(index * slope_rating / STANDARD_SLOPE + (course_rating - par) + 0.5))
+
+def playing_handicaps(indexes, slope_ratings, course_ratings, pars, allowance=100):
+    """Course and playing handicaps for a field of players at once, one array
+    element per player. Missing values are given as None and give nan."""
+    indexes, slope_ratings, course_ratings, pars = (
+        np.array(values, dtype=float)
+        for values in (indexes, slope_ratings, course_ratings, pars)
+    )
+    course = np.floor(indexes * slope_ratings / STANDARD_SLOPE + (course_ratings - pars) + 0.5)
+    playing = np.floor(course * allowance / 100 + 0.5)
+    return course, playing
+
+def handicap_index(differentials):
+    """Handicap index from differentials ordered newest first, the adjusted
+    average of the lowest of the most recent 20, None below 3 rounds"""
+    recent = sorted(differentials[:RECENT_ROUNDS])
+    if len(recent) not in BEST_OF:
+        return None
+    used, adjustment = BEST_OF[len(recent)]
+    return min(round(sum(recent[:used]) / used + adjustment, 1), MAX_INDEX)
+
+def what_if(differentials, candidates):
+    """Handicap index after adding each candidate differential to the window,
+    evaluated for all candidates at once, None while the window would still
+    be too short for an index.
+
+    The new round pushes the oldest out of a full window, which leaves the
+    same base of kept differentials for every candidate. With the base sorted
+    and its prefix sums taken, the lowest n of base + candidate are the n-1
+    lowest of the base and the candidate when it sorts among them, otherwise
+    the n lowest of the base."""
+    candidates = np.asarray(candidates, dtype=float)
+    base = np.sort(np.asarray(differentials[:RECENT_ROUNDS - 1], dtype=float))
+    if len(base) + 1 not in BEST_OF:
+        return [None] * len(candidates)
+    used, adjustment = BEST_OF[len(base) + 1]
+    prefix = np.concatenate(([0.0], np.cumsum(base)))
+    best = np.where(
+        np.searchsorted(base, candidates) < used, prefix[used - 1] + candidates, prefix[used]
+    )
+    return np.minimum(np.round(best / used + adjustment, 1), MAX_INDEX).tolist()
+
+def recent_differentials(user_ids, limit=RECENT_ROUNDS):
+    """Differentials of the most recent completed 18 hole rounds of each user,
+    newest first, loaded with a single query"""
+    recent = func.row_number().over(
+        partition_by=Round.user_id,
+        order_by=(Round.date.desc(), Round.id.desc())
+    ).label('recent')
+    ranked = db.session.query(
+        Round.user_id, Round.score_by_hole, Tee.course_rating, Tee.slope_rating, recent
+    ).join(Tee, Round.tee_id == Tee.id).filter(
+        id_in(Round.user_id, user_ids),
+        func.cardinality(Round.score_by_hole) == 18,
+        func.array_position(Round.score_by_hole, db.cast(None, db.Integer)).is_(None),
+        Tee.course_rating.isnot(None),
+        Tee.slope_rating.isnot(None)
+    ).subquery()
+    rows = db.session.query(ranked).filter(ranked.c.recent <= limit).order_by(
+        ranked.c.user_id, ranked.c.recent
+    )
+    differentials = {id: [] for id in user_ids}
+    for row in rows:
+        differentials[row.user_id].append(
+            differential(sum(row.score_by_hole), row.course_rating, row.slope_rating)
+        )
+    return differentials
+
+def handicap_indexes(user_ids):
+    """Handicap index of each user, None for users without a completed round"""
+    user_ids = list(dict.fromkeys(user_ids))
+    if not user_ids:
+        return {}
+    return {
+        user_id: handicap_index(differentials)
+        for user_id, differentials in shards.gather(recent_differentials, user_ids).items()
+    }
@@ -0,0 +1,141 @@
+"""Idempotency-Key support for the create endpoints.
+
+A client retrying a POST sends the same Idempotency-Key header with it.
+The first request claims the key and runs; its response is stored for
+IDEMPOTENCY_TTL_SECONDS and every retry gets that response back, marked
+with Idempotent-Replayed, from a single primary key lookup without the view
+running again. Keys are scoped to the request path.
+
+    same key, request still running   409, retry shortly
+    same key, different body          422
+    view failed (an abort or a 5xx)   nothing is stored, the retry runs again
+
+The claim is an INSERT ... ON CONFLICT committed before the view runs, so
+of two concurrent requests with one key only one runs the view. A claim
+left behind by a crashed process can be taken over after
+IDEMPOTENCY_LOCK_SECONDS. Expired keys are removed by
+
+    flask idempotency purge
+
+run daily, e.g. from cron.
+"""
+import datetime, functools, hashlib
+import click
+from flask import current_app, request, abort, Response
+from flask.cli import AppGroup
+from sqlalchemy.dialects.postgresql import insert
+from flask_app import db, statements
+from flask_app.config import env_flag, env_int
+from flask_app.models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+# response headers kept with the stored response
+STORED_HEADERS = ('Location', 'Content-Type')
+
+idempotency_cli = AppGroup('idempotency', help="Manage stored idempotent responses.")
+
+
+def digest(*parts):
+    value = hashlib.sha256()
+    for part in parts:
+        value.update(part if isinstance(part, bytes) else part.encode())
+        value.update(b'\n')
+    return value.hexdigest()
+
+def claim(key, fingerprint, now):
+    """Take the key for this request, True unless another request holds it"""
+    table = IdempotencyKey.__table__
+    lock = datetime.timedelta(seconds=current_app.config['IDEMPOTENCY_LOCK_SECONDS'])
+    statement = insert(table).values(
+        key=key, fingerprint=fingerprint, created_at=now,
+        expires_at=now + datetime.timedelta(seconds=current_app.config['IDEMPOTENCY_TTL_SECONDS'])
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=['key'],
+        set_={
+            'fingerprint': statement.excluded.fingerprint,
+            'status': None, 'headers': None, 'body': None,
+            'created_at': statement.excluded.created_at,
+            'expires_at': statement.excluded.expires_at,
+        },
+        # only expired keys and abandoned claims are taken over
+        where=(table.c.expires_at <= now) | (table.c.status.is_(None) & (table.c.created_at <= now - lock))
+    ).returning(table.c.key)
+    claimed = db.session.execute(statement).first() is not None
+    db.session.commit()
+    return claimed
+
+def release(key):
+    db.session.rollback()
+    IdempotencyKey.query.filter_by(key=key, status=None).delete()
+    db.session.commit()
+
+def store(key, response):
+    IdempotencyKey.query.filter_by(key=key).update({
+        'status': response.status_code,
+        'headers': {name: response.headers[name] for name in STORED_HEADERS if name in response.headers},
+        'body': response.get_data(),
+    })
+    db.session.commit()
+
+def replay(row):
+    response = Response(row.body, status=row.status, headers=row.headers or {})
+    response.headers[REPLAYED_HEADER] = 'true'
+    return response
+
+def in_progress():
+    abort(409, f"A request with this {HEADER} is still being processed, retry shortly.")
+
+def idempotent(view):
+    """Replay the stored response to POST requests repeating an
+    Idempotency-Key instead of running view again"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        header = request.headers.get(HEADER)
+        if request.method != 'POST' or header is None or not current_app.config['IDEMPOTENCY_ENABLED']:
+            return view(*args, **kwargs)
+        if not header or len(header) > MAX_KEY_LENGTH:
+            abort(400, f"{HEADER} must be 1 to {MAX_KEY_LENGTH} characters.")
+        key = digest(request.path, header)
+        fingerprint = digest(request.method, request.path, request.get_data())
+        now = datetime.datetime.utcnow()
+        row = statements.get(IdempotencyKey, key)
+        if row is not None and row.expires_at > now:
+            if row.fingerprint != fingerprint:
+                abort(422, f"This {HEADER} was already used with a different request.")
+            if row.status is not None:
+                return replay(row)
+        if not claim(key, fingerprint, now):
+            in_progress()
+        try:
+            response = current_app.make_response(view(*args, **kwargs))
+        except BaseException:
+            release(key)
+            raise
+        if response.status_code >= 500:
+            release(key)
+        else:
+            store(key, response)
+        return response
+    return wrapper
+
+def purge():
+    """Delete the expired keys, returning how many there were"""
+    removed = IdempotencyKey.query.filter(
+        IdempotencyKey.expires_at <= datetime.datetime.utcnow()
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return removed
+
+@idempotency_cli.command('purge')
+def purge_command():
+    """Delete expired idempotency keys."""
+    click.echo(f"Removed {purge()} expired idempotency keys.")
+
+def init_app(app):
+    app.config.setdefault('IDEMPOTENCY_ENABLED', env_flag('IDEMPOTENCY_ENABLED', True))
+    app.config.setdefault('IDEMPOTENCY_TTL_SECONDS', env_int('IDEMPOTENCY_TTL_SECONDS', 24 * 60 * 60))
+    app.config.setdefault('IDEMPOTENCY_LOCK_SECONDS', env_int('IDEMPOTENCY_LOCK_SECONDS', 60))
+    app.cli.add_command(idempotency_cli)
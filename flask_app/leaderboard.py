@@ -0,0 +1,310 @@
+"""In-memory event leaderboards.
+
+Each event's standings are kept in one sorted list per ordering, so a hole
+score moves a single entry (two bisections and a list shift) instead of
+re-ranking every round of the event. Boards are built lazily from the
+database the first time an event is read and then updated in place by the
+round endpoints of the same process. Subscribers receive every change
+through a bounded queue, which the server-sent events endpoint drains. A
+board dropped to be rebuilt sends its subscribers a final reset event, so
+their clients reconnect to the new board.
+
+Boards live in the memory of one process, deployments running several
+workers should route an event's writes and streams to the same worker.
+"""
+import json, queue, threading
+from bisect import bisect_left, insort
+from itertools import zip_longest
+from flask import current_app
+from sqlalchemy.orm import joinedload
+from flask_app import shards
+from flask_app.config import env_float, env_int
+from flask_app.handicap import course_handicap, handicap_indexes
+from flask_app.models import Hole, Round
+
+ORDERS = ('net', 'gross', 'to_par')
+RESET = 'reset'
+
+
+class Entry(object):
+    """One round on a leaderboard"""
+    __slots__ = ('round_id', 'user_id', 'name', 'scores', 'handicap', 'thru',
+        'gross', 'to_par', 'net')
+
+    def __init__(self, round_id, user_id, name, scores, handicap, pars):
+        self.round_id = round_id
+        self.user_id = user_id
+        self.name = name
+        self.scores = list(scores or ())
+        self.handicap = handicap
+        played = [
+            (score, par or 0) for score, par in zip_longest(self.scores, pars)
+            if score is not None
+        ]
+        self.thru = len(played)
+        self.gross = sum(score for score, par in played)
+        self.to_par = self.gross - sum(par for score, par in played)
+        # handicap strokes are received evenly over the holes played so far
+        holes = max(len(pars), len(self.scores))
+        strokes = round(handicap * self.thru / holes) if holes else 0
+        self.net = self.to_par - strokes
+
+    def key(self, order):
+        """Sort key, ties are broken by holes played then by round id"""
+        return (getattr(self, order), -self.thru, self.round_id)
+
+    def format(self):
+        return {
+            'round_id': self.round_id,
+            'user_id': self.user_id,
+            'name': self.name,
+            'thru': self.thru,
+            'gross': self.gross,
+            'to_par': self.to_par,
+            'net': self.net,
+            'handicap': self.handicap
+        }
+
+
+class Leaderboard(object):
+    """Standings of an event in gross, net and to par order"""
+
+    def __init__(self, event_id, pars, queue_size=100, course_id=None):
+        self.event_id = event_id
+        self.course_id = course_id
+        self.pars = list(pars)
+        self.version = 0
+        self.queue_size = queue_size
+        self._entries = {}
+        self._keys = {order: [] for order in ORDERS}
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, round_id):
+        return round_id in self._entries
+
+    def put(self, round_id, user_id, name, scores, handicap=0):
+        """Add a round to the board, or replace its scores"""
+        entry = Entry(round_id, user_id, name, scores, handicap, self.pars)
+        with self._lock:
+            old = self._entries.get(round_id)
+            for order, keys in self._keys.items():
+                if old is not None:
+                    del keys[bisect_left(keys, old.key(order))]
+                insort(keys, entry.key(order))
+            self._entries[round_id] = entry
+            self.version += 1
+            message = self._ranked(entry)
+            self._publish('score', message)
+        return message
+
+    def score(self, round_id, scores):
+        """Update the hole scores of a round already on the board, returns
+        False when the round is unknown"""
+        with self._lock:
+            entry = self._entries.get(round_id)
+        if entry is None:
+            return False
+        self.put(round_id, entry.user_id, entry.name, scores, entry.handicap)
+        return True
+
+    def remove(self, round_id):
+        with self._lock:
+            entry = self._entries.pop(round_id, None)
+            if entry is None:
+                return
+            for order, keys in self._keys.items():
+                del keys[bisect_left(keys, entry.key(order))]
+            self.version += 1
+            self._publish('remove', {'round_id': round_id})
+
+    def rank(self, order, round_id):
+        """1-based position of a round, found by bisection"""
+        with self._lock:
+            entry = self._entries.get(round_id)
+            if entry is None:
+                return None
+            return bisect_left(self._keys[order], entry.key(order)) + 1
+
+    def window(self, order, start, stop):
+        """Entries ranked start+1 .. stop"""
+        with self._lock:
+            keys = self._keys[order][max(start, 0):stop]
+            return [
+                dict(self._entries[key[-1]].format(), rank=position)
+                for position, key in enumerate(keys, max(start, 0) + 1)
+            ]
+
+    def top(self, order, k):
+        return self.window(order, 0, k)
+
+    def around(self, order, round_id, radius):
+        """The round with up to radius entries either side of it"""
+        rank = self.rank(order, round_id)
+        if rank is None:
+            return None
+        return self.window(order, rank - 1 - radius, rank + radius)
+
+    def subscribe(self):
+        """Queue receiving (version, event, data) for every change"""
+        subscriber = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def subscribed(self, subscriber):
+        return subscriber in self._subscribers
+
+    def close(self):
+        """Send every subscriber a reset and let them go, the board is being
+        replaced. A full queue loses its oldest change to make room, the
+        client reloads the board anyway."""
+        with self._lock:
+            for subscriber in self._subscribers:
+                while True:
+                    try:
+                        subscriber.put_nowait((self.version, RESET, {'event_id': self.event_id}))
+                        break
+                    except queue.Full:
+                        try:
+                            subscriber.get_nowait()
+                        except queue.Empty:
+                            pass
+            self._subscribers.clear()
+
+    def _ranked(self, entry):
+        message = entry.format()
+        message['ranks'] = {
+            order: bisect_left(self._keys[order], entry.key(order)) + 1 for order in ORDERS
+        }
+        return message
+
+    def _publish(self, event, data):
+        """Hand a change to every subscriber, dropping those too slow to keep
+        up rather than blocking the request that made the change"""
+        for subscriber in list(self._subscribers):
+            try:
+                subscriber.put_nowait((self.version, event, data))
+            except queue.Full:
+                self._subscribers.discard(subscriber)
+
+
+class LeaderboardRegistry(object):
+    """The boards loaded by this process, keyed by event id"""
+
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self._boards = {}
+        self._lock = threading.Lock()
+
+    def loaded(self, event_id):
+        return self._boards.get(event_id)
+
+    def get(self, event):
+        board = self._boards.get(event.id)
+        if board is None:
+            with self._lock:
+                board = self._boards.get(event.id)
+                if board is None:
+                    board = build_board(event, self.queue_size)
+                    self._boards[event.id] = board
+        return board
+
+    def discard(self, event_id):
+        with self._lock:
+            board = self._boards.pop(event_id, None)
+        if board is not None:
+            board.close()
+
+    def discard_course(self, course_id):
+        """Drop the boards of events played on a course whose holes changed"""
+        with self._lock:
+            boards = [board for board in self._boards.values() if board.course_id == course_id]
+            for board in boards:
+                del self._boards[board.event_id]
+        for board in boards:
+            board.close()
+
+
+def event_pars(course_id):
+    """Par of each hole of a course, in hole number order"""
+    holes = Hole.query.filter_by(course_id=course_id).order_by(Hole.number)
+    return [hole.par for hole in holes]
+
+def add_round(board, round, index):
+    """Put a round on a board, with the strokes received from its tee"""
+    tee = round.tee
+    handicap = course_handicap(index, tee.slope_rating, tee.course_rating, sum(board.pars))
+    return board.put(round.id, round.user_id, round.user.name, round.score_by_hole, handicap)
+
+def build_board(event, queue_size=100):
+    """Load every round of an event into a new board"""
+    board = Leaderboard(event.id, event_pars(event.course_id), queue_size, event.course_id)
+    rounds = []
+    for shard in shards.each():
+        rounds.extend(Round.query.filter_by(event_id=event.id).options(
+            joinedload(Round.user), joinedload(Round.tee)
+        ))
+    indexes = handicap_indexes([round.user_id for round in rounds])
+    for round in rounds:
+        add_round(board, round, indexes.get(round.user_id))
+    return board
+
+def registry():
+    return current_app.extensions['leaderboards']
+
+def round_added(round):
+    """Put a new event round on its board, if the board is loaded"""
+    board = registry().loaded(round.event_id)
+    if board is not None:
+        add_round(board, round, handicap_indexes([round.user_id]).get(round.user_id))
+
+def round_scored(event_id, round_id, scores):
+    """Move a round whose hole scores changed, a board which does not know
+    the round is dropped and rebuilt on next use"""
+    board = registry().loaded(event_id)
+    if board is not None and not board.score(round_id, scores):
+        registry().discard(event_id)
+
+def sse(event, data, id=None):
+    """Format one server-sent event"""
+    message = f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    if id is not None:
+        message = f"id: {id}\n" + message
+    return message
+
+def stream(board, order, k, keepalive):
+    """Server-sent events for a board, starting with a snapshot of the top k.
+    The generator does not use the request or the database, so the connection
+    is returned to the pool before streaming starts."""
+    subscriber = board.subscribe()
+    try:
+        yield sse('snapshot', board.top(order, k), board.version)
+        # a closed board leaves its reset in the queue after letting go
+        while board.subscribed(subscriber) or not subscriber.empty():
+            try:
+                version, event, data = subscriber.get(timeout=keepalive)
+            except queue.Empty:
+                yield ": keepalive\n\n"
+                continue
+            yield sse(event, data, version)
+            if event == RESET:
+                break
+    finally:
+        board.unsubscribe(subscriber)
+
+def init_app(app):
+    app.config.setdefault(
+        'LEADERBOARD_QUEUE_SIZE', env_int('LEADERBOARD_QUEUE_SIZE', 100)
+    )
+    app.config.setdefault(
+        'LEADERBOARD_KEEPALIVE_SECONDS', env_float('LEADERBOARD_KEEPALIVE_SECONDS', 15.0)
+    )
+    app.extensions['leaderboards'] = LeaderboardRegistry(app.config['LEADERBOARD_QUEUE_SIZE'])
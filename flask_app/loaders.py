@@ -0,0 +1,83 @@
+from datetime import date
+from flask import abort, request
+from sqlalchemy import any_, bindparam
+from sqlalchemy.dialects import postgresql
+from flask_app import db
+
+MAX_BATCH_IDS = 100
+
+
+def parse_ids(raw, limit=MAX_BATCH_IDS):
+    """Parse a comma separated list of ids from a query string argument"""
+    try:
+        ids = [int(part) for part in raw.split(',') if part.strip()]
+    except ValueError:
+        abort(400, "ids must be a comma separated list of integers.")
+    if not ids:
+        abort(400, "At least one id must be given.")
+    if len(ids) > limit:
+        abort(400, f"At most {limit} ids may be requested at once.")
+    return ids
+
+def id_in(column, ids):
+    """Filter column = ANY(:ids), with the ids bound as one array parameter so
+    the statement text is the same whatever the number of ids"""
+    return column == any_(bindparam(None, list(ids), type_=postgresql.ARRAY(db.Integer)))
+
+def fetch_by_ids(model, ids, *options):
+    """Load the rows of model with the given ids in a single query, returned
+    as a dict keyed by id"""
+    unique_ids = list(dict.fromkeys(ids))
+    if not unique_ids:
+        return {}
+    query = model.query.filter(id_in(model.id, unique_ids))
+    if options:
+        query = query.options(*options)
+    return {row.id: row for row in query}
+
+def ordered_batch(ids, found, format):
+    """Batch response body: found rows formatted in request order, plus the
+    requested ids which do not exist"""
+    return {
+        'data': [format(found[id]) for id in ids if id in found],
+        'missing': list(dict.fromkeys(id for id in ids if id not in found)),
+    }
+
+def fetch_grouped(column, parent_ids, *options):
+    """Load the rows whose foreign key column references any of parent_ids in a
+    single query, returned as a dict of lists keyed by parent id"""
+    unique_ids = list(dict.fromkeys(parent_ids))
+    grouped = {id: [] for id in unique_ids}
+    if not unique_ids:
+        return grouped
+    model = column.class_
+    query = model.query.filter(id_in(column, unique_ids))
+    if options:
+        query = query.options(*options)
+    for row in query:
+        grouped[getattr(row, column.key)].append(row)
+    return grouped
+
+def parse_include(allowed):
+    """Parse ?include=a,b into the set of relations to embed, rejecting any
+    relation the endpoint cannot expand"""
+    raw = request.args.get('include', '')
+    include = {part.strip() for part in raw.split(',') if part.strip()}
+    unknown = include - set(allowed)
+    if unknown:
+        abort(400, f"Cannot include {', '.join(sorted(unknown))}, "
+            f"choose from: {', '.join(allowed)}.")
+    return include
+
+def parse_date_range():
+    """Parse ?from=YYYY-MM-DD&to=YYYY-MM-DD, either end may be left open"""
+    bounds = []
+    for name in ('from', 'to'):
+        raw = request.args.get(name)
+        try:
+            bounds.append(date.fromisoformat(raw) if raw else None)
+        except ValueError:
+            abort(400, f"{name} must be a date formatted as YYYY-MM-DD.")
+    if bounds[0] and bounds[1] and bounds[0] > bounds[1]:
+        abort(400, "from must not be after to.")
+    return bounds
@@ -0,0 +1,167 @@
+import time
+from flask import Blueprint, Response, g, has_request_context, request
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+from flask_app.config import env_flag
+
+metrics_bp = Blueprint('metrics', __name__)
+
+QUERY_COUNT_HEADER = 'X-DB-Query-Count'
+DB_TIME_HEADER = 'X-DB-Time-Ms'
+
+REQUEST_LATENCY = Histogram(
+    'golf_api_request_latency_seconds',
+    'Time taken to handle a request',
+    ['endpoint', 'method', 'status']
+)
+REQUEST_QUERIES = Histogram(
+    'golf_api_request_db_queries',
+    'Number of SQL statements issued while handling a request',
+    ['endpoint'],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144)
+)
+REQUEST_DB_TIME = Histogram(
+    'golf_api_request_db_seconds',
+    'Time spent executing SQL statements while handling a request',
+    ['endpoint']
+)
+DB_QUERIES = Counter(
+    'golf_api_db_queries_total',
+    'Total number of SQL statements issued',
+    ['endpoint']
+)
+POOL_CHECKOUT_WAIT = Histogram(
+    'golf_api_db_pool_checkout_wait_seconds',
+    'Time spent waiting to check a connection out of the pool',
+    ['endpoint'],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5)
+)
+ADMISSION_IN_FLIGHT = Gauge(
+    'golf_api_admission_in_flight',
+    'Requests admitted and running, per admission budget',
+    ['budget']
+)
+ADMISSION_QUEUED = Gauge(
+    'golf_api_admission_queued',
+    'Requests waiting for a slot, per admission budget',
+    ['budget']
+)
+ADMISSION_WAIT = Histogram(
+    'golf_api_admission_wait_seconds',
+    'Time requests waited for an admission slot',
+    ['budget'],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5)
+)
+ADMISSION_REJECTED = Counter(
+    'golf_api_admission_rejected_total',
+    'Requests shed with a 503, by budget and reason',
+    ['budget', 'reason']
+)
+STARTUP_SECONDS = Gauge(
+    'golf_api_startup_seconds',
+    'Time taken by each phase of application startup',
+    ['phase']
+)
+
+
+class RequestStats(object):
+    """Database work done while handling a single request"""
+    __slots__ = ('started', 'queries', 'db_time', 'checkout_wait')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.checkout_wait = 0.0
+
+
+def current_stats():
+    """Return the stats object for the request being handled, if any"""
+    if has_request_context():
+        return g.get('db_stats')
+    return None
+
+def current_endpoint():
+    if has_request_context():
+        return request.endpoint or 'unmatched'
+    return ''
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool which records how long each checkout waited for a connection"""
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            waited = time.perf_counter() - start
+            POOL_CHECKOUT_WAIT.labels(current_endpoint()).observe(waited)
+            stats = current_stats()
+            if stats is not None:
+                stats.checkout_wait += waited
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # kept on the execution context, which goes away with the statement even
+    # when it raises and after_cursor_execute never runs
+    if context is not None:
+        context._metrics_started = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_metrics_started', None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    stats = current_stats()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_time += elapsed
+
+def install_engine_hooks():
+    """Attach the query timing hooks to every engine, only once per process"""
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def _start_request():
+    g.db_stats = RequestStats()
+
+def _finish_request(response):
+    stats = g.pop('db_stats', None)
+    if stats is None:
+        return response
+    endpoint = current_endpoint()
+    latency = time.perf_counter() - stats.started
+    REQUEST_LATENCY.labels(endpoint, request.method, response.status_code).observe(latency)
+    REQUEST_QUERIES.labels(endpoint).observe(stats.queries)
+    REQUEST_DB_TIME.labels(endpoint).observe(stats.db_time)
+    DB_QUERIES.labels(endpoint).inc(stats.queries)
+    response.headers[QUERY_COUNT_HEADER] = str(stats.queries)
+    response.headers[DB_TIME_HEADER] = f"{stats.db_time * 1000:.2f}"
+    return response
+
+
+@metrics_bp.route('/metrics')
+def metrics():
+    """Expose collected metrics in the Prometheus text format"""
+    return Response(generate_latest(), content_type=CONTENT_TYPE_LATEST)
+
+
+def init_app(app):
+    """Register the request hooks, the pool class and the /metrics endpoint"""
+    app.config.setdefault('METRICS_ENABLED', env_flag('METRICS_ENABLED', True))
+    if not app.config['METRICS_ENABLED']:
+        return
+    uri = app.config.get('SQLALCHEMY_DATABASE_URI') or ''
+    if uri.startswith('postgres'):
+        engine_options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+        engine_options.setdefault('poolclass', InstrumentedQueuePool)
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
+    install_engine_hooks()
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.register_blueprint(metrics_bp)
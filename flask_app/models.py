@@ -3,24 +3,23 @@ from flask_app import db
 from sqlalchemy.dialects import postgresql
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import validates
-from datetime import datetime
+from datetime import date, datetime
 
 
 class User(db.Model):
     __tablename__ = 'users'
+    # users and their rounds are spread over the shards by user id
+    __table_args__ = {'info': {'sharded': True, 'shard_key': 'id'}}
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(), nullable=False)
     date_joined = db.Column(db.Date, default=datetime.date(datetime.now()))
     rounds = db.relationship('Round', backref='user', lazy=True, order_by='Round.date') 
 
-    @hybrid_property
+    @property
     def handicap(self):
-        """Calculate the user's handicap"""
-        num_rounds = 0
-        handicap_sum = 0
-        for golf_round in self.rounds[:20]:
-            pass
-        return 30
+        """Calculate the user's handicap index from their most recent rounds"""
+        from flask_app.handicap import handicap_indexes
+        return handicap_indexes([self.id]).get(self.id)
 
     def __repr__(self):
         return f"<class User id: {self.id}, name: {self.name}," \
@@ -37,32 +36,54 @@ class User(db.Model):
 
 class Round(db.Model):
     __tablename__ = 'rounds'
-    id = db.Column(db.Integer, primary_key=True)
+    __table_args__ = (
+        db.Index('ix_rounds_user_id_date', 'user_id', 'date'),
+        db.Index('ix_rounds_course_id_tee_id', 'course_id', 'tee_id'),
+        db.Index('ix_rounds_tee_id', 'tee_id'),
+        db.Index('ix_rounds_event_id', 'event_id'),
+        {
+            'postgresql_partition_by': 'RANGE (date)',
+            'info': {'sharded': True, 'shard_key': 'user_id'},
+        },
+    )
+    # rounds is partitioned by month of date, which has to be part of the
+    # table's primary key, the mapper still identifies rounds by id alone
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     course_id = db.Column(db.Integer, db.ForeignKey('courses.id'))
     tee_id = db.Column(db.Integer, db.ForeignKey('tees.id'))
-    date = db.Column(db.Date, default=datetime.date(datetime.now()))
+    event_id = db.Column(db.Integer, db.ForeignKey('events.id'), nullable=True)
+    date = db.Column(db.Date, primary_key=True, default=date.today, server_default=db.func.current_date())
     score_by_hole = db.Column(postgresql.ARRAY(db.Integer), nullable=False)
     putts = db.Column(postgresql.ARRAY(db.Integer), nullable=True)
     fairways = db.Column(postgresql.ARRAY(db.Integer), nullable=True)
     gir = db.Column(postgresql.ARRAY(db.Integer), nullable=True)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
+    __mapper_args__ = {'version_id_col': version, 'primary_key': [id]}
 
     @hybrid_property
     def handicap(self):
         """Property which returns calculated handicap differential value for the round"""
         rating, slope = self.tee.course_rating, self.tee.slope_rating
-        if not rating or not slope:
+        if not rating or not slope or not self.is_complete:
             return None
-        return (slope / 113) * score - rating
+        return (113 / slope) * (self.score - rating)
 
     @hybrid_property
     def score(self):
-        """Compute total score."""
+        """Compute total score, of the holes played so far for a round in progress."""
         cumulative_score = 0
         for s in self.score_by_hole:
-            cumulative_score += s
+            if s is not None:
+                cumulative_score += s
         return cumulative_score
 
+    @property
+    def is_complete(self):
+        """True once a score has been entered for all 9 or 18 holes"""
+        return len(self.score_by_hole) in (9, 18) and None not in self.score_by_hole
+
     @validates('tee_id')
     def validate_tee_id(self, key, tee_id):
         """Validate that the given tee is associated with the given course"""
@@ -89,6 +110,7 @@ class Round(db.Model):
             'user_id': self.user_id,
             'course_id': self.course_id,
             'tee_id': self.tee_id,
+            'event_id': self.event_id,
             'handicap': self.handicap,
             'score': self.score
         }
@@ -97,12 +119,76 @@ class Round(db.Model):
     def detail_format(self):
         """Return round object full data as a dictionary for JSON requests/responses"""
         round_dict = self.format()
+        round_dict['version'] = self.version
         round_dict['score_by_hole'] = self.score_by_hole
         if self.putts: round_dict['putts'] = self.putts
         if self.fairways: round_dict['fairways'] = self.fairways
         if self.gir: round_dict['gir'] = self.gir
         return round_dict
 
+# Set one element of an integer array, padding with nulls as needed. Assigning
+# to element n of an empty or null array directly would produce an array whose
+# subscripts start at n, so those are first replaced with n nulls.
+array_set_element = db.DDL("""
+CREATE OR REPLACE FUNCTION array_set_element(arr integer[], idx integer, val integer)
+RETURNS integer[] AS $$
+BEGIN
+    IF arr IS NULL OR cardinality(arr) = 0 THEN
+        arr := array_fill(NULL::integer, ARRAY[idx]);
+    END IF;
+    arr[idx] := val;
+    RETURN arr;
+END;
+$$ LANGUAGE plpgsql IMMUTABLE
+""")
+db.event.listen(Round.__table__, 'after_create', array_set_element)
+# rows outside every monthly partition land here until the partition job runs
+db.event.listen(Round.__table__, 'after_create', db.DDL(
+    "CREATE TABLE rounds_default PARTITION OF rounds DEFAULT"
+))
+
+class ScoreSketch(db.Model):
+    """Histogram of the totals of completed rounds from one tee, counts[i]
+    holds the number of rounds with a total of holes + i - 1"""
+    __tablename__ = 'score_sketches'
+    __table_args__ = (
+        db.PrimaryKeyConstraint('tee_id', 'holes'),
+        db.Index('ix_score_sketches_course_id', 'course_id'),
+        # each shard counts the rounds it holds, readers merge the shards
+        {'info': {'sharded': True}},
+    )
+    tee_id = db.Column(db.Integer, db.ForeignKey('tees.id'), nullable=False)
+    holes = db.Column(db.Integer, nullable=False)
+    course_id = db.Column(db.Integer, db.ForeignKey('courses.id'), nullable=False)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    counts = db.Column(postgresql.ARRAY(db.Integer), nullable=False)
+
+    def __repr__(self):
+        return f"<class ScoreSketch tee id: {self.tee_id}, holes: {self.holes}," \
+            f" rounds: {self.total}>"
+
+class Event(db.Model):
+    __tablename__ = 'events'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(), nullable=False)
+    course_id = db.Column(db.Integer, db.ForeignKey('courses.id'), nullable=False)
+    date = db.Column(db.Date, default=datetime.date(datetime.now()))
+    rounds = db.relationship('Round', backref='event', lazy=True)
+    course = db.relationship('Course')
+
+    def __repr__(self):
+        return f"<class Event id: {self.id}, name: {self.name}," \
+            f" course id: {self.course_id}, date: {self.date}>"
+
+    def format(self):
+        """Return event object as a dict for JSON requests/responses"""
+        return {
+            'id': self.id,
+            'name': self.name,
+            'course_id': self.course_id,
+            'date': self.date
+        }
+
 class Course(db.Model):
     __tablename__ = 'courses'
     id = db.Column(db.Integer, primary_key=True)
@@ -137,6 +223,7 @@ class Yardage(db.Model):
     __tablename__ = 'yardages'
     __table_args__ = (
         db.PrimaryKeyConstraint('tee_id', 'hole_id'),
+        db.Index('ix_yardages_hole_id', 'hole_id'),
     )
     tee_id = db.Column(db.Integer, db.ForeignKey('tees.id'), primary_key=True)
     hole_id = db.Column(db.Integer, db.ForeignKey('holes.id'), primary_key=True)
@@ -144,6 +231,14 @@ class Yardage(db.Model):
     hole = db.relationship("Hole", back_populates="tees")
     tee = db.relationship("Tee", back_populates="holes")
 
+    def format(self):
+        """Return yardage and the tee it is measured from as a dictionary"""
+        return {
+            'yardage': self.yardage,
+            'tee_id': self.tee.id,
+            'colour': self.tee.colour
+        }
+
 
 class Tee(db.Model):
     __tablename__ = 'tees'
@@ -183,10 +278,15 @@ class Tee(db.Model):
 
 class Hole(db.Model):
     __tablename__ = 'holes'
+    __table_args__ = (
+        db.Index('ix_holes_course_id_number', 'course_id', 'number'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     course_id = db.Column(db.Integer, db.ForeignKey('courses.id'))
     number = db.Column(db.Integer, nullable=False)
     par = db.Column(db.Integer, nullable=False)
+    # 1 for the hardest hole, where handicap strokes are given first
+    stroke_index = db.Column(db.Integer, nullable=True)
     tees = db.relationship("Yardage", back_populates="hole")
 
     @validates('number')
@@ -203,6 +303,13 @@ class Hole(db.Model):
             raise ValueError(f"par may only be 3, 4 or 5.")
         return par
 
+    @validates('stroke_index')
+    def validate_stroke_index(self, key, stroke_index):
+        """Validate the stroke index is between 1 and 18 when given"""
+        if stroke_index is not None and (stroke_index < 1 or stroke_index > 18):
+            raise ValueError(f"stroke index must be between 1 and 18")
+        return stroke_index
+
     def format(self):
         """Return basic hole data as a dictionary for JSON requests/responses"""
         hole_dict = {
@@ -210,16 +317,115 @@ class Hole(db.Model):
             'number': self.number,
             'par': self.par,
         }
+        if self.stroke_index: hole_dict['stroke_index'] = self.stroke_index
         return hole_dict
 
     def detail_format(self):
         """Return more detailed hole data as dictionary for JSON requests/responses"""
         hole_dict = self.format()
-        hole_dict['tees'] = []
-        for tee in self.tees:
-            tee_dict = {}
-            tee_dict['yardage'] = tee.yardage
-            tee_dict['tee_id'] = tee.tee.id
-            tee_dict['colour'] = tee.tee.colour
-            hole_dict['tees'].append(tee_dict)
+        hole_dict['tees'] = [yardage.format() for yardage in self.tees]
         return hole_dict
+
+
+class SlowQuery(db.Model):
+    """A statement that crossed the slow query threshold, aggregated over its
+    calls from one endpoint"""
+    __tablename__ = 'slow_queries'
+    fingerprint = db.Column(db.String(40), primary_key=True)
+    endpoint = db.Column(db.String(), nullable=False)
+    statement = db.Column(db.Text, nullable=False)
+    calls = db.Column(db.Integer, nullable=False, default=1)
+    total_ms = db.Column(db.Float, nullable=False)
+    max_ms = db.Column(db.Float, nullable=False)
+    parameters = db.Column(postgresql.JSONB(none_as_null=True))
+    stack = db.Column(db.Text)
+    plan = db.Column(postgresql.JSONB(none_as_null=True))
+    first_seen = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_seen = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<class SlowQuery endpoint: {self.endpoint}, calls: {self.calls}," \
+            f" total ms: {self.total_ms}>"
+
+    def format(self):
+        """Return the slow query as a dictionary"""
+        return {
+            'fingerprint': self.fingerprint,
+            'endpoint': self.endpoint,
+            'statement': self.statement,
+            'calls': self.calls,
+            'total_ms': self.total_ms,
+            'mean_ms': self.total_ms / self.calls,
+            'max_ms': self.max_ms,
+            'parameters': self.parameters,
+            'stack': self.stack,
+            'plan': self.plan,
+            'last_seen': self.last_seen
+        }
+
+
+class ShardBucket(db.Model):
+    """Which shard holds the users whose id falls in a bucket, and whether the
+    bucket is being moved to another shard"""
+    __tablename__ = 'shard_buckets'
+    bucket = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    shard = db.Column(db.String(), nullable=False)
+    moving = db.Column(db.Boolean, nullable=False, default=False, server_default='false')
+
+    def __repr__(self):
+        return f"<class ShardBucket bucket: {self.bucket}, shard: {self.shard}," \
+            f" moving: {self.moving}>"
+
+
+class ChangeLog(db.Model):
+    """Append only record of course, hole, tee and yardage changes, read by
+    /sync. txid is the writing transaction's id, see changes.py."""
+    __tablename__ = 'change_log'
+    __table_args__ = (
+        db.Index('ix_change_log_txid_id', 'txid', 'id'),
+    )
+    id = db.Column(db.BigInteger, primary_key=True)
+    txid = db.Column(db.BigInteger, nullable=False, server_default=db.text('txid_current()'))
+    entity = db.Column(db.String(), nullable=False)
+    key = db.Column(db.String(), nullable=False)
+    op = db.Column(db.String(6), nullable=False)
+
+    def __repr__(self):
+        return f"<class ChangeLog id: {self.id}, {self.op} {self.entity} {self.key}>"
+
+class RoundChange(db.Model):
+    """Append only record of round changes, kept on the shard of the round's
+    user so that it commits with the round"""
+    __tablename__ = 'round_changes'
+    __table_args__ = (
+        db.Index('ix_round_changes_user_id_txid_id', 'user_id', 'txid', 'id'),
+        {'info': {'sharded': True}},
+    )
+    id = db.Column(db.BigInteger, primary_key=True)
+    txid = db.Column(db.BigInteger, nullable=False, server_default=db.text('txid_current()'))
+    user_id = db.Column(db.Integer, nullable=False)
+    round_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(6), nullable=False)
+
+    def __repr__(self):
+        return f"<class RoundChange id: {self.id}, {self.op} round {self.round_id}>"
+
+
+class IdempotencyKey(db.Model):
+    """The response to a POST sent with an Idempotency-Key header, replayed
+    to retries of it until it expires. status is null while the first
+    request is running."""
+    __tablename__ = 'idempotency_keys'
+    __table_args__ = (
+        db.Index('ix_idempotency_keys_expires_at', 'expires_at'),
+    )
+    key = db.Column(db.String(64), primary_key=True)
+    fingerprint = db.Column(db.String(64), nullable=False)
+    status = db.Column(db.SmallInteger, nullable=True)
+    headers = db.Column(postgresql.JSONB(none_as_null=True))
+    body = db.Column(db.LargeBinary, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f"<class IdempotencyKey key: {self.key}, status: {self.status}>"
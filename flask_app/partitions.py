@@ -0,0 +1,108 @@
+"""Monthly range partitions of the rounds table.
+
+rounds is partitioned by date, one partition per calendar month, plus a
+default partition catching rows no monthly partition covers. Queries which
+filter on date only read the matching months. The partitions for the coming
+months have to exist before rounds are played in them, run
+
+    flask rounds create-partitions --months-ahead 3
+
+daily (cron, a scheduled job) to keep ahead. Rows already sitting in the
+default partition for a month being created are moved into it.
+"""
+import datetime
+import click
+from flask.cli import AppGroup
+from sqlalchemy import text
+from flask_app import db, shards
+
+PARENT = 'rounds'
+DEFAULT_PARTITION = 'rounds_default'
+# serializes concurrent runs of the partition job
+LOCK_ID = 7_301_038
+
+rounds_cli = AppGroup('rounds', help="Maintain the rounds table.")
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+def add_months(day, months):
+    years, month = divmod(day.month - 1 + months, 12)
+    return datetime.date(day.year + years, month + 1, 1)
+
+def partition_name(month):
+    return f"{PARENT}_y{month.year}m{month.month:02d}"
+
+def is_partitioned(connection):
+    return connection.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:parent))"
+    ), parent=PARENT).scalar()
+
+def existing_partitions(connection):
+    return {row[0] for row in connection.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE pg_inherits.inhparent = to_regclass(:parent)"
+    ), parent=PARENT)}
+
+def create_partition(connection, month):
+    """Create the partition of one month, moving its rows out of the default
+    partition first if any were inserted before the partition existed"""
+    name, lower, upper = partition_name(month), month, add_months(month, 1)
+    bounds = f"FOR VALUES FROM ('{lower}') TO ('{upper}')"
+    in_range = {'lower': lower, 'upper': upper}
+    stranded = connection.execute(text(
+        f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE date >= :lower AND date < :upper)"
+    ), **in_range).scalar()
+    if not stranded:
+        connection.execute(text(f"CREATE TABLE {name} PARTITION OF {PARENT} {bounds}"))
+        return
+    connection.execute(text(f"ALTER TABLE {PARENT} DETACH PARTITION {DEFAULT_PARTITION}"))
+    connection.execute(text(f"CREATE TABLE {name} PARTITION OF {PARENT} {bounds}"))
+    connection.execute(text(
+        f"INSERT INTO {name} SELECT * FROM {DEFAULT_PARTITION} "
+        "WHERE date >= :lower AND date < :upper"
+    ), **in_range)
+    connection.execute(text(
+        f"DELETE FROM {DEFAULT_PARTITION} WHERE date >= :lower AND date < :upper"
+    ), **in_range)
+    connection.execute(text(f"ALTER TABLE {PARENT} ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT"))
+
+def create_partitions(bind, start=None, months_ahead=3, today=None):
+    """Create the missing monthly partitions from the month of start (today
+    by default) up to months_ahead months after today, in one transaction.
+    Returns the names of the partitions created."""
+    today = today or datetime.date.today()
+    month = month_start(start or today)
+    last = add_months(today, months_ahead)
+    created = []
+    with bind.begin() as connection:
+        if not is_partitioned(connection):
+            return created
+        connection.execute(text("SELECT pg_advisory_xact_lock(:id)"), id=LOCK_ID)
+        existing = existing_partitions(connection)
+        while month <= last:
+            if partition_name(month) not in existing:
+                create_partition(connection, month)
+                created.append(partition_name(month))
+            month = add_months(month, 1)
+    return created
+
+@rounds_cli.command('create-partitions')
+@click.option('--months-ahead', default=3, show_default=True,
+    help="Create partitions up to this many months after the current one.")
+@click.option('--start', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+    help="First month to create, defaults to the current month.")
+def create_partitions_command(months_ahead, start):
+    """Create the monthly partitions of the rounds table."""
+    engines = [db.engine] + [db.get_engine(bind=name) for name in shards.names()]
+    for engine in engines:
+        created = create_partitions(engine, start.date() if start else None, months_ahead)
+        click.echo(
+            f"Created {len(created)} partitions on {engine.url.database}: "
+            f"{', '.join(created) or 'none needed'}."
+        )
+
+def init_app(app):
+    app.cli.add_command(rounds_cli)
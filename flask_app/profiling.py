@@ -0,0 +1,220 @@
+"""Opt-in profiling of single requests.
+
+With PROFILING_ENABLED set, a request carrying the header
+
+    X-Profile-Token: <PROFILING_TOKEN>
+
+runs under cProfile, and so does a random PROFILING_SAMPLE_RATE fraction of
+all requests. At most one request per process is profiled at a time, any
+other request arriving meanwhile runs unprofiled, so turning this on for a
+production instance costs one slower request in flight, not all of them.
+A wrong token is ignored rather than rejected, the request is served as
+usual. Profiles are written as .pstats files with a .json summary to
+PROFILING_DIR, which keeps only the newest PROFILING_MAX_PROFILES.
+
+    GET /admin/profiles                 list the stored profiles
+    GET /admin/profiles/<name>          download one as pstats, or the top
+                                        functions with ?format=text
+
+Both need the token header. `flask profiles list` and `flask profiles show
+NAME` read the same directory. Streamed responses are profiled until the
+view returns, not while the body is sent.
+"""
+import cProfile, datetime, hmac, io, json, os, pstats, random, re, tempfile, threading, time
+import click
+from flask import Blueprint, Response, abort, current_app, g, jsonify, request, send_from_directory
+from flask.cli import AppGroup
+from flask_app.config import env_flag, env_float, env_int
+
+TOKEN_HEADER = 'X-Profile-Token'
+PROFILE_HEADER = 'X-Profile-Id'
+EXTENSION = '.pstats'
+NAME_PATTERN = re.compile(r'^[\w.-]+\.pstats$')
+TEXT_LIMIT = 40
+
+profiling_bp = Blueprint('profiles', __name__, url_prefix='/admin/profiles')
+profiles_cli = AppGroup('profiles', help="Inspect stored request profiles.")
+
+# cProfile cannot run two profilers in one process reliably, and the point is
+# to bound the overhead, so one request is profiled at a time
+_active = threading.Lock()
+
+
+def token_matches(app):
+    token = app.config['PROFILING_TOKEN']
+    given = request.headers.get(TOKEN_HEADER)
+    return bool(token and given) and hmac.compare_digest(given.encode(), token.encode())
+
+def should_profile(app):
+    """Why the current request should be profiled, None if it should not"""
+    if token_matches(app):
+        return 'token'
+    rate = app.config['PROFILING_SAMPLE_RATE']
+    if rate > 0 and random.random() < rate:
+        return 'sample'
+    return None
+
+
+class ProfileStore(object):
+    """Bounded directory of profiles, the oldest removed as new ones arrive"""
+
+    def __init__(self, path, max_profiles):
+        self.path = path
+        self.max_profiles = max_profiles
+
+    def names(self):
+        """Stored profile names, newest first"""
+        try:
+            entries = os.listdir(self.path)
+        except FileNotFoundError:
+            return []
+        return sorted((entry for entry in entries if entry.endswith(EXTENSION)), reverse=True)
+
+    def summary(self, name):
+        try:
+            with open(os.path.join(self.path, name[:-len(EXTENSION)] + '.json')) as f:
+                summary = json.load(f)
+        except (FileNotFoundError, ValueError):
+            summary = {}
+        summary['name'] = name
+        return summary
+
+    def list(self):
+        return [self.summary(name) for name in self.names()]
+
+    def file(self, name):
+        """Path of a stored profile, None for unknown or malformed names"""
+        if not NAME_PATTERN.match(name) or name not in self.names():
+            return None
+        return os.path.join(self.path, name)
+
+    def save(self, profiler, summary):
+        """Write a profile and its summary, then trim the ring"""
+        os.makedirs(self.path, exist_ok=True)
+        stamp = datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')
+        endpoint = re.sub(r'[^\w.-]', '_', summary.get('endpoint') or 'unmatched')
+        base = f"{stamp}-{endpoint}"
+        profiler.dump_stats(os.path.join(self.path, base + EXTENSION))
+        with open(os.path.join(self.path, base + '.json'), 'w') as f:
+            json.dump(summary, f)
+        self.trim()
+        return base + EXTENSION
+
+    def trim(self):
+        for name in self.names()[self.max_profiles:]:
+            for path in (name, name[:-len(EXTENSION)] + '.json'):
+                try:
+                    os.remove(os.path.join(self.path, path))
+                except FileNotFoundError:
+                    pass
+
+def store(app=None):
+    app = app or current_app
+    return ProfileStore(app.config['PROFILING_DIR'], app.config['PROFILING_MAX_PROFILES'])
+
+def top_functions(path, limit=TEXT_LIMIT, sort='cumulative'):
+    """The pstats report of a profile's most expensive functions"""
+    output = io.StringIO()
+    pstats.Stats(path, stream=output).sort_stats(sort).print_stats(limit)
+    return output.getvalue()
+
+
+def _start_profile():
+    if request.blueprint == profiling_bp.name:
+        return
+    reason = should_profile(current_app)
+    if reason is None or not _active.acquire(blocking=False):
+        return
+    g.profile = (cProfile.Profile(), reason, time.perf_counter())
+    g.profile[0].enable()
+
+def _finish_profile(response):
+    profile = g.pop('profile', None)
+    if profile is None:
+        return response
+    profiler, reason, started = profile
+    try:
+        profiler.disable()
+        name = store().save(profiler, {
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'endpoint': request.endpoint,
+            'status': response.status_code,
+            'reason': reason,
+            'duration_ms': round((time.perf_counter() - started) * 1000, 3),
+            'created': datetime.datetime.utcnow().isoformat(),
+        })
+        response.headers[PROFILE_HEADER] = name
+    except OSError as ex:
+        current_app.logger.warning(f"Could not store profile: {ex}")
+    finally:
+        _active.release()
+    return response
+
+def _abandon_profile(exception):
+    """Stop a profile whose request failed before after_request ran"""
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profile[0].disable()
+        _active.release()
+
+
+def require_token():
+    if not token_matches(current_app):
+        abort(401, f"A valid {TOKEN_HEADER} header is required.")
+
+@profiling_bp.route('')
+def list_profiles():
+    """List the stored profiles, newest first"""
+    require_token()
+    return jsonify({'profiles': store().list()})
+
+@profiling_bp.route('/<name>')
+def download_profile(name):
+    """Download a profile as pstats, or its top functions as text"""
+    require_token()
+    profiles = store()
+    path = profiles.file(name)
+    if path is None:
+        abort(404, f"Profile {name} does not exist.")
+    if request.args.get('format') == 'text':
+        return Response(top_functions(path), content_type='text/plain')
+    return send_from_directory(profiles.path, name, as_attachment=True)
+
+
+@profiles_cli.command('list')
+def list_command():
+    """List the stored profiles, newest first."""
+    for summary in store().list():
+        click.echo(
+            f"{summary['name']}  {summary.get('method', '')} {summary.get('path', '')}  "
+            f"{summary.get('status', '')}  {summary.get('duration_ms', '')} ms"
+        )
+
+@profiles_cli.command('show')
+@click.argument('name')
+@click.option('--limit', default=TEXT_LIMIT, show_default=True, help="Number of functions.")
+@click.option('--sort', default='cumulative', show_default=True, help="pstats sort key.")
+def show_command(name, limit, sort):
+    """Print the most expensive functions of profile NAME."""
+    path = store().file(name)
+    if path is None:
+        raise click.ClickException(f"Profile {name} does not exist.")
+    click.echo(top_functions(path, limit, sort))
+
+def init_app(app):
+    """Register the profiling hooks and endpoints when profiling is enabled"""
+    app.config.setdefault('PROFILING_ENABLED', env_flag('PROFILING_ENABLED', False))
+    app.config.setdefault('PROFILING_TOKEN', os.environ.get('PROFILING_TOKEN'))
+    app.config.setdefault('PROFILING_SAMPLE_RATE', env_float('PROFILING_SAMPLE_RATE', 0.0))
+    app.config.setdefault('PROFILING_DIR', os.environ.get(
+        'PROFILING_DIR', os.path.join(tempfile.gettempdir(), 'golf-api-profiles')
+    ))
+    app.config.setdefault('PROFILING_MAX_PROFILES', env_int('PROFILING_MAX_PROFILES', 50))
+    app.cli.add_command(profiles_cli)
+    if not app.config['PROFILING_ENABLED']:
+        return
+    app.before_request(_start_profile)
+    app.after_request(_finish_profile)
+    app.teardown_request(_abandon_profile)
+    app.register_blueprint(profiling_bp)
@@ -0,0 +1,350 @@
+"""Storage of the course reference data behind the course and tee views.
+
+The views load and change courses, tees, holes and yardages through
+repository() instead of Model.query, which is one of:
+
+    SqlRepository     the database through the models, the default
+    MemoryRepository  model instances held in dicts by id, with each
+                      course's holes and tees on its relationship lists
+                      and tees also by (course id, colour)
+
+STORAGE_BACKEND=memory serves course data from memory. With
+STORAGE_SNAPSHOT set to a file written by `flask storage dump PATH` the
+data is loaded from it at startup and the repository is read only, so a
+node can answer course reads without a database. Without a snapshot it
+starts empty and accepts writes, which only the endpoint tests may use:
+outside of TESTING it would be one process's private copy of the courses,
+so startup refuses it.
+
+Rounds, users and the score distributions stay on the database whatever
+the backend: with STORAGE_BACKEND=memory the endpoints that read them
+answer 503 rather than reaching for a database the node may not have. The
+similar course search is computed from the repository's courses.
+"""
+import datetime, json, os, threading
+import click
+from flask import abort, current_app, request
+from flask.cli import AppGroup
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import joinedload
+from flask_app import db, statements
+from flask_app.loaders import fetch_by_ids, fetch_grouped
+from flask_app.models import Course, Hole, Tee, Yardage
+
+FORMAT = 1
+BACKENDS = ('sql', 'memory')
+# snapshot sections, parents before children
+MODELS = {'courses': Course, 'tees': Tee, 'holes': Hole, 'yardages': Yardage}
+
+# served from the database whatever the backend
+DATABASE_BLUEPRINTS = ('users', 'events', 'competitions', 'sync', 'stats')
+DATABASE_ENDPOINTS = ('courses.score_distribution', 'courses.score_percentile')
+
+storage_cli = AppGroup('storage', help="Manage the course data storage.")
+
+
+class RepositoryError(Exception):
+    """A write was refused, the message says why"""
+
+
+def columns(instance):
+    return {column.key: getattr(instance, column.key) for column in instance.__table__.columns}
+
+def as_id(value):
+    """Integer id of a route value, None when it is not one"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class SqlRepository:
+    """Course data read and written with the session"""
+    database = True
+
+    def get_course(self, id):
+        return statements.get(Course, id)
+
+    def list_courses(self, offset, limit):
+        return Course.query.order_by(Course.id).offset(offset).limit(limit).all()
+
+    def courses_by_ids(self, ids):
+        return fetch_by_ids(Course, ids)
+
+    def get_tee(self, id):
+        return statements.get(Tee, id)
+
+    def tees_by_ids(self, ids):
+        return fetch_by_ids(Tee, ids)
+
+    def get_hole(self, id):
+        return statements.get(Hole, id, statements.HOLE_WITH_YARDAGES)
+
+    def yardages_by_hole(self, holes):
+        return fetch_grouped(Yardage.hole_id, [hole.id for hole in holes], joinedload(Yardage.tee))
+
+    def course_features(self, ids=None):
+        """(course id, raw similarity features) of the given courses or all"""
+        from flask_app.similarity import feature_rows
+        return feature_rows(ids)
+
+    def commit(self):
+        try:
+            db.session.commit()
+        except DBAPIError as ex:
+            db.session.rollback()
+            raise RepositoryError(str(ex)) from ex
+
+    def create_course(self, data):
+        course = Course(**data)
+        db.session.add(course)
+        try:
+            db.session.flush()
+        except DBAPIError as ex:
+            db.session.rollback()
+            raise RepositoryError(str(ex)) from ex
+        course_id = course.id
+        self.commit()
+        return course_id
+
+    def create_tee(self, course, data):
+        tee = Tee(course=course, **data)
+        db.session.add(tee)
+        try:
+            db.session.flush()
+        except DBAPIError as ex:
+            db.session.rollback()
+            raise RepositoryError(str(ex)) from ex
+        tee_id = tee.id
+        self.commit()
+        return tee_id
+
+    def create_holes(self, course, items):
+        """Add holes to a course, items are (hole data, [(tee, yardage)])"""
+        for data, yardages in items:
+            hole = Hole(course=course, **data)
+            db.session.add(hole)
+            for tee, yardage in yardages:
+                db.session.add(Yardage(hole=hole, tee=tee, yardage=yardage))
+        self.commit()
+
+    def update_hole(self, hole, data, yardages):
+        """Set hole columns and its yardage from each (tee, yardage) given"""
+        yardages_by_tee = {yardage.tee_id: yardage for yardage in hole.tees}
+        for tee, value in yardages:
+            yardage = yardages_by_tee.get(tee.id)
+            if not yardage:
+                yardage = Yardage(tee=tee, hole=hole, yardage=0)
+                db.session.add(yardage)
+            yardage.yardage = value
+        for key in data.keys():
+            setattr(hole, key, data[key])
+        self.commit()
+
+    def update_tee(self, tee, data):
+        for key in data.keys():
+            setattr(tee, key, data[key])
+        self.commit()
+
+
+class MemoryRepository:
+    """Course data held in memory as detached model instances.
+
+    Writes are checked against the columns' types, NOT NULL and unique
+    constraints before anything changes, so a refused write leaves the data
+    as it was, like a rolled back transaction would. They hold a lock from
+    the check to the last change, and ids come from a counter per table."""
+    database = False
+
+    def __init__(self, read_only=False):
+        self.read_only = read_only
+        self.rows = {name: {} for name in MODELS}
+        self.next_ids = dict.fromkeys(MODELS, 1)
+        self.tees_by_colour = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path):
+        """Read only repository of a `flask storage dump` file"""
+        with open(path) as f:
+            snapshot = json.load(f)
+        if snapshot.get('format') != FORMAT:
+            raise ValueError(f"{path} is not a storage snapshot of format {FORMAT}.")
+        repository = cls()
+        courses, tees, holes = {}, {}, {}
+        for row in snapshot['courses']:
+            courses[row['id']] = repository.insert('courses', Course(**row))
+        for row in snapshot['tees']:
+            tees[row['id']] = repository.insert('tees', Tee(course=courses[row['course_id']], **row))
+        for row in snapshot['holes']:
+            holes[row['id']] = repository.insert('holes', Hole(course=courses[row['course_id']], **row))
+        for row in snapshot['yardages']:
+            repository.link(holes[row['hole_id']], tees[row['tee_id']], row['yardage'])
+        repository.read_only = True
+        return repository
+
+    def get_course(self, id):
+        return self.rows['courses'].get(as_id(id))
+
+    def list_courses(self, offset, limit):
+        return [self.rows['courses'][id] for id in sorted(self.rows['courses'])[offset:offset + limit]]
+
+    def courses_by_ids(self, ids):
+        return {id: self.rows['courses'][id] for id in ids if id in self.rows['courses']}
+
+    def get_tee(self, id):
+        return self.rows['tees'].get(as_id(id))
+
+    def tees_by_ids(self, ids):
+        return {id: self.rows['tees'][id] for id in ids if id in self.rows['tees']}
+
+    def get_hole(self, id):
+        return self.rows['holes'].get(as_id(id))
+
+    def yardages_by_hole(self, holes):
+        return {hole.id: list(hole.tees) for hole in holes}
+
+    def course_features(self, ids=None):
+        from flask_app.similarity import course_feature_values
+        courses = self.rows['courses']
+        return [
+            (id, course_feature_values(courses[id]))
+            for id in (courses if ids is None else ids) if id in courses
+        ]
+
+    def writable(self):
+        if self.read_only:
+            raise RepositoryError("This node serves course data read only.")
+
+    def check(self, model, values):
+        """Refuse values the table's columns would refuse"""
+        for column in model.__table__.columns:
+            value = values.get(column.key)
+            if value is None:
+                if not column.nullable and column.key != 'id':
+                    raise RepositoryError(f"null value in column \"{column.name}\" violates not-null constraint")
+                continue
+            expected = column.type.python_type
+            if expected is float and isinstance(value, int):
+                expected = int
+            if not isinstance(value, expected) or isinstance(value, bool):
+                raise RepositoryError(f"invalid value {value!r} for column \"{column.name}\"")
+
+    def insert(self, name, instance):
+        rows = self.rows[name]
+        if instance.id is None:
+            instance.id = self.next_ids[name]
+        self.next_ids[name] = max(self.next_ids[name], instance.id + 1)
+        course = getattr(instance, 'course', None)
+        if course is not None:
+            instance.course_id = course.id
+        rows[instance.id] = instance
+        if name == 'tees':
+            self.tees_by_colour[(instance.course_id, instance.colour)] = instance
+        return instance
+
+    def link(self, hole, tee, yardage):
+        return Yardage(hole=hole, tee=tee, hole_id=hole.id, tee_id=tee and tee.id, yardage=yardage)
+
+    def create_course(self, data):
+        self.writable()
+        with self._lock:
+            self.check(Course, data)
+            return self.insert('courses', Course(**data)).id
+
+    def create_tee(self, course, data):
+        self.writable()
+        with self._lock:
+            self.check(Tee, dict(data, course_id=course.id))
+            if (course.id, data['colour']) in self.tees_by_colour:
+                raise RepositoryError(
+                    "duplicate key value violates unique constraint \"course_colour_unique\""
+                )
+            return self.insert('tees', Tee(course=course, **data)).id
+
+    def create_holes(self, course, items):
+        self.writable()
+        with self._lock:
+            holes = []
+            for data, yardages in items:
+                self.check(Hole, dict(data, course_id=course.id))
+                for tee, yardage in yardages:
+                    self.check(Yardage, {'tee_id': tee and tee.id, 'hole_id': 0, 'yardage': yardage})
+                # built unattached, so the validators run before anything is added
+                holes.append((Hole(**data), yardages))
+            for hole, yardages in holes:
+                hole.course = course
+                self.insert('holes', hole)
+                for tee, yardage in yardages:
+                    self.link(hole, tee, yardage)
+
+    def update_hole(self, hole, data, yardages):
+        self.writable()
+        with self._lock:
+            self.check(Hole, dict(columns(hole), **data))
+            Hole(**data)
+            for tee, value in yardages:
+                self.check(Yardage, {'tee_id': tee.id, 'hole_id': hole.id, 'yardage': value})
+            yardages_by_tee = {yardage.tee_id: yardage for yardage in hole.tees}
+            for tee, value in yardages:
+                yardage = yardages_by_tee.get(tee.id)
+                if yardage:
+                    yardage.yardage = value
+                else:
+                    self.link(hole, tee, value)
+            for key in data.keys():
+                setattr(hole, key, data[key])
+
+    def update_tee(self, tee, data):
+        self.writable()
+        with self._lock:
+            self.check(Tee, dict(columns(tee), **data))
+            for key in data.keys():
+                setattr(tee, key, data[key])
+
+
+def repository():
+    return current_app.extensions['repository']
+
+def refuse_database_routes():
+    """Turn away the endpoints a memory backed node cannot serve"""
+    if request.blueprint in DATABASE_BLUEPRINTS or request.endpoint in DATABASE_ENDPOINTS:
+        abort(503, "This node serves course data from memory, rounds and users are not available.")
+
+def dump(path):
+    """Write the course data of the database to a snapshot file, returning
+    the number of rows of each table"""
+    snapshot = {'format': FORMAT, 'created': datetime.datetime.utcnow().isoformat()}
+    with db.engine.connect() as connection:
+        for name, model in MODELS.items():
+            table = model.__table__
+            query = table.select().order_by(*table.primary_key.columns)
+            snapshot[name] = [dict(row) for row in connection.execute(query)]
+    with open(path, 'w') as f:
+        json.dump(snapshot, f, separators=(',', ':'))
+    return {name: len(snapshot[name]) for name in MODELS}
+
+@storage_cli.command('dump')
+@click.argument('path')
+def dump_command(path):
+    """Write courses, tees, holes and yardages to a snapshot file at PATH."""
+    counts = dump(path)
+    click.echo(f"Wrote {', '.join(f'{count} {name}' for name, count in counts.items())} to {path}.")
+
+def init_app(app):
+    app.config.setdefault('STORAGE_BACKEND', os.environ.get('STORAGE_BACKEND', 'sql'))
+    app.config.setdefault('STORAGE_SNAPSHOT', os.environ.get('STORAGE_SNAPSHOT'))
+    app.cli.add_command(storage_cli)
+    backend = app.config['STORAGE_BACKEND']
+    if backend not in BACKENDS:
+        raise ValueError(f"STORAGE_BACKEND must be one of: {', '.join(BACKENDS)}.")
+    if backend == 'sql':
+        app.extensions['repository'] = SqlRepository()
+        return
+    app.before_request(refuse_database_routes)
+    if app.config['STORAGE_SNAPSHOT']:
+        app.extensions['repository'] = MemoryRepository.load(app.config['STORAGE_SNAPSHOT'])
+    elif app.testing:
+        app.extensions['repository'] = MemoryRepository()
+    else:
+        raise ValueError("STORAGE_BACKEND=memory needs STORAGE_SNAPSHOT outside of tests.")
@@ -0,0 +1,65 @@
+"""Session routing for the sharded tables.
+
+Tables marked with info={'sharded': True} (users, rounds, score_sketches)
+live on the shard databases once SHARD_DATABASE_URIS is set. Their
+statements go to the shard named in session.info['shard'], which
+shards.route() and shards.routed() set, and rows being flushed go to the
+shard of their own shard_key column whatever the current shard is. Every
+other table stays on the default database. Without shards configured the
+session behaves exactly like Flask-SQLAlchemy's.
+"""
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import orm
+from sqlalchemy.sql.util import find_tables
+
+
+class UnroutedError(RuntimeError):
+    """A sharded table was used without choosing a shard first"""
+
+
+def is_sharded(table):
+    return table.info.get('sharded', False)
+
+def sharded_tables(mapper=None, clause=None):
+    if mapper is not None:
+        return [table for table in mapper.tables if is_sharded(table)]
+    if clause is not None:
+        return [
+            table for table in find_tables(clause, include_crud=True)
+            if is_sharded(table)
+        ]
+    return []
+
+
+class RoutingSession(SignallingSession):
+    """Session sending the statements of sharded tables to the current shard"""
+
+    def __init__(self, db, **options):
+        super().__init__(db, **options)
+        if self.app.extensions.get('shards') is not None:
+            self.connection_callable = self.connection_for_instance
+
+    def get_bind(self, mapper=None, clause=None):
+        shards = self.app.extensions.get('shards')
+        if shards is not None and sharded_tables(mapper, clause):
+            shard = self.info.get('shard')
+            if shard is None:
+                raise UnroutedError(
+                    f"No shard chosen for {mapper or clause}, use shards.routed()."
+                )
+            return shards.engine(shard)
+        return super().get_bind(mapper, clause)
+
+    def connection_for_instance(self, mapper, instance):
+        """Connection a flushed row is written with, its own shard for rows of
+        sharded tables with a shard key"""
+        shards = self.app.extensions['shards']
+        key = mapper.local_table.info.get('shard_key')
+        if key is not None and getattr(instance, key, None) is not None:
+            return self.connection(mapper, bind=shards.engine(shards.shard_for(getattr(instance, key))))
+        return self.connection(mapper)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
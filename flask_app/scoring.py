@@ -0,0 +1,95 @@
+"""Competition formats scored for a whole field at once.
+
+A field's hole scores are stacked into a (players x holes) float array,
+nan where a hole has no score, and every format is computed with array
+operations over it, never looping over players or holes in Python:
+
+    strokes     handicap strokes received on each hole, from the playing
+                handicaps and the holes' stroke indexes
+    stableford  points per player, 2 for a net par, 1 more per stroke
+                under and 1 less per stroke over, never below 0
+    skins       the hole goes to the single lowest net score, ties carry
+                its skin over to the next hole
+    match play  hole by hole between pairs of players, closed out once a
+                player is up by more holes than are left
+
+A hole without a score scores no Stableford points, cannot win a skin and
+loses the hole in match play, unless neither player has a score for it.
+"""
+import numpy as np
+
+
+def score_matrix(scores_by_player):
+    """The hole scores of each player as a (players x holes) array, None
+    scores as nan. Every player must have the same number of holes."""
+    return np.array(scores_by_player, dtype=float).reshape(len(scores_by_player), -1)
+
+def stroke_ranks(stroke_indexes):
+    """Stroke indexes of the holes played renumbered 1..holes, so the nine
+    holes of a nine hole round keep their order of difficulty"""
+    ranks = np.empty(len(stroke_indexes), dtype=int)
+    ranks[np.argsort(stroke_indexes, kind='stable')] = np.arange(1, len(stroke_indexes) + 1)
+    return ranks
+
+def strokes_received(handicaps, stroke_indexes):
+    """Strokes each player receives on each hole, (players x holes). Every
+    player gets handicap // holes strokes a hole, plus one on the holes whose
+    stroke index is at most the remainder. A plus handicap gives strokes back
+    on the easiest holes, which floor division and a non negative remainder
+    handle without a special case."""
+    handicaps = np.asarray(handicaps, dtype=int)[:, None]
+    ranks = stroke_ranks(stroke_indexes)[None, :]
+    holes = ranks.shape[1]
+    return handicaps // holes + (ranks <= handicaps % holes)
+
+def totals(scores):
+    """Sum and count of the scored holes of each player"""
+    return np.nansum(scores, axis=1), np.count_nonzero(~np.isnan(scores), axis=1)
+
+def stableford(scores, pars, strokes):
+    """Stableford points of each player"""
+    points = np.clip(2 + np.asarray(pars)[None, :] + strokes - scores, 0, None)
+    return np.nansum(points, axis=1).astype(int)
+
+def skins(net):
+    """Skins of each player, and the holes won as (hole index, player index,
+    skins) plus the skins still carried after the last hole"""
+    players, holes = net.shape
+    if not players or not holes:
+        return np.zeros(players, dtype=int), [], 0
+    lowest = np.where(np.isnan(net), np.inf, net)
+    best = lowest.min(axis=0)
+    won = np.isfinite(best) & ((lowest == best).sum(axis=0) == 1)
+    won_holes = np.flatnonzero(won)
+    # a won hole collects its own skin and every one carried to it
+    values = np.diff(np.concatenate(([-1], won_holes)))
+    winners = lowest[:, won_holes].argmin(axis=0)
+    counts = np.zeros(players, dtype=int)
+    np.add.at(counts, winners, values)
+    carried = holes - 1 - (won_holes[-1] if len(won_holes) else -1)
+    return counts, list(zip(won_holes.tolist(), winners.tolist(), values.tolist())), int(carried)
+
+def match_play(first, second):
+    """Matches between the rows of first and second, net scores both
+    (matches x holes). Returns the first player's margin when the match
+    ended (positive when they won) and the holes left at that point, 0
+    for a match played to the last hole."""
+    first = np.where(np.isnan(first), np.inf, first)
+    second = np.where(np.isnan(second), np.inf, second)
+    # holes neither player scored are halved, inf - inf would be nan
+    results = np.where(first == second, 0, np.sign(second - first)).astype(int)
+    running = np.cumsum(results, axis=1)
+    holes = results.shape[1]
+    left = holes - 1 - np.arange(holes)
+    closed = np.abs(running) > left[None, :]
+    ended = np.where(closed.any(axis=1), closed.argmax(axis=1), holes - 1)
+    rows = np.arange(len(results))
+    return running[rows, ended], left[ended]
+
+def match_result(margin, left):
+    """A match result as written on a card, e.g. 3&2, 2 up or halved"""
+    if margin == 0:
+        return 'halved'
+    if left:
+        return f"{abs(margin)}&{left}"
+    return f"{abs(margin)} up"
@@ -0,0 +1,445 @@
+"""Sharding of users and their rounds by user id.
+
+With SHARD_DATABASE_URIS set to a comma separated list of databases, named
+shard0, shard1, ... in that order, users, rounds and score_sketches live on
+the shards while the default database keeps everything else. User ids are
+hashed into BUCKETS buckets (id % BUCKETS) and the shard_buckets table on
+the default database maps buckets to shards; a bucket missing from it falls
+to shard (bucket % number of shards). Run `flask shards init` once to write
+the map down before ever adding a shard, otherwise the fallback moves users.
+
+Course reference data (courses, holes, tees, yardages, events) is written
+to the default database and replicated to every shard after each commit,
+so rounds keep their foreign keys and join tees locally. User ids come from
+the default database's users_id_seq. Round ids come from each shard's own
+sequence, stepping by MAX_SHARDS from a different start on every shard, so
+they stay unique across shards and across bucket moves.
+
+    flask shards create-tables      create the shard tables
+    flask shards init               persist the current bucket map
+    flask shards sync-reference     copy all reference data to the shards
+    flask shards move BUCKET SHARD  move a bucket of users to another shard
+    flask shards status             users, rounds and buckets per shard
+"""
+import contextlib, os, threading, time
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import event, inspect, literal, select, text, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import DBAPIError
+from werkzeug.exceptions import ServiceUnavailable
+from flask_app import db
+from flask_app.config import env_int
+from flask_app.models import Round, RoundChange, ShardBucket, User
+from flask_app.routing import RoutingSession, is_sharded
+
+BUCKETS = 256
+MAX_SHARDS = 64
+COPY_BATCH = 1000
+REFERENCE_TABLES = ('courses', 'holes', 'tees', 'yardages', 'events')
+
+shards_cli = AppGroup('shards', help="Manage the user shards.")
+
+
+def bucket(user_id):
+    return user_id % BUCKETS
+
+def shard_name(index):
+    return f"shard{index}"
+
+def reference_tables():
+    """The replicated tables, parents before children"""
+    return [table for table in db.metadata.sorted_tables if table.name in REFERENCE_TABLES]
+
+def shard_tables():
+    """Every table a shard holds, parents before children"""
+    return [
+        table for table in db.metadata.sorted_tables
+        if table.name in REFERENCE_TABLES or is_sharded(table)
+    ]
+
+
+class ShardMap(object):
+    """Shard of each bucket of users, reloaded every ttl seconds so that
+    bucket moves reach every process"""
+
+    def __init__(self, app, names, ttl):
+        self.app = app
+        self.names = names
+        self.ttl = ttl
+        self._buckets = None
+        self._moving = frozenset()
+        self._loaded = 0.0
+        self._lock = threading.Lock()
+
+    def engine(self, name=None):
+        return db.get_engine(self.app, bind=name)
+
+    def default(self):
+        return {number: self.names[number % len(self.names)] for number in range(BUCKETS)}
+
+    def load(self):
+        buckets, moving = self.default(), set()
+        try:
+            with self.engine().connect() as connection:
+                for row in connection.execute(select([ShardBucket.__table__])):
+                    buckets[row.bucket] = row.shard
+                    if row.moving:
+                        moving.add(row.bucket)
+        except DBAPIError as ex:
+            self.app.logger.warning(f"Using the default shard map: {ex.orig}")
+        self._buckets, self._moving = buckets, frozenset(moving)
+        self._loaded = time.monotonic()
+
+    def refresh(self, force=False):
+        if force or self._buckets is None or time.monotonic() - self._loaded > self.ttl:
+            with self._lock:
+                self.load()
+
+    def lookup(self, user_id):
+        """The shard of a user and whether the user's bucket is being moved"""
+        self.refresh()
+        number = bucket(user_id)
+        return self._buckets[number], number in self._moving
+
+    def shard_for(self, user_id):
+        return self.lookup(user_id)[0]
+
+    def buckets(self):
+        self.refresh()
+        return dict(self._buckets)
+
+
+def shard_map():
+    return db.get_app().extensions.get('shards')
+
+def names():
+    """Names of the shards, empty without sharding"""
+    shards = shard_map()
+    return list(shards.names) if shards else []
+
+def shard_for(user_id):
+    shards = shard_map()
+    return shards.shard_for(user_id) if shards else None
+
+@contextlib.contextmanager
+def routed(shard):
+    """Send the session's statements on sharded tables to shard in the block"""
+    info = db.session.info
+    previous = info.get('shard')
+    info['shard'] = shard
+    try:
+        yield
+    finally:
+        info['shard'] = previous
+
+def route(user_id, write=False):
+    """Send the rest of the request's statements to the user's shard. Writes
+    to a bucket being moved are turned away until the move completes."""
+    shards = shard_map()
+    if shards is None or user_id is None:
+        return
+    shard, moving = shards.lookup(user_id)
+    if moving and write:
+        raise ServiceUnavailable(
+            "This user's data is being moved, retry shortly.",
+            retry_after=current_app.config['SHARD_MOVE_RETRY_AFTER_SECONDS']
+        )
+    db.session.info['shard'] = shard
+
+def each():
+    """Route to every shard in turn, or once to the default database when
+    there are no shards"""
+    for shard in names() or [None]:
+        with routed(shard):
+            yield shard
+
+def by_shard(user_ids):
+    groups = {}
+    for user_id in dict.fromkeys(user_ids):
+        groups.setdefault(shard_for(user_id), []).append(user_id)
+    return groups
+
+def gather(load, user_ids):
+    """Merge the dicts load(ids) returns for the ids held by each shard, one
+    call per shard"""
+    merged = {}
+    for shard, ids in by_shard(user_ids).items():
+        with routed(shard):
+            merged.update(load(ids))
+    return merged
+
+
+def primary_key(instance):
+    return tuple(inspect(instance).mapper.primary_key_from_instance(instance))
+
+def upsert(connection, table, rows):
+    keys = [column.name for column in table.primary_key]
+    statement = insert(table)
+    columns = {
+        column.name: statement.excluded[column.name]
+        for column in table.columns if column.name not in keys
+    }
+    statement = statement.on_conflict_do_update(index_elements=keys, set_=columns)
+    connection.execute(statement, [dict(row) for row in rows])
+
+def replicate(app, changes):
+    """Copy changed reference rows from the default database to every shard,
+    changes maps table names to {'upsert': keys, 'delete': keys}"""
+    shards = app.extensions['shards']
+    tables = [table for table in reference_tables() if table.name in changes]
+    rows = {}
+    with shards.engine().connect() as connection:
+        for table in tables:
+            keys = list(changes[table.name]['upsert'])
+            if keys:
+                rows[table.name] = connection.execute(select([table]).where(
+                    tuple_(*table.primary_key.columns).in_(keys)
+                )).fetchall()
+    for name in shards.names:
+        try:
+            with shards.engine(name).begin() as connection:
+                for table in tables:
+                    if rows.get(table.name):
+                        upsert(connection, table, rows[table.name])
+                for table in reversed(tables):
+                    keys = list(changes[table.name]['delete'])
+                    if keys:
+                        connection.execute(table.delete().where(
+                            tuple_(*table.primary_key.columns).in_(keys)
+                        ))
+        except DBAPIError as ex:
+            app.logger.error(
+                f"Replicating {', '.join(changes)} to {name} failed, "
+                f"run `flask shards sync-reference`: {ex.orig}"
+            )
+
+def sync_reference(app):
+    """Make every shard's reference tables a copy of the default database's"""
+    shards = app.extensions['shards']
+    tables = reference_tables()
+    with shards.engine().connect() as connection:
+        rows = {table.name: connection.execute(select([table])).fetchall() for table in tables}
+    for name in shards.names:
+        with shards.engine(name).begin() as connection:
+            for table in tables:
+                if rows[table.name]:
+                    upsert(connection, table, rows[table.name])
+            for table in reversed(tables):
+                columns = list(table.primary_key.columns)
+                keep = {tuple(row[column.name] for column in columns) for row in rows[table.name]}
+                stale = [
+                    tuple(row) for row in connection.execute(select(columns))
+                    if tuple(row) not in keep
+                ]
+                if stale:
+                    connection.execute(table.delete().where(tuple_(*columns).in_(stale)))
+
+def prepare_sequence(connection, index):
+    """Step the shard's round ids by MAX_SHARDS starting from its index, so
+    the ids of different shards never collide"""
+    last = connection.execute(text("SELECT COALESCE(max(id), 0) FROM rounds")).scalar()
+    start = (last // MAX_SHARDS + 1) * MAX_SHARDS + index + 1
+    sequence = connection.execute(text("SELECT pg_get_serial_sequence('rounds', 'id')")).scalar()
+    connection.execute(text(f"ALTER SEQUENCE {sequence} INCREMENT BY {MAX_SHARDS}"))
+    connection.execute(text("SELECT setval(:sequence, :start, false)"), sequence=sequence, start=start)
+
+def create_tables(app):
+    shards = app.extensions['shards']
+    for index, name in enumerate(shards.names):
+        engine = shards.engine(name)
+        db.metadata.create_all(engine, tables=shard_tables())
+        with engine.begin() as connection:
+            prepare_sequence(connection, index)
+
+def drop_tables(app):
+    shards = app.extensions['shards']
+    for name in shards.names:
+        db.metadata.drop_all(shards.engine(name), tables=shard_tables())
+
+def set_bucket(connection, number, shard, moving):
+    statement = insert(ShardBucket.__table__).values(bucket=number, shard=shard, moving=moving)
+    connection.execute(statement.on_conflict_do_update(
+        index_elements=['bucket'], set_={'shard': shard, 'moving': moving}
+    ))
+
+def in_bucket(column, number):
+    return column % BUCKETS == number
+
+def copy_bucket(source, target, number):
+    """Copy a bucket's users and rounds, replacing any partial earlier copy"""
+    tables = ((User.__table__, User.__table__.c.id), (Round.__table__, Round.__table__.c.user_id))
+    copied = {}
+    with source.connect() as reader, target.begin() as writer:
+        for table, key in reversed(tables):
+            writer.execute(table.delete().where(in_bucket(key, number)))
+        for table, key in tables:
+            result = reader.execution_options(stream_results=True).execute(
+                select([table]).where(in_bucket(key, number))
+            )
+            copied[table.name] = 0
+            while True:
+                rows = result.fetchmany(COPY_BATCH)
+                if not rows:
+                    break
+                writer.execute(table.insert(), [dict(row) for row in rows])
+                copied[table.name] += len(rows)
+        # the target's change log starts every moved round afresh for /sync
+        rounds = Round.__table__
+        writer.execute(RoundChange.__table__.insert().from_select(
+            ['user_id', 'round_id', 'op'],
+            select([rounds.c.user_id, rounds.c.id, literal('upsert')])
+            .where(in_bucket(rounds.c.user_id, number))
+        ))
+    return copied
+
+def delete_bucket(engine, number):
+    with engine.begin() as connection:
+        connection.execute(RoundChange.__table__.delete().where(
+            in_bucket(RoundChange.__table__.c.user_id, number)
+        ))
+        connection.execute(Round.__table__.delete().where(in_bucket(Round.__table__.c.user_id, number)))
+        connection.execute(User.__table__.delete().where(in_bucket(User.__table__.c.id, number)))
+
+def move_bucket(app, number, target, wait=None):
+    """Move one bucket of users with their rounds to the target shard.
+
+    Writes to the bucket are refused while it moves: the bucket is flagged,
+    every process is given wait seconds (the map ttl by default) to notice,
+    the rows are copied, the map is switched while still flagged and after
+    another wait, once no process can still write to the source, the flag
+    is cleared and the source rows are deleted. Reads carry on throughout."""
+    from flask_app import sketches
+    shards = app.extensions['shards']
+    wait = shards.ttl if wait is None else wait
+    shards.refresh(force=True)
+    source = shards.buckets()[number]
+    if target not in shards.names:
+        raise click.ClickException(f"Unknown shard {target}, choose from: {', '.join(shards.names)}.")
+    if source == target:
+        return {}
+    with shards.engine().begin() as connection:
+        set_bucket(connection, number, source, True)
+    time.sleep(wait)
+    copied = copy_bucket(shards.engine(source), shards.engine(target), number)
+    with shards.engine().begin() as connection:
+        set_bucket(connection, number, target, True)
+    time.sleep(wait)
+    with shards.engine().begin() as connection:
+        set_bucket(connection, number, target, False)
+    delete_bucket(shards.engine(source), number)
+    for shard in (source, target):
+        with routed(shard):
+            sketches.rebuild()
+    shards.refresh(force=True)
+    return copied
+
+
+def _assign_user_ids(session, flush_context, instances):
+    """New users take their id from the default database before they are
+    routed by it"""
+    if session.app.extensions.get('shards') is None:
+        return
+    for instance in session.new:
+        if isinstance(instance, User) and instance.id is None:
+            instance.id = session.execute(text("SELECT nextval('users_id_seq')")).scalar()
+
+def _collect_reference_changes(session, flush_context):
+    if session.app.extensions.get('shards') is None:
+        return
+    # dirty also holds rows whose collections changed, e.g. a course gaining
+    # a round, which have nothing to replicate
+    modified = [
+        instance for instance in session.dirty
+        if session.is_modified(instance, include_collections=False)
+    ]
+    changes = session.info.setdefault('replicate', {})
+    for instances, kind in ((session.new, 'upsert'), (modified, 'upsert'), (session.deleted, 'delete')):
+        for instance in instances:
+            name = instance.__table__.name
+            if name in REFERENCE_TABLES:
+                keys = changes.setdefault(name, {'upsert': set(), 'delete': set()})
+                keys[kind].add(primary_key(instance))
+
+def _replicate_after_commit(session):
+    changes = session.info.pop('replicate', None)
+    if changes:
+        replicate(session.app, changes)
+
+def _forget_after_rollback(session, previous_transaction):
+    session.info.pop('replicate', None)
+
+def install_session_hooks():
+    if not event.contains(RoutingSession, 'before_flush', _assign_user_ids):
+        event.listen(RoutingSession, 'before_flush', _assign_user_ids)
+        event.listen(RoutingSession, 'after_flush', _collect_reference_changes)
+        event.listen(RoutingSession, 'after_commit', _replicate_after_commit)
+        event.listen(RoutingSession, 'after_soft_rollback', _forget_after_rollback)
+
+
+@shards_cli.command('create-tables')
+def create_tables_command():
+    """Create the user, round and reference tables on every shard."""
+    create_tables(current_app)
+    sync_reference(current_app)
+    click.echo(f"Created the tables on {', '.join(names())}.")
+
+@shards_cli.command('init')
+def init_command():
+    """Persist the current bucket map, run before adding shards."""
+    buckets = shard_map().buckets()
+    with db.engine.begin() as connection:
+        for number, shard in buckets.items():
+            set_bucket(connection, number, shard, False)
+    click.echo(f"Stored the shard of {len(buckets)} buckets.")
+
+@shards_cli.command('sync-reference')
+def sync_reference_command():
+    """Copy all course reference data to every shard."""
+    sync_reference(current_app)
+    click.echo(f"Synchronized {', '.join(REFERENCE_TABLES)} to {', '.join(names())}.")
+
+@shards_cli.command('move')
+@click.argument('number', type=int)
+@click.argument('target')
+@click.option('--wait', type=float, default=None,
+    help="Seconds for other processes to see each map change, the map TTL by default.")
+def move_command(number, target, wait):
+    """Move bucket NUMBER of users and their rounds to shard TARGET."""
+    if not 0 <= number < BUCKETS:
+        raise click.ClickException(f"Buckets are numbered 0 to {BUCKETS - 1}.")
+    copied = move_bucket(current_app, number, target, wait)
+    click.echo(f"Moved bucket {number} to {target}: {copied or 'already there'}.")
+
+@shards_cli.command('status')
+def status_command():
+    """Show the buckets, users and rounds of every shard."""
+    shards = shard_map()
+    buckets = shards.buckets()
+    for name in shards.names:
+        with shards.engine(name).connect() as connection:
+            users = connection.execute(text("SELECT count(*) FROM users")).scalar()
+            rounds = connection.execute(text("SELECT count(*) FROM rounds")).scalar()
+        owned = sum(1 for shard in buckets.values() if shard == name)
+        click.echo(f"{name}: {owned} buckets, {users} users, {rounds} rounds")
+
+def init_app(app):
+    """Configure a bind per shard and the shard map when shards are listed"""
+    app.config.setdefault('SHARD_DATABASE_URIS', [
+        uri.strip() for uri in os.environ.get('SHARD_DATABASE_URIS', '').split(',') if uri.strip()
+    ])
+    app.config.setdefault('SHARD_MAP_TTL_SECONDS', env_int('SHARD_MAP_TTL_SECONDS', 30))
+    app.config.setdefault('SHARD_MOVE_RETRY_AFTER_SECONDS', env_int('SHARD_MOVE_RETRY_AFTER_SECONDS', 5))
+    app.cli.add_command(shards_cli)
+    uris = app.config['SHARD_DATABASE_URIS']
+    if not uris:
+        return
+    if len(uris) > MAX_SHARDS:
+        raise ValueError(f"At most {MAX_SHARDS} shards are supported.")
+    shard_names = [shard_name(index) for index in range(len(uris))]
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    binds.update(zip(shard_names, uris))
+    app.config['SQLALCHEMY_BINDS'] = binds
+    app.extensions['shards'] = ShardMap(app, shard_names, app.config['SHARD_MAP_TTL_SECONDS'])
+    install_session_hooks()
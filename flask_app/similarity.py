@@ -0,0 +1,236 @@
+"""Courses similar to a course, from an in-memory feature matrix.
+
+Every course is described by FEATURES: its par and number of holes, the
+share of par 3, 4 and 5 holes, the total yardage of its longest and shortest
+tee and the highest course and slope rating of its tees. The raw values of
+all courses sit in one NumPy array, one row per course, built with a single
+aggregate query. Each column is scaled to zero mean and unit variance, a
+missing value (no tees yet, no rating) counts as the average, and similar
+courses are the nearest rows by euclidean distance, found for a batch of
+courses with one matrix product over the whole catalogue.
+
+The index is built on first use and kept up to date from the change log
+(see changes.py): at most every SIMILARITY_REFRESH_SECONDS a request reads
+the course, hole, tee and yardage changes committed since the last look,
+and only the courses they touch are queried again. The column scaling is
+recomputed after every update, which is cheap next to the query. The rows
+come from the course repository, so STORAGE_BACKEND=memory computes them
+from the courses in memory; that backend keeps no change log and the index
+is rebuilt from it in full once the ttl has passed.
+"""
+import threading, time
+import numpy as np
+from sqlalchemy import func, select
+from flask_app import db
+from flask_app.config import env_int
+from flask_app.models import ChangeLog, Course, Hole, Tee, Yardage
+from flask_app.repository import repository
+
+FEATURES = (
+    'par', 'holes', 'par3', 'par4', 'par5', 'longest', 'shortest', 'course_rating', 'slope_rating'
+)
+DEFAULT_K = 10
+MAX_K = 100
+# change log entries read per query while catching up
+LOG_BATCH = 5000
+
+
+def feature_rows(course_ids=None):
+    """(course id, raw feature values) of the given courses, or of all of
+    them, in one query"""
+    def only(query, column):
+        return query if course_ids is None else query.filter(column.in_(course_ids))
+
+    holes = only(db.session.query(
+        Hole.course_id,
+        func.sum(Hole.par).label('par'),
+        func.count().label('holes'),
+        func.count().filter(Hole.par == 3).label('par3'),
+        func.count().filter(Hole.par == 4).label('par4'),
+        func.count().filter(Hole.par == 5).label('par5'),
+    ), Hole.course_id).group_by(Hole.course_id).subquery()
+    totals = only(db.session.query(
+        Tee.course_id, Tee.course_rating, Tee.slope_rating,
+        func.sum(Yardage.yardage).label('yardage'),
+    ).outerjoin(Yardage, Yardage.tee_id == Tee.id), Tee.course_id).group_by(Tee.id).subquery()
+    tees = db.session.query(
+        totals.c.course_id,
+        func.max(totals.c.yardage).label('longest'),
+        func.min(totals.c.yardage).label('shortest'),
+        func.max(totals.c.course_rating).label('course_rating'),
+        func.max(totals.c.slope_rating).label('slope_rating'),
+    ).group_by(totals.c.course_id).subquery()
+    query = only(db.session.query(
+        Course.id,
+        holes.c.par, holes.c.holes, holes.c.par3, holes.c.par4, holes.c.par5,
+        tees.c.longest, tees.c.shortest, tees.c.course_rating, tees.c.slope_rating,
+    ).outerjoin(holes, holes.c.course_id == Course.id)
+     .outerjoin(tees, tees.c.course_id == Course.id), Course.id)
+    for row in query:
+        par, holes_count, par3, par4, par5 = (value or 0 for value in row[1:6])
+        shares = [count / holes_count if holes_count else 0.0 for count in (par3, par4, par5)]
+        yield row[0], [par, holes_count] + shares + [
+            np.nan if value is None else value for value in row[6:]
+        ]
+
+def course_feature_values(course):
+    """Raw feature values of a course from its holes and tees, the same
+    values feature_rows() aggregates in SQL"""
+    pars = [hole.par for hole in course.holes]
+    holes_count = len(pars)
+    shares = [
+        sum(1 for par in pars if par == number) / holes_count if holes_count else 0.0
+        for number in (3, 4, 5)
+    ]
+    totals = []
+    for tee in course.tees:
+        yardages = [yardage.yardage for yardage in tee.holes if yardage.yardage is not None]
+        if yardages:
+            totals.append(sum(yardages))
+    def highest(values):
+        values = [value for value in values if value is not None]
+        return max(values) if values else np.nan
+    return [sum(par for par in pars if par is not None), holes_count] + shares + [
+        max(totals) if totals else np.nan,
+        min(totals) if totals else np.nan,
+        highest(tee.course_rating for tee in course.tees),
+        highest(tee.slope_rating for tee in course.tees),
+    ]
+
+def scale(raw):
+    """Columns of raw to zero mean and unit variance, missing values to 0"""
+    if not len(raw):
+        return raw
+    with np.errstate(invalid='ignore'):
+        mean = np.nanmean(raw, axis=0)
+        std = np.nanstd(raw, axis=0)
+    scaled = (raw - np.nan_to_num(mean)) / np.where(std > 0, std, 1.0)
+    return np.nan_to_num(scaled)
+
+
+class CourseIndex(object):
+    """Feature rows of every course with a nearest neighbour search, caught
+    up with the change log every ttl seconds"""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._rows = None
+        self.set_rows(np.empty(0, dtype=np.int64), np.empty((0, len(FEATURES))))
+        self._cursor = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._rows[0])
+
+    @property
+    def ids(self):
+        return self._rows[0]
+
+    @property
+    def raw(self):
+        return self._rows[1]
+
+    def set_rows(self, ids, raw):
+        """Swap in new rows in one assignment, so a search running meanwhile
+        sees either the old arrays or the new ones"""
+        matrix = scale(raw)
+        positions = {id: position for position, id in enumerate(ids.tolist())}
+        self._rows = (ids, raw, matrix, np.einsum('ij,ij->i', matrix, matrix), positions)
+
+    def build(self):
+        """Load the rows of every course"""
+        store = repository()
+        horizon = None
+        if store.database:
+            # every transaction older than the snapshot is already in the rows
+            # read next, the log is followed from there
+            horizon = db.session.execute(
+                select([func.txid_snapshot_xmin(func.txid_current_snapshot())]),
+                mapper=ChangeLog.__mapper__
+            ).scalar()
+        rows = list(store.course_features())
+        ids = np.array([id for id, _ in rows], dtype=np.int64)
+        raw = np.array([values for _, values in rows], dtype=float).reshape(len(rows), len(FEATURES))
+        self.set_rows(ids, raw)
+        self._cursor = [horizon, 0]
+
+    def update(self, course_ids):
+        """Query the rows of the given courses again, adding new courses and
+        dropping deleted ones"""
+        if not course_ids:
+            return
+        fresh = dict(repository().course_features(list(course_ids)))
+        keep = ~np.isin(self.ids, list(course_ids))
+        added = sorted(fresh)
+        ids = np.concatenate([self.ids[keep], np.array(added, dtype=np.int64)])
+        raw = np.vstack([
+            self.raw[keep],
+            np.array([fresh[id] for id in added], dtype=float).reshape(len(added), len(FEATURES))
+        ])
+        order = np.argsort(ids, kind='stable')
+        self.set_rows(ids[order], raw[order])
+
+    def changed_courses(self):
+        """Courses touched by the changes logged after the cursor, moving the
+        cursor past them"""
+        from flask_app.sync_views import parse_key, read_log
+        keys = {'courses': set(), 'holes': set(), 'tees': set(), 'yardages': set()}
+        more = True
+        while more:
+            entries = read_log(ChangeLog, self._cursor, LOG_BATCH)
+            more = len(entries) > LOG_BATCH
+            for entry in entries[:LOG_BATCH]:
+                keys[entry.entity].add(parse_key(entry.key)[0])
+                self._cursor = [entry.txid, entry.id]
+        courses = set(keys['courses'])
+        # a yardage key starts with its tee id, holes and tees already
+        # deleted have nothing left to point at their course
+        tee_ids = keys['tees'] | keys['yardages']
+        if keys['holes']:
+            courses.update(id for id, in db.session.query(Hole.course_id).filter(Hole.id.in_(keys['holes'])))
+        if tee_ids:
+            courses.update(id for id, in db.session.query(Tee.course_id).filter(Tee.id.in_(tee_ids)))
+        courses.discard(None)
+        return courses
+
+    def refresh(self, force=False):
+        """Build the index or catch it up with the change log once the ttl
+        has passed"""
+        if not force and self._cursor is not None and time.monotonic() - self._checked < self.ttl:
+            return
+        with self._lock:
+            if self._cursor is None or not repository().database:
+                self.build()
+            else:
+                self.update(self.changed_courses())
+            self._checked = time.monotonic()
+
+    def nearest(self, course_ids, k):
+        """The k courses nearest to each of course_ids, as lists of (id,
+        distance) closest first. Courses not in the index get None."""
+        ids, _, matrix, norms, positions = self._rows
+        found = [positions.get(id) for id in course_ids]
+        rows = [position for position in found if position is not None]
+        results = {}
+        if rows and len(ids) > 1:
+            k = min(k, len(ids) - 1)
+            queries = matrix[rows]
+            distances = norms[rows][:, None] - 2 * queries @ matrix.T + norms[None, :]
+            distances[np.arange(len(rows)), rows] = np.inf
+            nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+            for number, row in enumerate(rows):
+                picked = nearest[number][np.argsort(distances[number, nearest[number]], kind='stable')]
+                results[row] = [
+                    (int(ids[column]), float(np.sqrt(max(distances[number, column], 0.0))))
+                    for column in picked
+                ]
+        return [None if position is None else results.get(position, []) for position in found]
+
+
+def index():
+    return db.get_app().extensions['similarity']
+
+def init_app(app):
+    app.config.setdefault('SIMILARITY_REFRESH_SECONDS', env_int('SIMILARITY_REFRESH_SECONDS', 5))
+    app.extensions['similarity'] = CourseIndex(app.config['SIMILARITY_REFRESH_SECONDS'])
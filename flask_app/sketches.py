@@ -0,0 +1,191 @@
+"""Score distributions per tee, kept up to date as rounds are scored.
+
+Round totals are small bounded integers, so instead of an approximate
+quantile sketch (t-digest, KLL) each (tee, holes) pair keeps one counter per
+possible total, from one stroke a hole up to MAX_STROKES_PER_HOLE strokes a
+hole. That is a few hundred bytes per tee, merges by adding counts, and is
+exact: percentiles and ranks carry no error for totals inside that range,
+higher totals are pooled into the top counter so only their relative order
+is lost. A query for one tee reads that tee's row, one for a whole course
+reads a row per tee and merges them by adding counts, and either walks at
+most holes * 10 counters.
+
+Only completed rounds are counted. A round enters the histogram when its
+last hole is scored and moves bins when a score of a completed round is
+corrected, in the same transaction as the round update.
+"""
+import click
+from flask.cli import AppGroup
+from sqlalchemy import func, literal
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import insert
+from flask_app import db, shards
+from flask_app.models import Round, ScoreSketch
+
+MAX_STROKES_PER_HOLE = 10
+HOLE_COUNTS = (9, 18)
+QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+
+sketches_cli = AppGroup('sketches', help="Maintain the per tee score distributions.")
+
+
+class Sketch(object):
+    """Counts of round totals from one or more tees, for one number of holes"""
+
+    def __init__(self, holes, counts=()):
+        self.holes = holes
+        self.counts = [count or 0 for count in counts]
+
+    @property
+    def total(self):
+        return sum(self.counts)
+
+    def bin(self, score):
+        return min(max(score, self.holes), self.holes * MAX_STROKES_PER_HOLE) - self.holes
+
+    def merge(self, other):
+        """Add the counts of another sketch of the same number of holes"""
+        if len(other.counts) > len(self.counts):
+            self.counts.extend([0] * (len(other.counts) - len(self.counts)))
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        return self
+
+    def rank(self, score):
+        """Numbers of rounds with a lower total, the same total, and a higher
+        total than score"""
+        index = self.bin(score)
+        below = sum(self.counts[:index])
+        ties = self.counts[index] if index < len(self.counts) else 0
+        return below, ties, self.total - below - ties
+
+    def percentile(self, score):
+        """Percentage of rounds that score beats, ties counting half"""
+        total = self.total
+        if not total:
+            return None
+        below, ties, above = self.rank(score)
+        return round(100 * (above + ties / 2) / total, 1)
+
+    def quantile(self, q):
+        """Lowest total with at least a fraction q of rounds at or below it"""
+        total = self.total
+        if not total:
+            return None
+        target, seen = q * total, 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= target:
+                return self.holes + i
+        return self.holes + len(self.counts) - 1
+
+    def histogram(self):
+        return [
+            {'score': self.holes + i, 'count': count}
+            for i, count in enumerate(self.counts) if count
+        ]
+
+    def format(self):
+        return {
+            'holes': self.holes,
+            'rounds': self.total,
+            'quantiles': {str(q): self.quantile(q) for q in QUANTILES},
+            'histogram': self.histogram()
+        }
+
+
+def round_total(scores):
+    """Total of a completed round and its number of holes, None otherwise"""
+    if not scores or len(scores) not in HOLE_COUNTS or None in scores:
+        return None
+    return len(scores), sum(scores)
+
+def load(course_id, holes, tee_id=None):
+    """Sketch of one tee, or of the whole course merged over its tees"""
+    query = ScoreSketch.query.filter_by(course_id=course_id, holes=holes)
+    if tee_id is not None:
+        query = query.filter_by(tee_id=tee_id)
+    sketch = Sketch(holes)
+    for shard in shards.each():
+        for row in query:
+            sketch.merge(Sketch(holes, row.counts))
+    return sketch
+
+def increment(counts, index, delta):
+    """SQL expression adding delta to counts[index], index is 1-based"""
+    return func.array_set_element(
+        counts, index, func.coalesce(counts[index], 0) + literal(delta, db.Integer),
+        type_=postgresql.ARRAY(db.Integer)
+    )
+
+def record(course_id, tee_id, previous_scores, scores):
+    """Move a round's total between histogram bins after its scores changed,
+    with a single upsert. previous_scores is None for a new round."""
+    before, after = round_total(previous_scores), round_total(scores)
+    if before == after:
+        return
+    if before and after and before[0] != after[0]:
+        # a change of the number of holes moves the round between sketches
+        record(course_id, tee_id, previous_scores, None)
+        record(course_id, tee_id, None, scores)
+        return
+    holes = (after or before)[0]
+    sketch = Sketch(holes)
+    table = ScoreSketch.__table__
+    counts, delta = table.c.counts, 0
+    if before:
+        counts = increment(counts, sketch.bin(before[1]) + 1, -1)
+        delta -= 1
+    if after:
+        counts = increment(counts, sketch.bin(after[1]) + 1, 1)
+        delta += 1
+    initial = [0] * (sketch.bin(after[1]) + 1) if after else []
+    if after:
+        initial[-1] = 1
+    statement = insert(table).values(
+        tee_id=tee_id, holes=holes, course_id=course_id, total=max(delta, 0), counts=initial
+    ).on_conflict_do_update(
+        index_elements=[table.c.tee_id, table.c.holes],
+        set_={'counts': counts, 'total': table.c.total + delta}
+    )
+    db.session.execute(statement)
+
+def rebuild():
+    """Recompute every sketch from the completed rounds"""
+    holes = func.cardinality(Round.score_by_hole)
+    score = db.literal_column("(SELECT sum(s) FROM unnest(rounds.score_by_hole) AS s)")
+    totals = db.session.query(
+        Round.course_id, Round.tee_id, holes.label('holes'), score.label('score'),
+        func.count().label('rounds')
+    ).filter(
+        holes.in_(HOLE_COUNTS),
+        func.array_position(Round.score_by_hole, db.cast(None, db.Integer)).is_(None)
+    ).group_by(Round.course_id, Round.tee_id, holes, score)
+    sketches = {}
+    for row in totals:
+        key = (row.course_id, row.tee_id, row.holes)
+        sketch = sketches.setdefault(key, Sketch(row.holes))
+        index = sketch.bin(row.score)
+        if index >= len(sketch.counts):
+            sketch.counts.extend([0] * (index + 1 - len(sketch.counts)))
+        sketch.counts[index] += row.rounds
+    ScoreSketch.query.delete()
+    if sketches:
+        db.session.execute(ScoreSketch.__table__.insert(), [
+            {'course_id': course_id, 'tee_id': tee_id, 'holes': holes,
+                'total': sketch.total, 'counts': sketch.counts}
+            for (course_id, tee_id, holes), sketch in sketches.items()
+        ])
+    db.session.commit()
+    return len(sketches)
+
+@sketches_cli.command('rebuild')
+def rebuild_command():
+    """Recompute the score distributions from all completed rounds."""
+    rebuilt = 0
+    for shard in shards.each():
+        rebuilt += rebuild()
+    click.echo(f"Rebuilt {rebuilt} score sketches.")
+
+def init_app(app):
+    app.cli.add_command(sketches_cli)
@@ -0,0 +1,254 @@
+"""Slow query log with plans.
+
+Every statement taking longer than SLOW_QUERY_THRESHOLD_MS is recorded in
+the slow_queries table together with the endpoint that issued it, the
+application frames of its call stack and its parameters with the values
+redacted to their types. Calls of the same statement from the same endpoint
+are aggregated into one row, and the table keeps the SLOW_QUERY_MAX_ENTRIES
+statements with the highest total time.
+
+The first slow call of a statement, and a SLOW_QUERY_EXPLAIN_RATE fraction
+of the later ones, also get their plan from `EXPLAIN (FORMAT JSON)` (no
+ANALYZE, the statement is not run again). The fingerprints already explained
+are remembered for the SLOW_QUERY_EXPLAINED_SIZE most recently seen. Writing the row and explaining
+happen on a background thread with its own connection so the request that
+ran the slow statement does not wait for either; when its queue is full
+further slow queries are dropped. Statements are recorded on the default
+database and every shard, each explained on the database that ran it, and
+the log itself is kept in the default database.
+
+    flask slow-queries top --limit 10 [--plans]
+"""
+import collections, datetime, hashlib, json, os, queue, random, threading, time, traceback
+import click
+from flask.cli import AppGroup
+from sqlalchemy import event, func, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import DBAPIError
+from flask_app import db, shards
+from flask_app.config import env_flag, env_float, env_int
+from flask_app.metrics import current_endpoint
+from flask_app.models import SlowQuery
+
+EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+STACK_DEPTH = 12
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+slow_queries_cli = AppGroup('slow-queries', help="Inspect the slow query log.")
+
+
+def redact(parameters):
+    """The parameters of a statement with every value replaced by its type"""
+    def kind(value):
+        if value is None:
+            return 'null'
+        if isinstance(value, (list, tuple)):
+            return f"{type(value).__name__}[{len(value)}]"
+        return type(value).__name__
+    if isinstance(parameters, dict):
+        return {key: kind(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [kind(value) for value in parameters]
+    return None
+
+def application_stack():
+    """The frames of this package leading to the statement, innermost last"""
+    frames = [
+        frame for frame in traceback.extract_stack()
+        if frame.filename.startswith(PACKAGE_DIR) and frame.filename != __file__
+    ]
+    return ''.join(traceback.format_list(frames[-STACK_DEPTH:]))
+
+def fingerprint(endpoint, statement):
+    return hashlib.sha1(f"{endpoint}\n{statement}".encode()).hexdigest()
+
+def explainable(statement):
+    return statement.lstrip().split(None, 1)[0].upper() in EXPLAINABLE
+
+
+class SlowQueryRecorder(object):
+    """Times the statements of one engine and hands the slow ones to a
+    background writer"""
+
+    def __init__(self, app, engine):
+        self.config = app.config
+        self.engine = engine
+        self.logger = app.logger
+        self.queue = queue.Queue(maxsize=app.config['SLOW_QUERY_QUEUE_SIZE'])
+        # fingerprints already explained, the least recently seen forgotten
+        # first once there are SLOW_QUERY_EXPLAINED_SIZE of them
+        self.explained = collections.OrderedDict()
+        self.dropped = 0
+        self._writer = None
+        self._lock = threading.Lock()
+        # the writer's own statements must not be recorded
+        self._local = threading.local()
+
+    def install(self, engines):
+        """Record the statements run on each of engines"""
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute', self.before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', self.after_cursor_execute)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        # the statement is kept from before statements.py may turn it into an
+        # EXECUTE, on the execution context so nothing is left behind when it
+        # raises and after_cursor_execute never runs
+        if context is not None:
+            context._slow_query_started = (time.perf_counter(), statement)
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, '_slow_query_started', None)
+        if started is None:
+            return
+        started, statement = started
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if elapsed_ms < self.config['SLOW_QUERY_THRESHOLD_MS'] or getattr(self._local, 'writing', False):
+            return
+        endpoint = current_endpoint()
+        key = fingerprint(endpoint, statement)
+        explain = not executemany and explainable(statement) and (
+            self.first_explain(key) or random.random() < self.config['SLOW_QUERY_EXPLAIN_RATE']
+        )
+        try:
+            self.queue.put_nowait({
+                'fingerprint': key,
+                'endpoint': endpoint,
+                'statement': statement,
+                'elapsed_ms': elapsed_ms,
+                'parameters': parameters if explain else None,
+                'redacted': redact(parameters[0] if executemany and parameters else parameters),
+                'stack': application_stack(),
+                'explain': explain,
+                'engine': conn.engine,
+            })
+        except queue.Full:
+            self.dropped += 1
+            return
+        self.start()
+
+    def first_explain(self, key):
+        """Whether a fingerprint has not been explained yet, noting it"""
+        with self._lock:
+            if key in self.explained:
+                self.explained.move_to_end(key)
+                return False
+            self.explained[key] = None
+            if len(self.explained) > self.config['SLOW_QUERY_EXPLAINED_SIZE']:
+                self.explained.popitem(last=False)
+            return True
+
+    def start(self):
+        if self._writer is None:
+            with self._lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(
+                        target=self.run, name='slow-query-writer', daemon=True
+                    )
+                    self._writer.start()
+
+    def wait(self):
+        """Block until every queued slow query has been written"""
+        self.queue.join()
+
+    def run(self):
+        self._local.writing = True
+        while True:
+            item = self.queue.get()
+            try:
+                self.write(item)
+            except Exception as ex:
+                self.logger.warning(f"Could not record slow query: {ex}")
+            finally:
+                self.queue.task_done()
+
+    def explain(self, engine, statement, parameters):
+        """Plan of a statement on the database it ran on"""
+        connection = engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            cursor.execute("EXPLAIN (FORMAT JSON) " + statement, parameters or None)
+            plan = cursor.fetchone()[0]
+            return json.loads(plan) if isinstance(plan, str) else plan
+        finally:
+            connection.rollback()
+            connection.close()
+
+    def write(self, item):
+        plan = None
+        if item['explain']:
+            try:
+                plan = self.explain(item['engine'], item['statement'], item['parameters'])
+            except DBAPIError as ex:
+                plan = {'error': str(ex.orig).strip()}
+            except Exception as ex:
+                plan = {'error': str(ex).strip()}
+        table = SlowQuery.__table__
+        now = datetime.datetime.utcnow()
+        statement = insert(table).values(
+            fingerprint=item['fingerprint'], endpoint=item['endpoint'],
+            statement=item['statement'], calls=1, total_ms=item['elapsed_ms'],
+            max_ms=item['elapsed_ms'], parameters=item['redacted'], stack=item['stack'],
+            plan=plan, first_seen=now, last_seen=now
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.fingerprint],
+            set_={
+                'calls': table.c.calls + 1,
+                'total_ms': table.c.total_ms + statement.excluded.total_ms,
+                'max_ms': func.greatest(table.c.max_ms, statement.excluded.max_ms),
+                'parameters': statement.excluded.parameters,
+                'stack': statement.excluded.stack,
+                'plan': func.coalesce(statement.excluded.plan, table.c.plan),
+                'last_seen': statement.excluded.last_seen,
+            }
+        )
+        with self.engine.begin() as connection:
+            connection.execute(statement)
+            connection.execute(text(
+                "DELETE FROM slow_queries WHERE fingerprint NOT IN ("
+                "SELECT fingerprint FROM slow_queries ORDER BY total_ms DESC LIMIT :keep)"
+            ), keep=self.config['SLOW_QUERY_MAX_ENTRIES'])
+
+
+def top(limit=10):
+    """The recorded statements with the highest total time"""
+    return SlowQuery.query.order_by(SlowQuery.total_ms.desc()).limit(limit).all()
+
+@slow_queries_cli.command('top')
+@click.option('--limit', default=10, show_default=True, help="Number of statements.")
+@click.option('--plans', is_flag=True, help="Print the captured plans.")
+def top_command(limit, plans):
+    """List the statements with the highest total time."""
+    for slow in top(limit):
+        click.echo(
+            f"{slow.total_ms:10.1f} ms total  {slow.calls:6d} calls  "
+            f"{slow.max_ms:8.1f} ms max  {slow.endpoint or '-'}"
+        )
+        click.echo(f"    {' '.join(slow.statement.split())}")
+        if plans and slow.plan:
+            click.echo(json.dumps(slow.plan, indent=2))
+
+@slow_queries_cli.command('reset')
+def reset_command():
+    """Empty the slow query log."""
+    click.echo(f"Removed {SlowQuery.query.delete()} slow queries.")
+    db.session.commit()
+
+def init_app(app):
+    """Start recording slow statements when the slow query log is enabled"""
+    app.config.setdefault('SLOW_QUERY_LOG_ENABLED', env_flag('SLOW_QUERY_LOG_ENABLED', False))
+    app.config.setdefault('SLOW_QUERY_THRESHOLD_MS', env_float('SLOW_QUERY_THRESHOLD_MS', 200.0))
+    app.config.setdefault('SLOW_QUERY_EXPLAIN_RATE', env_float('SLOW_QUERY_EXPLAIN_RATE', 0.05))
+    app.config.setdefault('SLOW_QUERY_MAX_ENTRIES', env_int('SLOW_QUERY_MAX_ENTRIES', 500))
+    app.config.setdefault('SLOW_QUERY_QUEUE_SIZE', env_int('SLOW_QUERY_QUEUE_SIZE', 1000))
+    app.config.setdefault('SLOW_QUERY_EXPLAINED_SIZE', env_int('SLOW_QUERY_EXPLAINED_SIZE', 10000))
+    app.cli.add_command(slow_queries_cli)
+    if not app.config['SLOW_QUERY_LOG_ENABLED']:
+        return
+    with app.app_context():
+        # the log lives in the default database, statements are recorded on
+        # every shard too
+        recorder = SlowQueryRecorder(app, db.engine)
+        recorder.install([db.get_engine(app, bind=bind) for bind in [None] + shards.names()])
+    app.extensions['slow_queries'] = recorder
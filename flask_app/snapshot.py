@@ -0,0 +1,336 @@
+"""Columnar on-disk snapshot of rounds for analytics.
+
+A snapshot is a directory of segments, each holding one .npy file per
+column, and a manifest.json listing the segments. Columns are fixed width,
+so Snapshot opens them with numpy memory maps: scans read straight from
+the page cache without copying and without touching Postgres.
+
+    id, user_id, course_id, tee_id    int32
+    date                              datetime64[D]
+    holes                             int8, number of hole scores recorded
+    total                             int16, sum of the holes played
+    complete                          bool, all 9 or 18 holes scored
+    differential                      float32, nan unless a complete 18
+                                      hole round from a rated tee
+    hole_offsets, hole_scores         per hole block: the scores of row i
+                                      are hole_scores[hole_offsets[i]:
+                                      hole_offsets[i + 1]], 0 if unplayed
+
+`flask snapshot export PATH` appends a segment per shard with the rounds
+created, changed or deleted since the last export, read from the
+round_changes log (see changes.py) the way the /sync feed reads it: the
+manifest keeps a (txid, id) cursor per shard, and each export takes the log
+entries of transactions below the export's txid horizon, so a round
+committed out of id order is not skipped and a round scored hole by hole is
+exported again after every change. Each segment lists the ids it replaces,
+and a row of an older segment whose id is replaced by a newer one is
+shadowed: Snapshot masks it out of every scan. Round ids are unique over
+the shards, and a round moved to another shard is logged there afresh, so
+its new segment shadows the copy from its old shard. `--full` rewrites the
+snapshot as one segment per shard, which also drops the shadowed rows.
+"""
+import datetime, json, os, shutil
+import click
+import numpy as np
+from flask.cli import AppGroup
+from numpy.lib.format import open_memmap
+from flask_app import db, shards
+from flask_app.handicap import STANDARD_SLOPE
+
+FORMAT = 3
+# cursor key of the default database when rounds are not sharded
+DEFAULT = 'default'
+MANIFEST = 'manifest.json'
+FETCH_SIZE = 50000
+COLUMNS = {
+    'id': np.int32,
+    'user_id': np.int32,
+    'course_id': np.int32,
+    'tee_id': np.int32,
+    'date': 'datetime64[D]',
+    'holes': np.int8,
+    'total': np.int16,
+    'complete': np.bool_,
+    'differential': np.float32,
+}
+HORIZON_QUERY = "SELECT txid_snapshot_xmin(txid_current_snapshot())"
+# rounds with a log entry after the cursor from a transaction below the horizon
+CHANGED_QUERY = """
+    SELECT DISTINCT round_id FROM round_changes
+    WHERE txid < %(horizon)s AND (txid, id) > (%(txid)s, %(id)s)
+"""
+EXPORT_QUERY = """
+    SELECT rounds.id, rounds.user_id, rounds.course_id, rounds.tee_id, rounds.date,
+        rounds.score_by_hole, tees.course_rating, tees.slope_rating
+    FROM rounds LEFT JOIN tees ON tees.id = rounds.tee_id
+    WHERE {where}
+    ORDER BY rounds.id
+"""
+COUNT_QUERY = """
+    SELECT count(*), COALESCE(sum(cardinality(score_by_hole)), 0)
+    FROM rounds WHERE {where}
+"""
+
+snapshot_cli = AppGroup('snapshot', help="Export rounds for analytics.")
+
+
+class Segment(object):
+    """One exported batch of rounds, every column memory mapped. live is
+    None when no newer segment shadows a row, else the mask of the rows
+    still current."""
+
+    def __init__(self, path, info):
+        self.path = path
+        self.info = info
+        self.rows = info['rows']
+        self.live = None
+        self._columns = {}
+
+    def __len__(self):
+        return self.rows if self.live is None else int(np.count_nonzero(self.live))
+
+    def __getitem__(self, name):
+        if name not in self._columns:
+            self._columns[name] = np.load(
+                os.path.join(self.path, f"{name}.npy"), mmap_mode='r'
+            )
+        return self._columns[name]
+
+    def hole_scores(self):
+        """Flattened per hole block as (row, hole number, score) arrays"""
+        offsets, scores = self['hole_offsets'], self['hole_scores']
+        lengths = np.diff(offsets)
+        rows = np.repeat(np.arange(self.rows), lengths)
+        numbers = np.arange(len(scores)) - np.repeat(offsets[:-1], lengths) + 1
+        return rows, numbers, scores
+
+
+class Snapshot(object):
+    """Read access to an exported snapshot"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, MANIFEST)) as f:
+            self.manifest = json.load(f)
+        self.segments = [
+            Segment(os.path.join(path, info['name']), info)
+            for info in self.manifest['segments']
+        ]
+        # newest first, every segment shadows the ids the later ones replaced
+        replaced = np.empty(0, dtype=np.int32)
+        for number in range(len(self.segments) - 1, -1, -1):
+            segment = self.segments[number]
+            if len(replaced):
+                live = ~np.isin(segment['id'], replaced)
+                segment.live = None if live.all() else live
+            if number:
+                replaced = np.union1d(replaced, segment['replaced'])
+
+    def __len__(self):
+        return sum(len(segment) for segment in self.segments)
+
+    def column(self, name):
+        """Every segment's array for a column, without copying unless some of
+        its rows are shadowed"""
+        return [
+            segment[name] if segment.live is None else segment[name][segment.live]
+            for segment in self.segments
+        ]
+
+    def group(self, key, value='total', where=None):
+        """Count and mean of value grouped by key, merged over the segments.
+        key is a column name or a function of a segment returning the group
+        of each row, where an optional function returning a row mask. Rows
+        with a nan value are left out."""
+        counts, sums = {}, {}
+        for segment in self.segments:
+            keys = segment[key] if isinstance(key, str) else key(segment)
+            values = np.asarray(segment[value], dtype=np.float64)
+            mask = ~np.isnan(values)
+            if segment.live is not None:
+                mask &= segment.live
+            if where is not None:
+                mask &= where(segment)
+            groups, inverse = np.unique(np.asarray(keys)[mask], return_inverse=True)
+            group_counts = np.bincount(inverse, minlength=len(groups))
+            group_sums = np.bincount(inverse, weights=values[mask], minlength=len(groups))
+            for group, count, total in zip(groups.tolist(), group_counts, group_sums):
+                counts[group] = counts.get(group, 0) + int(count)
+                sums[group] = sums.get(group, 0.0) + float(total)
+        return {
+            group: {'rounds': counts[group], 'mean': sums[group] / counts[group]}
+            for group in sorted(counts)
+        }
+
+    def hole_averages(self, course_id):
+        """Mean score of every hole of a course over its complete rounds"""
+        counts, sums = np.zeros(19), np.zeros(19)
+        for segment in self.segments:
+            rows, numbers, scores = segment.hole_scores()
+            mask = (np.asarray(segment['course_id']) == course_id) & np.asarray(segment['complete'])
+            if segment.live is not None:
+                mask &= segment.live
+            selected = mask[rows] & (scores > 0)
+            counts += np.bincount(numbers[selected], minlength=19)[:19]
+            sums += np.bincount(numbers[selected], weights=scores[selected], minlength=19)[:19]
+        return {
+            number: sums[number] / counts[number] for number in range(1, 19) if counts[number]
+        }
+
+
+def month(segment):
+    """Group key for by month aggregates"""
+    return np.asarray(segment['date']).astype('datetime64[M]').astype(str)
+
+def handicap_band(width=5):
+    """Group key putting differentials into bands of width strokes"""
+    def band(segment):
+        differentials = np.nan_to_num(np.asarray(segment['differential']), nan=-999)
+        return (np.floor(differentials / width) * width).astype(np.int32)
+    return band
+
+
+def read_manifest(path):
+    try:
+        with open(os.path.join(path, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'format': FORMAT, 'cursors': {}, 'segments': []}
+
+def write_manifest(path, manifest):
+    """Replace the manifest atomically, readers see the old or new segments"""
+    temporary = os.path.join(path, MANIFEST + '.tmp')
+    with open(temporary, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(temporary, os.path.join(path, MANIFEST))
+
+def write_segment(connection, path, after):
+    """Stream the rounds changed since the (txid, id) cursor after, or every
+    round when after is None, into a new segment directory. Runs under one
+    repeatable read transaction, so the log, the count and the rows agree.
+    Returns the segment's manifest entry, None when nothing changed, and the
+    cursor for the next export."""
+    cursor = connection.cursor()
+    cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+    cursor.execute(HORIZON_QUERY)
+    horizon, = cursor.fetchone()
+    # every transaction below the horizon has finished and is in the rounds
+    # read below, the log is followed from there next time
+    next_cursor = [horizon, 0]
+    if after is None:
+        where, replaced = 'TRUE', []
+    else:
+        cursor.execute(CHANGED_QUERY, {'horizon': horizon, 'txid': after[0], 'id': after[1]})
+        replaced = sorted(id for id, in cursor)
+        if not replaced:
+            return None, next_cursor
+        where = 'rounds.id = ANY(%(ids)s)'
+    parameters = {'ids': replaced}
+    cursor.execute(COUNT_QUERY.format(where=where), parameters)
+    rows, hole_count = cursor.fetchone()
+    if after is None and not rows:
+        return None, next_cursor
+    os.makedirs(path)
+    columns = {
+        name: open_memmap(os.path.join(path, f"{name}.npy"), mode='w+', dtype=dtype, shape=(rows,))
+        for name, dtype in COLUMNS.items()
+    }
+    offsets = open_memmap(
+        os.path.join(path, 'hole_offsets.npy'), mode='w+', dtype=np.int64, shape=(rows + 1,)
+    )
+    scores = open_memmap(
+        os.path.join(path, 'hole_scores.npy'), mode='w+', dtype=np.int8, shape=(hole_count,)
+    )
+    stream = connection.cursor(name='snapshot_export')
+    stream.itersize = FETCH_SIZE
+    stream.execute(EXPORT_QUERY.format(where=where), parameters)
+    position = 0
+    for i, (id, user_id, course_id, tee_id, date, holes, rating, slope) in enumerate(stream):
+        played = [score for score in holes if score is not None]
+        complete = len(holes) in (9, 18) and len(played) == len(holes)
+        columns['id'][i] = id
+        columns['user_id'][i] = user_id or 0
+        columns['course_id'][i] = course_id or 0
+        columns['tee_id'][i] = tee_id or 0
+        columns['date'][i] = date
+        columns['holes'][i] = len(played)
+        columns['total'][i] = sum(played)
+        columns['complete'][i] = complete
+        columns['differential'][i] = (
+            STANDARD_SLOPE / slope * (sum(played) - rating)
+            if complete and len(holes) == 18 and rating and slope else np.nan
+        )
+        offsets[i] = position
+        scores[position:position + len(holes)] = [score or 0 for score in holes]
+        position += len(holes)
+    offsets[rows] = position
+    stream.close()
+    for array in list(columns.values()) + [offsets, scores]:
+        array.flush()
+    if after is None:
+        # a whole database replaces its rows in older segments, which exist
+        # when a shard is exported for the first time next to the others
+        replaced = columns['id']
+    np.save(os.path.join(path, 'replaced.npy'), np.asarray(replaced, dtype=np.int32))
+    return {'rows': rows, 'replaced': len(replaced)}, next_cursor
+
+def databases():
+    """(shard name, engine) of every database holding rounds, each shard or
+    the default database with name None"""
+    return [(name, db.get_engine(bind=name)) for name in shards.names()] or [(None, db.engine)]
+
+def export(path, full=False):
+    """Add the rounds changed since the last export to the snapshot at path,
+    or rewrite it from scratch. Every shard has its own change log and txid
+    horizon, so each gets its own cursor and segment. Returns the manifest
+    entries of the new segments."""
+    os.makedirs(path, exist_ok=True)
+    manifest = read_manifest(path)
+    # a snapshot of an older format cannot be added to, it is rebuilt
+    full = full or manifest.get('format') != FORMAT
+    if full:
+        manifest = {'format': FORMAT, 'cursors': {}, 'segments': []}
+    stamp = f"segment-{datetime.datetime.utcnow():%Y%m%dT%H%M%S%f}"
+    added = []
+    for shard, engine in databases():
+        key = shard or DEFAULT
+        name = f"{stamp}-{shard}" if shard else stamp
+        connection = engine.raw_connection()
+        try:
+            info, cursor = write_segment(
+                connection, os.path.join(path, name), manifest['cursors'].get(key)
+            )
+            connection.rollback()
+        finally:
+            connection.close()
+        if info:
+            info.update(name=name, shard=shard, exported_at=datetime.datetime.utcnow().isoformat())
+            added.append(info)
+        manifest['cursors'][key] = cursor
+    names = {info['name'] for info in added}
+    old_segments = [] if not full else [
+        entry for entry in os.listdir(path) if entry.startswith('segment-') and entry not in names
+    ]
+    manifest['segments'].extend(added)
+    manifest['columns'] = {name: np.dtype(dtype).str for name, dtype in COLUMNS.items()}
+    write_manifest(path, manifest)
+    for entry in old_segments:
+        shutil.rmtree(os.path.join(path, entry))
+    return added
+
+@snapshot_cli.command('export')
+@click.argument('path')
+@click.option('--full', is_flag=True, help="Rewrite the snapshot instead of appending.")
+def export_command(path, full):
+    """Export rounds to a columnar snapshot at PATH."""
+    added = export(path, full)
+    for info in added:
+        click.echo(
+            f"Exported {info['rows']} rounds, replacing {info['replaced']}, "
+            f"from {info['shard'] or DEFAULT} to {path}."
+        )
+    if not added:
+        click.echo("No changed rounds to export.")
+
+def init_app(app):
+    app.cli.add_command(snapshot_cli)
@@ -0,0 +1,80 @@
+"""Cached statements for the hot primary key lookups.
+
+Model.query.get() builds a Query and compiles its SQL again on every call.
+get() runs the same lookup from a baked query instead, so the SQL string
+and result setup are built once per model and set of loader options, and
+an object already in the session is still returned without a query.
+Relationship lazy loads are baked by SQLAlchemy already.
+
+With PREPARED_STATEMENTS_ENABLED the lookups are also prepared on the
+server: the first time a connection runs one it is sent as PREPARE and
+every later call as EXECUTE, so Postgres skips parsing and planning it.
+Prepared statements belong to a connection, so turn this off behind a
+pooler in transaction mode (e.g. pgbouncer), where consecutive statements
+can land on different server connections.
+"""
+import re
+from sqlalchemy import event
+from sqlalchemy.ext import baked
+from sqlalchemy.orm import joinedload, selectinload
+from flask_app import db
+from flask_app.config import env_flag
+
+PARAMETER = re.compile(r'%\((\w+)\)s')
+# prepared statements kept per connection, later ones run unprepared
+MAX_PREPARED = 100
+
+bakery = baked.bakery(size=200)
+
+# Loader options are part of a baked query's cache key by identity, so the
+# ones used with get() are created once here. They name the relationships,
+# as Round.tee only exists once the mappers are configured.
+ROUND_WITH_TEE = (joinedload('tee'),)
+HOLE_WITH_YARDAGES = (selectinload('tees').joinedload('tee'),)
+
+
+def get(model, id, options=()):
+    """model.query.options(*options).get(id) from a cached statement"""
+    if id is None:
+        return None
+    query = bakery(lambda session: session.query(model).execution_options(prepare=True), model)
+    if options:
+        query = query.with_criteria(lambda q: q.options(*options), *options)
+    return query.for_session(db.session()).get(id)
+
+def prepared(connection):
+    """The statements prepared on a pooled connection, statement: (name, keys)"""
+    return connection.info.setdefault('prepared_statements', {})
+
+def _execute_prepared(connection, cursor, statement, parameters, context, executemany):
+    if executemany or context is None or not context.execution_options.get('prepare'):
+        return statement, parameters
+    statements = prepared(connection)
+    found = statements.get(statement)
+    if found is None:
+        if len(statements) >= MAX_PREPARED:
+            return statement, parameters
+        keys = list(dict.fromkeys(PARAMETER.findall(statement)))
+        body = PARAMETER.sub(lambda match: f"${keys.index(match.group(1)) + 1}", statement)
+        name = f"golf_api_{len(statements) + 1}"
+        cursor.execute(f"PREPARE {name} AS {body.replace('%%', '%')}")
+        found = statements[statement] = (name, keys)
+    name, keys = found
+    arguments = ', '.join(f"%({key})s" for key in keys)
+    return f"EXECUTE {name}({arguments})" if keys else f"EXECUTE {name}", parameters
+
+def init_app(app):
+    """Prepare the marked statements on the default and shard engines. The
+    listener goes on each engine, after the engine wide ones such as the
+    query counters, which so still see the statement itself."""
+    from flask_app import shards
+    app.config.setdefault(
+        'PREPARED_STATEMENTS_ENABLED', env_flag('PREPARED_STATEMENTS_ENABLED', True)
+    )
+    if not app.config['PREPARED_STATEMENTS_ENABLED']:
+        return
+    with app.app_context():
+        for bind in [None] + shards.names():
+            engine = db.get_engine(app, bind=bind)
+            if not event.contains(engine, 'before_cursor_execute', _execute_prepared):
+                event.listen(engine, 'before_cursor_execute', _execute_prepared, retval=True)
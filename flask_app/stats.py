@@ -0,0 +1,240 @@
+"""Platform wide statistics for the admin dashboard.
+
+Totals over every user's rounds are kept in materialized views next to the
+rounds table, on each shard when the rounds are sharded:
+
+    stats_daily_rounds    rounds and players per day
+    stats_active_users    users with a round in the last 1, 7, 30 and 365 days
+    stats_course_rounds   rounds and players per course
+    stats_tee_scores      completed rounds and their strokes per tee
+
+The views only change when they are refreshed, run
+
+    flask stats refresh
+
+every few minutes (cron, a scheduled job). Each view is refreshed
+CONCURRENTLY in its own transaction, so the admin endpoints and the API
+keep reading the previous contents while it runs. Every column is a count
+or a sum, and a user's rounds all live on one shard, so the endpoints merge
+the shards' rows by adding them up.
+
+    GET /admin/stats/rounds?from=&to=     rounds per day, the last 30 days by default
+    GET /admin/stats/active-users
+    GET /admin/stats/courses?limit=       most played courses
+    GET /admin/stats/scores?course_id=    average score by course, tee and holes
+
+The endpoints read the views only, plus the names of the courses and tees
+they return, and need the X-Admin-Token header matching ADMIN_TOKEN.
+"""
+import datetime, hmac, os
+import click
+from flask import Blueprint, abort, current_app, jsonify, request
+from flask.cli import AppGroup
+from sqlalchemy import Column, Date, DateTime, Integer, MetaData, Table, text
+from flask_app import db, shards
+from flask_app.loaders import fetch_by_ids, parse_date_range
+from flask_app.models import Course, Round, Tee
+
+TOKEN_HEADER = 'X-Admin-Token'
+DEFAULT_DAYS = 30
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 100
+# serializes concurrent runs of the refresh job
+LOCK_ID = 7_301_039
+
+# name: (query, unique index columns), a unique index is what lets a view be
+# refreshed concurrently
+VIEWS = {
+    'stats_daily_rounds': ("""
+        SELECT date, count(*) AS rounds, count(DISTINCT user_id) AS players
+        FROM rounds
+        GROUP BY date
+    """, 'date'),
+    'stats_active_users': ("""
+        SELECT timezone('utc', now()) AS refreshed_at,
+               count(DISTINCT user_id) FILTER (WHERE date > current_date - 1) AS day,
+               count(DISTINCT user_id) FILTER (WHERE date > current_date - 7) AS week,
+               count(DISTINCT user_id) FILTER (WHERE date > current_date - 30) AS month,
+               count(DISTINCT user_id) AS year
+        FROM rounds
+        WHERE date > current_date - 365
+    """, 'refreshed_at'),
+    'stats_course_rounds': ("""
+        SELECT course_id, count(*) AS rounds, count(DISTINCT user_id) AS players,
+               max(date) AS last_played
+        FROM rounds
+        WHERE course_id IS NOT NULL
+        GROUP BY course_id
+    """, 'course_id'),
+    'stats_tee_scores': ("""
+        SELECT course_id, tee_id, cardinality(score_by_hole) AS holes,
+               count(*) AS rounds, sum(total)::bigint AS strokes
+        FROM rounds, LATERAL (SELECT sum(s) AS total FROM unnest(score_by_hole) AS s) AS totals
+        WHERE tee_id IS NOT NULL AND cardinality(score_by_hole) IN (9, 18)
+          AND array_position(score_by_hole, NULL) IS NULL
+        GROUP BY course_id, tee_id, cardinality(score_by_hole)
+    """, 'tee_id, holes'),
+}
+
+# The views for reading through the session, kept out of db.metadata so that
+# create_all() leaves them to the DDL below. Marked sharded like rounds, so
+# statements on them go to the shard chosen with shards.each().
+views = MetaData()
+sharded = {'sharded': True}
+daily_rounds = Table('stats_daily_rounds', views,
+    Column('date', Date), Column('rounds', Integer), Column('players', Integer), info=sharded)
+active_users = Table('stats_active_users', views,
+    Column('refreshed_at', DateTime), Column('day', Integer), Column('week', Integer),
+    Column('month', Integer), Column('year', Integer), info=sharded)
+course_rounds = Table('stats_course_rounds', views,
+    Column('course_id', Integer), Column('rounds', Integer), Column('players', Integer),
+    Column('last_played', Date), info=sharded)
+tee_scores = Table('stats_tee_scores', views,
+    Column('course_id', Integer), Column('tee_id', Integer), Column('holes', Integer),
+    Column('rounds', Integer), Column('strokes', Integer), info=sharded)
+
+stats_bp = Blueprint('stats', __name__, url_prefix='/admin/stats')
+stats_cli = AppGroup('stats', help="Maintain the platform statistics.")
+
+
+def create_statements(name):
+    query, unique = VIEWS[name]
+    return [
+        f"CREATE MATERIALIZED VIEW {name} AS {query}",
+        f"CREATE UNIQUE INDEX ix_{name}_unique ON {name} ({unique})",
+    ]
+
+def drop_statement(name):
+    return f"DROP MATERIALIZED VIEW IF EXISTS {name}"
+
+# the views are created and dropped along with the rounds table they read
+for name in VIEWS:
+    for statement in create_statements(name):
+        db.event.listen(Round.__table__, 'after_create', db.DDL(statement))
+    db.event.listen(Round.__table__, 'before_drop', db.DDL(drop_statement(name)))
+
+def refresh(engine, names=None):
+    """Refresh the views on one database, one transaction each, returning
+    the seconds each took. Returns None when another refresh is running."""
+    took = {}
+    with engine.connect() as connection:
+        if not connection.execute(text("SELECT pg_try_advisory_lock(:id)"), id=LOCK_ID).scalar():
+            return None
+        try:
+            for name in names or VIEWS:
+                started = datetime.datetime.utcnow()
+                with connection.begin():
+                    connection.execute(text(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {name}"))
+                took[name] = (datetime.datetime.utcnow() - started).total_seconds()
+        finally:
+            connection.execute(text("SELECT pg_advisory_unlock(:id)"), id=LOCK_ID)
+    return took
+
+@stats_cli.command('refresh')
+@click.option('--view', 'names', multiple=True, type=click.Choice(list(VIEWS)),
+    help="Refresh only this view, may be repeated.")
+def refresh_command(names):
+    """Refresh the statistics views."""
+    for shard in shards.each():
+        label = shard or 'default'
+        took = refresh(db.get_engine(bind=shard), names)
+        if took is None:
+            click.echo(f"Skipped {label}, a refresh is already running.")
+            continue
+        click.echo(
+            f"Refreshed {label}: "
+            f"{', '.join(f'{name} in {seconds:.2f}s' for name, seconds in took.items())}."
+        )
+
+
+def require_token():
+    token = current_app.config['ADMIN_TOKEN']
+    given = request.headers.get(TOKEN_HEADER)
+    if not (token and given and hmac.compare_digest(given.encode(), token.encode())):
+        abort(401, f"A valid {TOKEN_HEADER} header is required.")
+
+def merged(query, key, columns):
+    """Rows of query from every shard, the columns added up per key"""
+    totals = {}
+    for shard in shards.each():
+        for row in db.session.execute(query):
+            found = totals.setdefault(row[key], dict.fromkeys(columns, 0))
+            for column in columns:
+                found[column] += row[column] or 0
+    return totals
+
+@stats_bp.route('/rounds')
+def rounds_per_day():
+    """Rounds and players per day, oldest first"""
+    require_token()
+    start, end = parse_date_range()
+    end = end or datetime.date.today()
+    start = start or end - datetime.timedelta(days=DEFAULT_DAYS - 1)
+    query = daily_rounds.select().where(daily_rounds.c.date.between(start, end))
+    days = merged(query, 'date', ('rounds', 'players'))
+    return jsonify([
+        dict(days[day], date=day.isoformat()) for day in sorted(days)
+    ]), 200
+
+@stats_bp.route('/active-users')
+def active():
+    """Users with a round dated in the last day, week, month and year"""
+    require_token()
+    counts = dict.fromkeys(('day', 'week', 'month', 'year'), 0)
+    refreshed = []
+    for shard in shards.each():
+        for row in db.session.execute(active_users.select()):
+            refreshed.append(row.refreshed_at)
+            for window in counts:
+                counts[window] += row[window]
+    # the counts are as old as the least recently refreshed shard
+    refreshed_at = min(refreshed).isoformat() if refreshed else None
+    return jsonify(dict(counts, refreshed_at=refreshed_at)), 200
+
+@stats_bp.route('/courses')
+def most_played():
+    """The most played courses, most rounds first"""
+    require_token()
+    limit = request.args.get('limit', DEFAULT_LIMIT, type=int)
+    if not 0 < limit <= MAX_LIMIT:
+        abort(400, f"limit must be between 1 and {MAX_LIMIT}.")
+    query = course_rounds.select().order_by(course_rounds.c.rounds.desc(), course_rounds.c.course_id)
+    if len(shards.names()) < 2:
+        # totals from one database are final, only the top rows are needed
+        query = query.limit(limit)
+    courses = merged(query, 'course_id', ('rounds', 'players'))
+    top = sorted(courses, key=lambda id: (-courses[id]['rounds'], id))[:limit]
+    names = fetch_by_ids(Course, top)
+    return jsonify([
+        dict(courses[id], course_id=id, name=names[id].name if id in names else None)
+        for id in top
+    ]), 200
+
+@stats_bp.route('/scores')
+def average_scores():
+    """Average total of the completed rounds by course, tee and holes"""
+    require_token()
+    query = tee_scores.select()
+    course_id = request.args.get('course_id', type=int)
+    if course_id is not None:
+        query = query.where(tee_scores.c.course_id == course_id)
+    groups = {}
+    for shard in shards.each():
+        for row in db.session.execute(query):
+            found = groups.setdefault((row.course_id, row.tee_id, row.holes), [0, 0])
+            found[0] += row.rounds
+            found[1] += row.strokes
+    tees = fetch_by_ids(Tee, [tee_id for _, tee_id, _ in groups])
+    return jsonify([
+        {
+            'course_id': course_id, 'tee_id': tee_id,
+            'colour': tees[tee_id].colour if tee_id in tees else None,
+            'holes': holes, 'rounds': rounds, 'average': round(strokes / rounds, 2),
+        }
+        for (course_id, tee_id, holes), (rounds, strokes) in sorted(groups.items())
+    ]), 200
+
+def init_app(app):
+    app.config.setdefault('ADMIN_TOKEN', os.environ.get('ADMIN_TOKEN'))
+    app.register_blueprint(stats_bp)
+    app.cli.add_command(stats_cli)
@@ -0,0 +1,171 @@
+"""Delta sync for offline clients.
+
+GET /sync?since=<token> returns the courses, tees, holes and yardages
+created, modified or deleted since the token, plus the rounds of user_id
+when it is given, oldest change first with each row at most once per page.
+Every response carries the token for the next call; while more is true the
+client should call again straight away. A client without a token gets
+every row that has changed since the change log was created.
+
+Tokens are opaque to clients. They hold a (txid, id) position in each log,
+see changes.py for why that is the order, and the user and shard the
+rounds were read for: rounds start over for another user, and when the
+user's bucket has moved, from the new shard, which logs every round it
+received.
+"""
+import base64, binascii, json
+from flask import Blueprint, jsonify, request, abort
+from sqlalchemy import func, literal, select, tuple_
+from sqlalchemy.orm import joinedload
+from flask_app import db, shards
+from flask_app.changes import DELETE
+from flask_app.loaders import fetch_by_ids
+from flask_app.models import ChangeLog, Course, Hole, Round, RoundChange, Tee, Yardage
+
+PAGE_SIZE = 500
+MAX_PAGE_SIZE = 1000
+START = [0, 0]
+sync_bp = Blueprint('sync', __name__, url_prefix='/sync')
+
+
+def encode_token(cursor):
+    raw = json.dumps(cursor, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_token(token):
+    """Cursor of a sync token, the start of both logs when there is none"""
+    if not token:
+        return {'c': START, 'r': START, 'u': None, 's': None}
+    try:
+        cursor = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        positions = [cursor['c'], cursor['r']]
+        valid = all(
+            isinstance(position, list) and len(position) == 2
+            and all(type(value) is int for value in position)
+            for position in positions
+        ) and (cursor['u'] is None or type(cursor['u']) is int) \
+            and (cursor['s'] is None or isinstance(cursor['s'], str))
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        valid = False
+    if not valid:
+        abort(400, "Invalid sync token, start again without one.")
+    return cursor
+
+def read_log(model, after, limit, *filters):
+    """Up to limit + 1 entries of a change log after the (txid, id) position,
+    from transactions that have all finished"""
+    horizon = db.session.execute(
+        select([func.txid_snapshot_xmin(func.txid_current_snapshot())]), mapper=model.__mapper__
+    ).scalar()
+    return model.query.filter(
+        *filters,
+        model.txid < horizon,
+        tuple_(model.txid, model.id) > tuple_(literal(after[0]), literal(after[1]))
+    ).order_by(model.txid, model.id).limit(limit + 1).all()
+
+def latest(entries, key):
+    """The last operation on each key, in the order of those last changes"""
+    ops = {}
+    for entry in entries:
+        name = key(entry)
+        ops.pop(name, None)
+        ops[name] = entry.op
+    return ops
+
+def load_yardages(keys):
+    if not keys:
+        return {}
+    query = Yardage.query.filter(tuple_(Yardage.tee_id, Yardage.hole_id).in_(keys))
+    return {(yardage.tee_id, yardage.hole_id): yardage for yardage in query}
+
+def hole_format(hole):
+    return dict(hole.format(), id=hole.id)
+
+def yardage_format(yardage):
+    return {'tee_id': yardage.tee_id, 'hole_id': yardage.hole_id, 'yardage': yardage.yardage}
+
+def round_format(round):
+    return dict(round.detail_format(), id=round.id, date=round.date.isoformat())
+
+# log entity: (change type, model, format)
+ENTITIES = {
+    'courses': ('course', Course, Course.detail_format),
+    'tees': ('tee', Tee, Tee.detail_format),
+    'holes': ('hole', Hole, hole_format),
+    'yardages': ('yardage', Yardage, yardage_format),
+}
+
+def change(kind, id, op, row, format):
+    """A change of the feed, rows gone since they were logged count as
+    deleted"""
+    if row is None or op == DELETE:
+        return {'type': kind, 'id': id, 'op': DELETE, 'data': None}
+    return {'type': kind, 'id': id, 'op': op, 'data': format(row)}
+
+def parse_key(key):
+    return tuple(int(part) for part in key.split(':'))
+
+def reference_changes(entries):
+    ops = latest(entries, lambda entry: (entry.entity, parse_key(entry.key)))
+    keys = {}
+    for entity, key in ops:
+        keys.setdefault(entity, []).append(key)
+    rows = {
+        entity: load_yardages(ids) if entity == 'yardages'
+        else fetch_by_ids(ENTITIES[entity][1], [id for id, in ids])
+        for entity, ids in keys.items()
+    }
+    changes = []
+    for (entity, key), op in ops.items():
+        kind, model, format = ENTITIES[entity]
+        if entity == 'yardages':
+            found, id = rows[entity].get(key), {'tee_id': key[0], 'hole_id': key[1]}
+        else:
+            found, id = rows[entity].get(key[0]), key[0]
+        changes.append(change(kind, id, op, found, format))
+    return changes
+
+def round_changes(entries):
+    ops = latest(entries, lambda entry: entry.round_id)
+    rounds = fetch_by_ids(
+        Round, [id for id, op in ops.items() if op != DELETE], joinedload(Round.tee)
+    )
+    return [change('round', id, op, rounds.get(id), round_format) for id, op in ops.items()]
+
+@sync_bp.route('')
+def sync():
+    """Changes since ?since=<token>, ?user_id= adds the user's rounds and
+    ?limit= caps the log entries read per page"""
+    cursor = decode_token(request.args.get('since'))
+    limit = request.args.get('limit', PAGE_SIZE, type=int)
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        abort(400, f"limit must be between 1 and {MAX_PAGE_SIZE}.")
+    user_id = request.args.get('user_id', type=int)
+
+    entries = read_log(ChangeLog, cursor['c'], limit)
+    more = len(entries) > limit
+    entries = entries[:limit]
+    changes = reference_changes(entries)
+    next_cursor = {
+        'c': [entries[-1].txid, entries[-1].id] if entries else cursor['c'],
+        'r': cursor['r'],
+        'u': cursor['u'],
+        's': cursor['s'],
+    }
+
+    if user_id is not None:
+        shard = shards.shard_for(user_id)
+        after = cursor['r'] if (cursor['u'], cursor['s']) == (user_id, shard) else START
+        with shards.routed(shard):
+            entries = read_log(RoundChange, after, limit, RoundChange.user_id == user_id)
+            more = more or len(entries) > limit
+            entries = entries[:limit]
+            changes.extend(round_changes(entries))
+        next_cursor['r'] = [entries[-1].txid, entries[-1].id] if entries else after
+        next_cursor['u'], next_cursor['s'] = user_id, shard
+
+    return jsonify({
+        'changes': changes,
+        'next': encode_token(next_cursor),
+        'more': more,
+    }), 200
@@ -0,0 +1,44 @@
+from contextlib import contextmanager
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class QueryCapture(object):
+    """Context manager which records every SQL statement sent to any engine"""
+
+    def __init__(self):
+        self.statements = []
+
+    def __enter__(self):
+        event.listen(Engine, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(Engine, 'before_cursor_execute', self._record)
+        return False
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append((statement, parameters))
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def report(self):
+        """Return the captured statements numbered, one per line"""
+        return '\n'.join(
+            f"{number}: {statement}"
+            for number, (statement, _) in enumerate(self.statements, start=1)
+        )
+
+
+@contextmanager
+def assert_max_queries(limit):
+    """Fail if the wrapped block issues more than limit SQL statements"""
+    with QueryCapture() as capture:
+        yield capture
+    if capture.count > limit:
+        raise AssertionError(
+            f"Expected at most {limit} queries, {capture.count} were issued:\n"
+            f"{capture.report()}"
+        )
@@ -1,41 +1,89 @@
 from flask import Blueprint, jsonify, request, abort, Response, url_for
-from flask_app.models import Course, Hole, Yardage, Tee, User, Round
-from flask_app import db
+from flask_app.models import Course, Hole, Yardage, Tee, User, Round, Event
+from flask_app import changes, db, leaderboard, shards, sketches, statements
+from flask_app.idempotency import idempotent
+from flask_app.handicap import differential, handicap_index, recent_differentials, what_if
+from flask_app.loaders import fetch_by_ids, parse_date_range, parse_include
+from sqlalchemy import func, literal, select, update
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import joinedload
+from sqlalchemy.orm.exc import StaleDataError
 import traceback
 
 PAGE_SIZE = 10
+MAX_HOLES = 18
+MAX_WHAT_IF = 1000
+HOLE_FIELDS = {
+    'score': 'score_by_hole',
+    'putts': 'putts',
+    'fairways': 'fairways',
+    'gir': 'gir'
+}
 user_bp = Blueprint('users', __name__, url_prefix='/users')
 
+@user_bp.url_value_preprocessor
+def route_to_shard(endpoint, values):
+    """Send the request's user and round statements to the user's shard"""
+    shards.route(values.get('id') if values else None, write=request.method != 'GET')
+
 @user_bp.route('/<int:id>')
 def user_detail(id):
     pass
 
 @user_bp.route('/<int:id>/rounds', methods=["GET", "POST"])
+@idempotent
 def retrieve_rounds(id):
     """Endpoint for rounds associated with the user which has id, GET request
-    will return user rounds, POST request to add a round for the user."""
-    user = User.query.get(id)
+    will return user rounds, ?include=course,tee embeds the related objects
+    with one query per relation and ?from=&to= limits the dates, so only the
+    matching monthly partitions are read. POST request to add a round for
+    the user, retries sending the same Idempotency-Key header get the first
+    response back."""
+    user = statements.get(User, id)
     if not user:
         abort(404, f"User with id: {id} does not exist.")
 
     if request.method == 'GET':
         page = request.args.get('page', 1, type=int)
         start = PAGE_SIZE * (page - 1)
-        end = start + PAGE_SIZE 
-        formatted_rounds = [round.format() for round in user.rounds[start:end]]
+        first, last = parse_date_range()
+        query = Round.query.with_parent(user).options(joinedload(Round.tee))
+        if first:
+            query = query.filter(Round.date >= first)
+        if last:
+            query = query.filter(Round.date <= last)
+        rounds = query.order_by(Round.date).offset(start).limit(PAGE_SIZE).all()
+        formatted_rounds = [round.format() for round in rounds]
         if not formatted_rounds:
             abort(404, f"No rounds exist for user with id: {id}.")
+        include = parse_include(('course', 'tee'))
+        if 'course' in include:
+            courses = fetch_by_ids(Course, [round.course_id for round in rounds])
+            for round, round_dict in zip(rounds, formatted_rounds):
+                course = courses.get(round.course_id)
+                round_dict['course'] = course.detail_format() if course else None
+        if 'tee' in include:
+            # tees are joined onto the rounds query already
+            for round, round_dict in zip(rounds, formatted_rounds):
+                round_dict['tee'] = round.tee.detail_format() if round.tee else None
         return jsonify(formatted_rounds), 200
 
     if request.method == 'POST':
         data = request.get_json(force=True)
-        course = Course.query.get(data.pop('course_id', None))
-        tee = Tee.query.get(data.pop('tee_id', None))
+        course = statements.get(Course, data.pop('course_id', None))
+        tee = statements.get(Tee, data.pop('tee_id', None))
+        if data.get('event_id') is not None:
+            event = statements.get(Event, data['event_id'])
+            if not event or not course or event.course_id != course.id:
+                abort(400, "Event does not exist or is played on a different course.")
         if course and tee:
             try:
                 new_round = Round(user=user, course=course, tee=tee, **data)
                 db.session.add(new_round)
+                db.session.flush()
+                round_id = new_round.id
+                sketches.record(course.id, tee.id, None, new_round.score_by_hole)
                 db.session.commit()
             except DBAPIError as ex: 
                 db.session.rollback()
@@ -43,11 +91,13 @@ def retrieve_rounds(id):
             except ValueError as ex:
                 db.session.rollback()
                 abort(400, f"The following value error occurred: {str(ex)}")
+            if data.get('event_id') is not None:
+                leaderboard.round_added(new_round)
             return Response(
                 headers={'Location': url_for(
                     'users.round_detail',
-                    id=user.id,
-                    round_id=new_round.id
+                    id=id,
+                    round_id=round_id
                 )},
                 status=201
             )   
@@ -58,10 +108,10 @@ def round_detail(id, round_id):
     """Round detail endpoint, GET request will return detailed data for 
     round record with round_id, PATCH request allows update of round record with
     round_id"""
-    user = User.query.get(id)
+    user = statements.get(User, id)
     if not user:
         abort(404, f"User with id: {id} does not exist.")
-    round = Round.query.get(round_id)
+    round = statements.get(Round, round_id, statements.ROUND_WITH_TEE)
     if not round:
         abort(404, f"Round recorde with id: {round_id} does not exist.")
 
@@ -70,13 +120,177 @@ def round_detail(id, round_id):
 
     if request.method == "PATCH":
         data = request.get_json(force=True)
+        previous_event_id = round.event_id
+        previous_scores = round.score_by_hole
+        previous_tee = (round.course_id, round.tee_id)
         try:
             for key in data.keys():
                 setattr(round, key, data[key])
+            event_id, scores = round.event_id, round.score_by_hole
+            db.session.flush()
+            if previous_tee != (round.course_id, round.tee_id):
+                # the round leaves the old tee's sketch for the new one's
+                sketches.record(*previous_tee, previous_scores, None)
+                sketches.record(round.course_id, round.tee_id, None, scores)
+            else:
+                sketches.record(round.course_id, round.tee_id, previous_scores, scores)
             db.session.commit()
         except DBAPIError as ex:
             db.session.rollback()
             abort(400, f"""The following exception occurred when attempting
                 to update the round: {str(ex)}""")
+        except StaleDataError:
+            db.session.rollback()
+            abort(409, "The round was modified while it was being updated.")
+        if previous_event_id and previous_event_id != event_id:
+            leaderboard.registry().discard(previous_event_id)
+        if event_id:
+            leaderboard.round_scored(event_id, round_id, scores)
+
+        return jsonify({}), 201
+
+def hole_values(number, fields):
+    """Validate the update for one hole, returning (column, value) pairs"""
+    if number < 1 or number > MAX_HOLES:
+        abort(400, f"hole number must be between 1 and {MAX_HOLES}")
+    if not isinstance(fields, dict) or not fields:
+        abort(400, f"No values given for hole {number}.")
+    values = []
+    for key, value in fields.items():
+        if key not in HOLE_FIELDS:
+            abort(400, f"Unknown hole field {key}, choose from: {', '.join(HOLE_FIELDS)}.")
+        if value is not None and (not isinstance(value, int) or isinstance(value, bool)):
+            abort(400, f"{key} for hole {number} must be an integer or null.")
+        values.append((HOLE_FIELDS[key], value))
+    return values
 
-        return jsonify({}), 201
\ No newline at end of file
+def update_holes(user_id, round_id, holes, version=None):
+    """Set individual hole values of a round with a single UPDATE, touching only
+    the array elements given. When version is given the update only applies
+    if the round is still at that version, otherwise a 409 is raised. A hole
+    past the end of the round's scores is a 400: writing it would pad the
+    arrays with nulls and silently lengthen the round, so a round scored as
+    it is played is created with a null score for each of its holes."""
+    table = Round.__table__
+    new_values = {}
+    for number, fields in holes:
+        for column, value in hole_values(number, fields):
+            current = new_values.get(column, table.c[column])
+            new_values[column] = func.array_set_element(
+                current, number, literal(value, db.Integer),
+                type_=postgresql.ARRAY(db.Integer)
+            )
+    new_values['version'] = table.c.version + 1
+    # the scores before the update are read from a locked self join, so the
+    # score distributions can be moved in the same round trip
+    previous = select([
+        table.c.id, table.c.score_by_hole.label('previous_scores')
+    ]).where(table.c.id == round_id).with_for_update().alias('previous')
+    last_hole = max(number for number, _ in holes)
+    statement = update(table).where(table.c.id == previous.c.id).where(table.c.user_id == user_id)
+    statement = statement.where(func.cardinality(table.c.score_by_hole) >= last_hole)
+    if version is not None:
+        statement = statement.where(table.c.version == version)
+    statement = statement.values(new_values).returning(
+        table.c.version, table.c.event_id, table.c.course_id, table.c.tee_id,
+        previous.c.previous_scores, table.c.score_by_hole,
+        table.c.putts, table.c.fairways, table.c.gir
+    )
+    try:
+        row = db.session.execute(statement).fetchone()
+    except DBAPIError as ex:
+        db.session.rollback()
+        abort(400, f"Error updating round holes. {str(ex)}")
+    if row is None:
+        db.session.rollback()
+        current = db.session.query(
+            Round.version, func.cardinality(Round.score_by_hole)
+        ).filter_by(id=round_id, user_id=user_id).first()
+        if current is None:
+            abort(404, f"Round record with id: {round_id} does not exist for user: {user_id}.")
+        current, hole_count = current
+        if last_hole > hole_count:
+            abort(400, f"The round has {hole_count} holes.")
+        abort(409, f"Round has been modified, its current version is {current}.")
+    try:
+        sketches.record(row.course_id, row.tee_id, row.previous_scores, row.score_by_hole)
+        changes.round_changed(round_id, user_id)
+        db.session.commit()
+    except DBAPIError as ex:
+        db.session.rollback()
+        abort(400, f"Error updating round holes. {str(ex)}")
+    if row.event_id:
+        leaderboard.round_scored(row.event_id, round_id, row.score_by_hole)
+    return {
+        key: row[key] for key in ('version', 'event_id', 'score_by_hole', 'putts', 'fairways', 'gir')
+    }
+
+@user_bp.route('/<int:id>/rounds/<int:round_id>/holes/<int:number>', methods=["PATCH"])
+def round_hole_detail(id, round_id, number):
+    """Update the score, putts, fairways or gir of a single hole of a round, e.g.
+    {"score": 5, "putts": 2, "version": 3}. Only that array element is written,
+    so rounds can be scored as they are played."""
+    data = request.get_json(force=True)
+    if not isinstance(data, dict):
+        abort(400, "The request body must be a JSON object.")
+    version = data.pop('version', None)
+    return jsonify(update_holes(id, round_id, [(number, data)], version)), 200
+
+@user_bp.route('/<int:id>/rounds/<int:round_id>/holes', methods=["PATCH"])
+def round_holes(id, round_id):
+    """Update several holes of a round at once, e.g.
+    {"version": 3, "holes": {"1": {"score": 4}, "2": {"score": 5, "putts": 2}}}"""
+    data = request.get_json(force=True)
+    if not isinstance(data, dict):
+        abort(400, "The request body must be a JSON object.")
+    holes = data.get('holes')
+    if not isinstance(holes, dict) or not holes:
+        abort(400, "holes must map hole numbers to the values to set.")
+    try:
+        holes = [(int(number), fields) for number, fields in holes.items()]
+    except ValueError:
+        abort(400, "hole numbers must be integers.")
+    return jsonify(update_holes(id, round_id, holes, data.get('version'))), 200
+
+@user_bp.route('/<int:id>/handicap/what-if', methods=["POST"])
+def handicap_what_if(id):
+    """Handicap index the user would have after each hypothetical round, e.g.
+    {"tee_id": 3, "scores": [72, 73, 74]} for a curve from one tee, or
+    {"scores": [72, 80], "tee_ids": [3, 7]} pairing each score with a tee."""
+    if not db.session.query(User.id).filter_by(id=id).scalar():
+        abort(404, f"User with id: {id} does not exist.")
+    data = request.get_json(force=True)
+    if not isinstance(data, dict):
+        abort(400, "The request body must be a JSON object.")
+    scores = data.get('scores')
+    if not isinstance(scores, list) or not scores:
+        abort(400, "scores must be a list of hypothetical scores.")
+    if len(scores) > MAX_WHAT_IF:
+        abort(400, f"At most {MAX_WHAT_IF} scores may be evaluated at once.")
+    tee_ids = data.get('tee_ids', [data.get('tee_id')] * len(scores))
+    if not isinstance(tee_ids, list) or len(tee_ids) != len(scores):
+        abort(400, "Give a tee_id, or one tee id in tee_ids for every score.")
+    tees = fetch_by_ids(Tee, [tee_id for tee_id in tee_ids if isinstance(tee_id, int)])
+    candidates = []
+    for score, tee_id in zip(scores, tee_ids):
+        tee = tees.get(tee_id)
+        if not tee or not tee.course_rating or not tee.slope_rating:
+            abort(400, f"Tee {tee_id} does not exist or has no course and slope rating.")
+        if not isinstance(score, int) or isinstance(score, bool) or score <= 0:
+            abort(400, "scores must be positive integers.")
+        candidates.append(differential(score, tee.course_rating, tee.slope_rating))
+    differentials = recent_differentials([id])[id]
+    indexes = what_if(differentials, candidates)
+    return jsonify({
+        'handicap_index': handicap_index(differentials),
+        'rounds': len(differentials),
+        'results': [
+            {
+                'score': score,
+                'tee_id': tee_id,
+                'differential': round(candidate, 1),
+                'handicap_index': index
+            }
+            for score, tee_id, candidate, index in zip(scores, tee_ids, candidates, indexes)
+        ]
+    }), 200
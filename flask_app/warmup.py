@@ -0,0 +1,115 @@
+import time
+from flask import g
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import configure_mappers, joinedload, selectinload
+from flask_app import db, shards
+from flask_app.config import env_flag, env_int
+from flask_app.metrics import STARTUP_SECONDS
+
+MISSING_ID = 0
+
+
+class StartupReport(object):
+    """How long each phase of bringing the application up took, in seconds"""
+
+    def __init__(self, import_seconds, create_app_seconds):
+        self.import_seconds = import_seconds
+        self.create_app_seconds = create_app_seconds
+        self.warmup = {}
+        self.first_request_seconds = None
+
+    def as_dict(self):
+        return {
+            'import': self.import_seconds,
+            'create_app': self.create_app_seconds,
+            'warmup': dict(self.warmup),
+            'first_request': self.first_request_seconds,
+        }
+
+    def publish(self):
+        """Copy the timings into the startup gauge"""
+        STARTUP_SECONDS.labels('import').set(self.import_seconds)
+        STARTUP_SECONDS.labels('create_app').set(self.create_app_seconds)
+        for phase, seconds in self.warmup.items():
+            STARTUP_SECONDS.labels(f"warmup_{phase}").set(seconds)
+        if self.first_request_seconds is not None:
+            STARTUP_SECONDS.labels('first_request').set(self.first_request_seconds)
+
+
+def hot_queries():
+    """The queries the request handlers issue, keyed so that nothing matches"""
+    from flask_app.models import Course, Hole, Round, Tee, User, Yardage
+    return [
+        Course.query.filter(Course.id == MISSING_ID),
+        Course.query.order_by(Course.id).filter(Course.id == MISSING_ID).offset(0).limit(1),
+        Hole.query.options(
+            selectinload(Hole.tees).joinedload(Yardage.tee)
+        ).filter(Hole.id == MISSING_ID),
+        Hole.query.filter(Hole.course_id == MISSING_ID),
+        Tee.query.filter(Tee.id == MISSING_ID),
+        Tee.query.filter(Tee.course_id == MISSING_ID),
+        User.query.filter(User.id == MISSING_ID),
+        Round.query.options(joinedload(Round.tee)).filter(Round.id == MISSING_ID),
+        Round.query.options(joinedload(Round.tee)).filter(
+            Round.user_id == MISSING_ID
+        ).order_by(Round.date).offset(0).limit(1),
+    ]
+
+def open_connections(engine, count):
+    """Check out count connections at once so the pool holds them open"""
+    connections = []
+    try:
+        for _ in range(count):
+            connections.append(engine.connect())
+    finally:
+        for connection in connections:
+            connection.close()
+
+def warm_up(app):
+    """Do the work the first request would otherwise pay for: configure the
+    mappers, fill the connection pool and run each hot query once"""
+    timings = {}
+    with app.app_context():
+        started = time.perf_counter()
+        configure_mappers()
+        timings['mappers'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        try:
+            engine = db.engine
+            count = app.config['WARMUP_CONNECTIONS'] or engine.pool.size()
+            open_connections(engine, count)
+            for shard in shards.each():
+                for query in hot_queries():
+                    query.all()
+        except DBAPIError as ex:
+            app.logger.warning(f"Database warm-up skipped: {ex}")
+        finally:
+            db.session.remove()
+        timings['database'] = time.perf_counter() - started
+    return timings
+
+
+def init_app(app, import_seconds, create_app_seconds):
+    """Run the warm-up phase and record the startup timings of the app"""
+    app.config.setdefault('WARMUP_ENABLED', env_flag('WARMUP_ENABLED', not app.testing))
+    app.config.setdefault('WARMUP_CONNECTIONS', env_int('WARMUP_CONNECTIONS', 0))
+    report = StartupReport(import_seconds, create_app_seconds)
+    app.extensions['startup_report'] = report
+    if app.config['WARMUP_ENABLED']:
+        report.warmup = warm_up(app)
+    report.publish()
+
+    @app.before_request
+    def time_first_request():
+        if report.first_request_seconds is None:
+            g.first_request_started = time.perf_counter()
+
+    @app.after_request
+    def report_first_request(response):
+        started = g.pop('first_request_started', None)
+        if started is not None and report.first_request_seconds is None:
+            report.first_request_seconds = time.perf_counter() - started
+            report.publish()
+            app.logger.info(f"Startup timings: {report.as_dict()}")
+        return response
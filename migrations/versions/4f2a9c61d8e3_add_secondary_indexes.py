@@ -0,0 +1,41 @@
+"""add secondary indexes
+
+Revision ID: 4f2a9c61d8e3
+Revises: 1b9bc83db33a
+Create Date: 2026-10-19 09:12:31.482113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4f2a9c61d8e3'
+down_revision = '1b9bc83db33a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # course.tees and tee lookups by colour, the model already declares this
+    # constraint but the initial migration never created it
+    op.create_unique_constraint('course_colour_unique', 'tees', ['course_id', 'colour'])
+    # course.holes, hole listings in number order
+    op.create_index('ix_holes_course_id_number', 'holes', ['course_id', 'number'])
+    # hole.tees, the primary key (tee_id, hole_id) only serves tee.holes
+    op.create_index('ix_yardages_hole_id', 'yardages', ['hole_id'])
+    # user.rounds ordered by date, and date ranges for a user
+    op.create_index('ix_rounds_user_id_date', 'rounds', ['user_id', 'date'])
+    # course.rounds and per course/tee statistics
+    op.create_index('ix_rounds_course_id_tee_id', 'rounds', ['course_id', 'tee_id'])
+    # tee.rounds
+    op.create_index('ix_rounds_tee_id', 'rounds', ['tee_id'])
+
+
+def downgrade():
+    op.drop_index('ix_rounds_tee_id', table_name='rounds')
+    op.drop_index('ix_rounds_course_id_tee_id', table_name='rounds')
+    op.drop_index('ix_rounds_user_id_date', table_name='rounds')
+    op.drop_index('ix_yardages_hole_id', table_name='yardages')
+    op.drop_index('ix_holes_course_id_number', table_name='holes')
+    op.drop_constraint('course_colour_unique', 'tees', type_='unique')
@@ -0,0 +1,38 @@
+"""round hole updates
+
+Revision ID: 7c3e5d21a9b4
+Revises: 4f2a9c61d8e3
+Create Date: 2026-10-19 13:41:08.215907
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c3e5d21a9b4'
+down_revision = '4f2a9c61d8e3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # optimistic concurrency for rounds scored hole by hole
+    op.add_column('rounds', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+    op.execute("""
+        CREATE OR REPLACE FUNCTION array_set_element(arr integer[], idx integer, val integer)
+        RETURNS integer[] AS $$
+        BEGIN
+            IF arr IS NULL OR cardinality(arr) = 0 THEN
+                arr := array_fill(NULL::integer, ARRAY[idx]);
+            END IF;
+            arr[idx] := val;
+            RETURN arr;
+        END;
+        $$ LANGUAGE plpgsql IMMUTABLE
+    """)
+
+
+def downgrade():
+    op.execute("DROP FUNCTION IF EXISTS array_set_element(integer[], integer, integer)")
+    op.drop_column('rounds', 'version')
@@ -0,0 +1,38 @@
+"""add events
+
+Revision ID: 9d4b7f02c6e1
+Revises: 7c3e5d21a9b4
+Create Date: 2026-10-19 15:02:44.631580
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d4b7f02c6e1'
+down_revision = '7c3e5d21a9b4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('events',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('course_id', sa.Integer(), nullable=False),
+    sa.Column('date', sa.Date(), nullable=True),
+    sa.ForeignKeyConstraint(['course_id'], ['courses.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.add_column('rounds', sa.Column('event_id', sa.Integer(), nullable=True))
+    op.create_foreign_key('rounds_event_id_fkey', 'rounds', 'events', ['event_id'], ['id'])
+    # leaderboards load every round of an event
+    op.create_index('ix_rounds_event_id', 'rounds', ['event_id'])
+
+
+def downgrade():
+    op.drop_index('ix_rounds_event_id', table_name='rounds')
+    op.drop_constraint('rounds_event_id_fkey', 'rounds', type_='foreignkey')
+    op.drop_column('rounds', 'event_id')
+    op.drop_table('events')
@@ -0,0 +1,37 @@
+"""add score sketches
+
+Revision ID: b1e8a4c3d570
+Revises: 9d4b7f02c6e1
+Create Date: 2026-10-19 16:20:17.904361
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'b1e8a4c3d570'
+down_revision = '9d4b7f02c6e1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('score_sketches',
+    sa.Column('tee_id', sa.Integer(), nullable=False),
+    sa.Column('holes', sa.Integer(), nullable=False),
+    sa.Column('course_id', sa.Integer(), nullable=False),
+    sa.Column('total', sa.Integer(), nullable=False),
+    sa.Column('counts', postgresql.ARRAY(sa.Integer()), nullable=False),
+    sa.ForeignKeyConstraint(['course_id'], ['courses.id'], ),
+    sa.ForeignKeyConstraint(['tee_id'], ['tees.id'], ),
+    sa.PrimaryKeyConstraint('tee_id', 'holes')
+    )
+    op.create_index('ix_score_sketches_course_id', 'score_sketches', ['course_id'])
+    # existing rounds are counted with `flask sketches rebuild`
+
+
+def downgrade():
+    op.drop_index('ix_score_sketches_course_id', table_name='score_sketches')
+    op.drop_table('score_sketches')
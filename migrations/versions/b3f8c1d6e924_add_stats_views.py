@@ -0,0 +1,60 @@
+"""add stats views
+
+Revision ID: b3f8c1d6e924
+Revises: a7d2e5b9c431
+Create Date: 2026-10-20 00:27:39.604118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3f8c1d6e924'
+down_revision = 'a7d2e5b9c431'
+branch_labels = None
+depends_on = None
+
+VIEWS = [
+    ('stats_daily_rounds', """
+        SELECT date, count(*) AS rounds, count(DISTINCT user_id) AS players
+        FROM rounds
+        GROUP BY date
+    """, 'date'),
+    ('stats_active_users', """
+        SELECT timezone('utc', now()) AS refreshed_at,
+               count(DISTINCT user_id) FILTER (WHERE date > current_date - 1) AS day,
+               count(DISTINCT user_id) FILTER (WHERE date > current_date - 7) AS week,
+               count(DISTINCT user_id) FILTER (WHERE date > current_date - 30) AS month,
+               count(DISTINCT user_id) AS year
+        FROM rounds
+        WHERE date > current_date - 365
+    """, 'refreshed_at'),
+    ('stats_course_rounds', """
+        SELECT course_id, count(*) AS rounds, count(DISTINCT user_id) AS players,
+               max(date) AS last_played
+        FROM rounds
+        WHERE course_id IS NOT NULL
+        GROUP BY course_id
+    """, 'course_id'),
+    ('stats_tee_scores', """
+        SELECT course_id, tee_id, cardinality(score_by_hole) AS holes,
+               count(*) AS rounds, sum(total)::bigint AS strokes
+        FROM rounds, LATERAL (SELECT sum(s) AS total FROM unnest(score_by_hole) AS s) AS totals
+        WHERE tee_id IS NOT NULL AND cardinality(score_by_hole) IN (9, 18)
+          AND array_position(score_by_hole, NULL) IS NULL
+        GROUP BY course_id, tee_id, cardinality(score_by_hole)
+    """, 'tee_id, holes'),
+]
+
+
+def upgrade():
+    # populated once here, `flask stats refresh` keeps them current
+    for name, query, unique in VIEWS:
+        op.execute(f"CREATE MATERIALIZED VIEW {name} AS {query}")
+        op.execute(f"CREATE UNIQUE INDEX ix_{name}_unique ON {name} ({unique})")
+
+
+def downgrade():
+    for name, query, unique in reversed(VIEWS):
+        op.execute(f"DROP MATERIALIZED VIEW {name}")
@@ -0,0 +1,94 @@
+"""partition rounds by date
+
+Revision ID: c52f9e7a1d08
+Revises: b1e8a4c3d570
+Create Date: 2026-10-19 17:48:52.307716
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c52f9e7a1d08'
+down_revision = 'b1e8a4c3d570'
+branch_labels = None
+depends_on = None
+
+COLUMNS = "id, user_id, course_id, tee_id, date, score_by_hole, putts, fairways, gir, version, event_id"
+INDEXES = (
+    ('ix_rounds_user_id_date', 'user_id, date'),
+    ('ix_rounds_course_id_tee_id', 'course_id, tee_id'),
+    ('ix_rounds_tee_id', 'tee_id'),
+    ('ix_rounds_event_id', 'event_id'),
+)
+
+
+def create_rounds(partitioned):
+    # declarative partitioning needs PostgreSQL 11 or later, and the
+    # partition key has to be part of the primary key
+    op.execute(f"""
+        CREATE TABLE rounds (
+            id integer NOT NULL DEFAULT nextval('rounds_id_seq'),
+            user_id integer,
+            course_id integer,
+            tee_id integer,
+            date date {'NOT NULL DEFAULT CURRENT_DATE' if partitioned else ''},
+            score_by_hole integer[] NOT NULL,
+            putts integer[],
+            fairways integer[],
+            gir integer[],
+            version integer NOT NULL DEFAULT 1,
+            event_id integer,
+            CONSTRAINT rounds_pkey PRIMARY KEY ({'id, date' if partitioned else 'id'}),
+            CONSTRAINT rounds_user_id_fkey FOREIGN KEY (user_id) REFERENCES users (id),
+            CONSTRAINT rounds_course_id_fkey FOREIGN KEY (course_id) REFERENCES courses (id),
+            CONSTRAINT rounds_tee_id_fkey FOREIGN KEY (tee_id) REFERENCES tees (id),
+            CONSTRAINT rounds_event_id_fkey FOREIGN KEY (event_id) REFERENCES events (id)
+        ) {'PARTITION BY RANGE (date)' if partitioned else ''}
+    """)
+
+def replace_rounds(partitioned):
+    """Swap rounds for a new table of the other kind, copying every row. The
+    old table's indexes are dropped first to free their names, and the new
+    ones are built after the copy."""
+    op.execute("ALTER TABLE rounds RENAME TO rounds_old")
+    op.execute("ALTER TABLE rounds_old RENAME CONSTRAINT rounds_pkey TO rounds_old_pkey")
+    for name, columns in INDEXES:
+        op.execute(f"DROP INDEX IF EXISTS {name}")
+    create_rounds(partitioned)
+    if partitioned:
+        op.execute("""
+            DO $$
+            DECLARE
+                month date;
+            BEGIN
+                FOR month IN SELECT generate_series(
+                    date_trunc('month', COALESCE((SELECT min(date) FROM rounds_old), CURRENT_DATE)),
+                    date_trunc('month', CURRENT_DATE) + interval '3 months',
+                    interval '1 month'
+                )::date LOOP
+                    EXECUTE format(
+                        'CREATE TABLE %I PARTITION OF rounds FOR VALUES FROM (%L) TO (%L)',
+                        'rounds_y' || to_char(month, 'YYYY') || 'm' || to_char(month, 'MM'),
+                        month, (month + interval '1 month')::date
+                    );
+                END LOOP;
+            END $$
+        """)
+        op.execute("CREATE TABLE rounds_default PARTITION OF rounds DEFAULT")
+    op.execute(f"INSERT INTO rounds ({COLUMNS}) SELECT {COLUMNS} FROM rounds_old")
+    # the sequence belongs to the old id column and would be dropped with it
+    op.execute("ALTER SEQUENCE rounds_id_seq OWNED BY rounds.id")
+    op.execute("DROP TABLE rounds_old")
+    for name, columns in INDEXES:
+        op.execute(f"CREATE INDEX {name} ON rounds ({columns})")
+
+
+def upgrade():
+    op.execute("UPDATE rounds SET date = CURRENT_DATE WHERE date IS NULL")
+    replace_rounds(partitioned=True)
+
+
+def downgrade():
+    replace_rounds(partitioned=False)
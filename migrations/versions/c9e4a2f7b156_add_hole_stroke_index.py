@@ -0,0 +1,24 @@
+"""add hole stroke index
+
+Revision ID: c9e4a2f7b156
+Revises: b3f8c1d6e924
+Create Date: 2026-10-20 01:14:52.380417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c9e4a2f7b156'
+down_revision = 'b3f8c1d6e924'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('holes', sa.Column('stroke_index', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('holes', 'stroke_index')
@@ -0,0 +1,38 @@
+"""add slow queries
+
+Revision ID: d6a3f1e90b27
+Revises: c52f9e7a1d08
+Create Date: 2026-10-19 19:05:41.220518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'd6a3f1e90b27'
+down_revision = 'c52f9e7a1d08'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('slow_queries',
+    sa.Column('fingerprint', sa.String(length=40), nullable=False),
+    sa.Column('endpoint', sa.String(), nullable=False),
+    sa.Column('statement', sa.Text(), nullable=False),
+    sa.Column('calls', sa.Integer(), nullable=False),
+    sa.Column('total_ms', sa.Float(), nullable=False),
+    sa.Column('max_ms', sa.Float(), nullable=False),
+    sa.Column('parameters', postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+    sa.Column('stack', sa.Text(), nullable=True),
+    sa.Column('plan', postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+    sa.Column('first_seen', sa.DateTime(), nullable=False),
+    sa.Column('last_seen', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('fingerprint')
+    )
+
+
+def downgrade():
+    op.drop_table('slow_queries')
@@ -0,0 +1,29 @@
+"""add shard buckets
+
+Revision ID: e83b5c2d6f14
+Revises: d6a3f1e90b27
+Create Date: 2026-10-19 20:41:09.513377
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e83b5c2d6f14'
+down_revision = 'd6a3f1e90b27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('shard_buckets',
+    sa.Column('bucket', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('shard', sa.String(), nullable=False),
+    sa.Column('moving', sa.Boolean(), server_default='false', nullable=False),
+    sa.PrimaryKeyConstraint('bucket')
+    )
+
+
+def downgrade():
+    op.drop_table('shard_buckets')
@@ -0,0 +1,44 @@
+"""add change log
+
+Revision ID: f4a7c9e2b318
+Revises: e83b5c2d6f14
+Create Date: 2026-10-19 22:12:47.108264
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f4a7c9e2b318'
+down_revision = 'e83b5c2d6f14'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('change_log',
+    sa.Column('id', sa.BigInteger(), nullable=False),
+    sa.Column('txid', sa.BigInteger(), server_default=sa.text('txid_current()'), nullable=False),
+    sa.Column('entity', sa.String(), nullable=False),
+    sa.Column('key', sa.String(), nullable=False),
+    sa.Column('op', sa.String(length=6), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_change_log_txid_id', 'change_log', ['txid', 'id'], unique=False)
+    op.create_table('round_changes',
+    sa.Column('id', sa.BigInteger(), nullable=False),
+    sa.Column('txid', sa.BigInteger(), server_default=sa.text('txid_current()'), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('round_id', sa.Integer(), nullable=False),
+    sa.Column('op', sa.String(length=6), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_round_changes_user_id_txid_id', 'round_changes', ['user_id', 'txid', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_round_changes_user_id_txid_id', table_name='round_changes')
+    op.drop_table('round_changes')
+    op.drop_index('ix_change_log_txid_id', table_name='change_log')
+    op.drop_table('change_log')
@@ -0,0 +1,111 @@
+import threading, unittest
+from flask_app import create_app, db
+from flask_app.admission import Budget, parse_limits
+from flask_app.models import Course, User
+
+
+class AdmissionTestCase(unittest.TestCase):
+    """Class for testing admission control against a small pool"""
+
+    def setUp(self):
+        """Set up for tests"""
+        self.app = create_app({
+            'TEST_DB_URI': 'postgresql://test:password@db:5432/testdb',
+            'SQLALCHEMY_ENGINE_OPTIONS': {'pool_size': 2, 'max_overflow': 0, 'pool_timeout': 5},
+            'ADMISSION_QUEUE_SIZE': 1,
+            'ADMISSION_QUEUE_TIMEOUT_MS': 50,
+            'ADMISSION_RETRY_AFTER_SECONDS': 2,
+            'ADMISSION_ENDPOINT_LIMITS': {'users.retrieve_rounds': 1},
+        })
+        self.client = self.app.test_client
+        self.controller = self.app.extensions['admission']
+        self.db = db
+        self.db.create_all()
+        user = User(name="Jon Snow")
+        self.db.session.add_all([user, Course(name="Fake golf course", location="fake location")])
+        self.db.session.commit()
+        self.user_id = user.id
+        self.db.session.remove()
+
+    def tearDown(self):
+        """Test teardown"""
+        self.db.session.remove()
+        self.db.drop_all()
+
+    def test_budgets_split_the_pool(self):
+        """Test the default limits divide the pool between reads and writes"""
+        self.assertEqual(self.controller.budgets['write'].limit, 1)
+        self.assertEqual(self.controller.budgets['read'].limit, 1)
+
+    def test_write_saturation_spares_reads(self):
+        """Test writes are shed with Retry-After while reads are served"""
+        write = self.controller.budgets['write']
+        self.assertIsNone(write.acquire(0))
+        try:
+            res = self.client().post("/courses", json={"name": "New", "location": "Somewhere"})
+            self.assertEqual(res.status_code, 503)
+            self.assertEqual(res.headers['Retry-After'], '2')
+            self.assertEqual(self.client().get("/courses").status_code, 200)
+        finally:
+            write.release()
+        res = self.client().post("/courses", json={"name": "New", "location": "Somewhere"})
+        self.assertEqual(res.status_code, 201)
+
+    def test_queued_request_is_admitted(self):
+        """Test a waiting request gets the slot released within its deadline"""
+        self.controller.timeout = 2.0
+        read = self.controller.budgets['read']
+        self.assertIsNone(read.acquire(0))
+        timer = threading.Timer(0.1, read.release)
+        timer.start()
+        res = self.client().get("/courses")
+        timer.join()
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(read.in_flight, 0)
+
+    def test_endpoint_limit(self):
+        """Test a per endpoint limit sheds that endpoint only"""
+        budget = self.controller.endpoint_budgets['users.retrieve_rounds']
+        self.assertIsNone(budget.acquire(0))
+        try:
+            res = self.client().get(f"/users/{self.user_id}/rounds")
+            self.assertEqual(res.status_code, 503)
+            self.assertEqual(self.client().get("/courses").status_code, 200)
+        finally:
+            budget.release()
+        self.assertEqual(self.controller.budgets['read'].in_flight, 0)
+
+    def test_pool_saturated(self):
+        """Test requests fail fast instead of waiting for the pool timeout
+        while every connection is checked out"""
+        with self.app.app_context():
+            connections = [db.engine.connect() for _ in range(2)]
+        try:
+            res = self.client().get("/courses")
+            self.assertEqual(res.status_code, 503)
+            self.assertIn('Retry-After', res.headers)
+        finally:
+            for connection in connections:
+                connection.close()
+        self.assertEqual(self.client().get("/courses").status_code, 200)
+        metrics = self.client().get("/metrics").data.decode()
+        self.assertIn('golf_api_admission_rejected_total{budget="read",reason="pool_saturated"}', metrics)
+
+    def test_queue_full(self):
+        """Test a budget turns requests away once its queue is full"""
+        budget = Budget('test', 1, 0)
+        self.assertIsNone(budget.acquire(0))
+        self.assertEqual(budget.acquire(1), 'queue_full')
+        budget.release()
+        self.assertIsNone(budget.acquire(0))
+
+    def test_parse_limits(self):
+        """Test endpoint limits are read from the environment format"""
+        self.assertEqual(
+            parse_limits("users.retrieve_rounds=4, courses.hole_detail=8"),
+            {'users.retrieve_rounds': 4, 'courses.hole_detail': 8}
+        )
+        self.assertEqual(parse_limits(None), {})
+
+if __name__ == "__main__":
+    unittest.main()
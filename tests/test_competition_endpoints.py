@@ -0,0 +1,174 @@
+import json, unittest
+from flask_app import create_app, db
+from flask_app.models import Course, Hole, Round, Tee, User
+
+def sample_course(db, pars=(4,) * 18):
+    course = Course(name="Fake golf course", location="fake location")
+    db.session.add(course)
+    db.session.flush()
+    for number, par in enumerate(pars, 1):
+        db.session.add(Hole(course_id=course.id, number=number, par=par))
+    db.session.commit()
+    return course.id
+
+def sample_tee(db, course_id, colour, course_rating, slope_rating):
+    tee = Tee(course_id=course_id, colour=colour,
+        course_rating=course_rating, slope_rating=slope_rating)
+    db.session.add(tee)
+    db.session.commit()
+    return tee.id
+
+def sample_player(db, tee_id, course_id, scores):
+    user = User(name="Player")
+    db.session.add(user)
+    db.session.flush()
+    for score in scores:
+        db.session.add(Round(
+            user_id=user.id, course_id=course_id, tee_id=tee_id,
+            score_by_hole=[score - 17 * 4] + [4] * 17
+        ))
+    db.session.commit()
+    return user.id
+
+
+class CompetitionEndpointTestCase(unittest.TestCase):
+    """Class for testing the competition endpoints"""
+
+    def setUp(self):
+        """Set up for tests"""
+        test_config = {'TEST_DB_URI': 'postgresql://test:password@db:5432/testdb'}
+        self.app = create_app(test_config)
+        self.client = self.app.test_client
+        self.db = db
+        self.db.create_all()
+
+    def tearDown(self):
+        """Test teardown"""
+        self.db.session.remove()
+        self.db.drop_all()
+
+    def test_handicaps(self):
+        """Test course and playing handicaps for a field on different tees"""
+        course_id = sample_course(self.db)
+        white = sample_tee(self.db, course_id, "white", 72.0, 113)
+        blue = sample_tee(self.db, course_id, "blue", 74.5, 130)
+        player = sample_player(self.db, white, course_id, [92, 94, 96])
+        new_player = sample_player(self.db, white, course_id, [])
+        payload = {'allowance': 95, 'entries': [
+            {'user_id': player, 'tee_id': white},
+            {'user_id': player, 'tee_id': blue},
+            {'user_id': new_player, 'tee_id': blue}
+        ]}
+        res = self.client().post("/competitions/handicaps", data=json.dumps(payload))
+        self.assertEqual(res.status_code, 200, res.data)
+        entries = json.loads(res.data)['entries']
+        self.assertEqual([e['handicap_index'] for e in entries], [18.0, 18.0, None])
+        self.assertEqual([e['course_handicap'] for e in entries], [18, 23, None])
+        self.assertEqual([e['playing_handicap'] for e in entries], [17, 22, None])
+
+    def test_handicaps_fail(self):
+        course_id = sample_course(self.db)
+        tee_id = sample_tee(self.db, course_id, "white", 72.0, 113)
+        payload = {'entries': [{'user_id': 99, 'tee_id': tee_id}]}
+        res = self.client().post("/competitions/handicaps", data=json.dumps(payload))
+        self.assertEqual(res.status_code, 400)
+        res = self.client().post("/competitions/handicaps", data=json.dumps({'entries': []}))
+        self.assertEqual(res.status_code, 400)
+        res = self.client().post("/competitions/handicaps", data=json.dumps([payload]))
+        self.assertEqual(res.status_code, 400)
+
+    def field(self):
+        """Three players on a par 4 course with stroke indexes, round ids in
+        the order the players were added"""
+        course_id = sample_course(self.db, pars=(4,) * 9)
+        for hole in Hole.query.filter_by(course_id=course_id):
+            hole.stroke_index = 10 - hole.number
+        tee_id = sample_tee(self.db, course_id, "white", 36.0, 113)
+        cards = [
+            [4, 4, 4, 4, 4, 4, 4, 4, 4],
+            [5, 5, 4, 4, 4, 4, 4, 4, 3],
+            [3, 5, 5, 5, 5, 5, 5, 5, 5],
+        ]
+        round_ids = []
+        for card in cards:
+            user = User(name="Player")
+            self.db.session.add(user)
+            self.db.session.flush()
+            round = Round(user_id=user.id, course_id=course_id, tee_id=tee_id, score_by_hole=card)
+            self.db.session.add(round)
+            self.db.session.flush()
+            round_ids.append(round.id)
+        self.db.session.commit()
+        return course_id, round_ids
+
+    def test_scores(self):
+        """Test every format for a field, with given playing handicaps"""
+        course_id, (first, second, third) = self.field()
+        payload = {
+            'round_ids': [first, second, third],
+            'handicaps': {str(second): 2, str(third): 9},
+            'matches': [[first, second], [third, first]],
+        }
+        res = self.client().post("/competitions/scores", data=json.dumps(payload))
+        self.assertEqual(res.status_code, 200, res.data)
+        body = json.loads(res.data)
+        self.assertEqual((body['course_id'], body['holes']), (course_id, 9))
+        players = body['players']
+        self.assertEqual([p['playing_handicap'] for p in players], [0, 2, 9])
+        self.assertEqual([p['gross'] for p in players], [36, 37, 43])
+        self.assertEqual([p['net'] for p in players], [36, 35, 34])
+        self.assertEqual([p['net_to_par'] for p in players], [0, -1, -2])
+        self.assertEqual([p['stableford'] for p in players], [18, 19, 20])
+        # the second player gets strokes on holes 9 and 8, the hardest, the
+        # third on every hole, holes 2 to 7 are tied and carry to hole 8
+        self.assertEqual([p['skins'] for p in players], [0, 8, 1])
+        self.assertEqual(body['skins'], {
+            'won': [
+                {'hole': 1, 'round_id': third, 'skins': 1},
+                {'hole': 8, 'round_id': second, 'skins': 7},
+                {'hole': 9, 'round_id': second, 'skins': 1},
+            ],
+            'carried': 0,
+        })
+        self.assertEqual(body['matches'], [
+            {'round_ids': [first, second], 'winner': None, 'result': 'halved'},
+            {'round_ids': [third, first], 'winner': third, 'result': '1 up'},
+        ])
+
+    def test_scores_fail(self):
+        """Test fields that cannot be scored are refused"""
+        course_id, round_ids = self.field()
+        self.assertEqual(self.client().post("/competitions/scores", data=json.dumps(
+            {'round_ids': round_ids + [999]}
+        )).status_code, 400)
+        self.assertEqual(self.client().post("/competitions/scores", data=json.dumps(
+            round_ids
+        )).status_code, 400)
+        self.assertEqual(self.client().post("/competitions/scores", data=json.dumps(
+            {'round_ids': round_ids, 'matches': [[round_ids[0], 999]]}
+        )).status_code, 400)
+        user_id = User.query.first().id
+        empty = [Round(user_id=user_id, course_id=course_id, score_by_hole=[]) for _ in range(2)]
+        self.db.session.add_all(empty)
+        self.db.session.commit()
+        self.assertEqual(self.client().post("/competitions/scores", data=json.dumps(
+            {'round_ids': [row.id for row in empty], 'matches': [[row.id for row in empty]]}
+        )).status_code, 400)
+        other = sample_course(self.db, pars=(4,) * 9)
+        other_round = Round(user_id=User.query.first().id, course_id=other, score_by_hole=[4] * 9)
+        self.db.session.add(other_round)
+        self.db.session.commit()
+        self.assertEqual(self.client().post("/competitions/scores", data=json.dumps(
+            {'round_ids': [round_ids[0], other_round.id]}
+        )).status_code, 400)
+        Hole.query.filter_by(course_id=course_id, number=1).one().stroke_index = None
+        self.db.session.commit()
+        res = self.client().post("/competitions/scores", data=json.dumps(
+            {'round_ids': round_ids, 'handicaps': {str(round_ids[0]): 3}}
+        ))
+        self.assertEqual(res.status_code, 400)
+        res = self.client().post("/competitions/scores", data=json.dumps({'round_ids': round_ids}))
+        self.assertEqual(res.status_code, 200)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -87,6 +87,24 @@ class CourseTestCase(unittest.TestCase):
         data = json.loads(res.data)
         self.assertEqual(len(data), 2)
 
+    def test_retrieve_holes_include_yardages(self):
+        """Test ?include=yardages embeds the same tee data as the hole detail"""
+        course_id = sample_course(self.db)
+        tee_id = sample_tee(self.db, course_id, 'blue')
+        hole = Hole(course_id=course_id, number=1, par=4)
+        self.db.session.add(hole)
+        self.db.session.add(Yardage(hole=hole, tee_id=tee_id, yardage=380))
+        self.db.session.add(Hole(course_id=course_id, number=2, par=3))
+        self.db.session.commit()
+        res = self.client().get(f"/courses/{course_id}/holes?include=yardages")
+        self.assertEqual(res.status_code, 200)
+        data = {hole['number']: hole for hole in json.loads(res.data)}
+        self.assertEqual(
+            data[1]['tees'],
+            [{'yardage': 380, 'tee_id': tee_id, 'colour': 'blue'}]
+        )
+        self.assertEqual(data[2]['tees'], [])
+
     def test_post_one_hole_success_no_yardage(self):
         """Test successful post request of one hole to /courses/<course id>/holes,
         without any associated yardage value"""
@@ -325,5 +343,39 @@ class CourseTestCase(unittest.TestCase):
         """Test update fails"""
         pass
 
+    def test_retrieve_courses_batch(self):
+        """Test retrieving several courses by id keeps the requested order and
+        reports missing ids"""
+        course1_id = sample_course(self.db, name="first course")
+        course2_id = sample_course(self.db, name="second course")
+        missing_id = course2_id + 100
+        res = self.client().get(f"/courses?ids={course2_id},{missing_id},{course1_id}")
+        self.assertEqual(res.status_code, 200)
+        data = json.loads(res.data)
+        self.assertEqual([course['id'] for course in data['data']], [course2_id, course1_id])
+        self.assertEqual(data['missing'], [missing_id])
+
+    def test_retrieve_tees_batch(self):
+        """Test retrieving tees from several courses by id"""
+        course1_id = sample_course(self.db)
+        course2_id = sample_course(self.db)
+        tee1_id = sample_tee(self.db, course1_id, 'blue')
+        tee2_id = sample_tee(self.db, course2_id, 'red')
+        res = self.client().get(f"/tees?ids={tee2_id},{tee1_id}")
+        self.assertEqual(res.status_code, 200)
+        data = json.loads(res.data)
+        self.assertEqual([tee['colour'] for tee in data['data']], ['red', 'blue'])
+        self.assertEqual(data['missing'], [])
+
+    def test_retrieve_batch_fail(self):
+        """Test batch requests with bad, missing or too many ids fail"""
+        res = self.client().get("/courses?ids=1,two")
+        self.assertEqual(res.status_code, 400)
+        res = self.client().get("/tees")
+        self.assertEqual(res.status_code, 400)
+        ids = ','.join(str(i) for i in range(1, 200))
+        res = self.client().get(f"/tees?ids={ids}")
+        self.assertEqual(res.status_code, 400)
+
 if __name__ == "__main__":
     unittest.main(verbosity=2)
\ No newline at end of file
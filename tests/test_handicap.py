@@ -0,0 +1,36 @@
+import random, unittest
+from flask_app.handicap import course_handicap, handicap_index, what_if
+
+class HandicapTestCase(unittest.TestCase):
+    """Class for testing the handicap calculations"""
+
+    def test_handicap_index(self):
+        """Test the number of differentials used and the adjustments"""
+        self.assertIsNone(handicap_index([10.0, 12.0]))
+        self.assertEqual(handicap_index([10.0, 12.0, 14.0]), 8.0)
+        self.assertEqual(handicap_index([10.0, 12.0, 14.0, 11.0, 9.0, 13.0]), 8.5)
+        self.assertEqual(handicap_index([float(d) for d in range(20)]), 3.5)
+        self.assertEqual(handicap_index([float(d) for d in range(40, 0, -1)]), 24.5)
+        self.assertEqual(handicap_index([60.0] * 20), 54.0)
+
+    def test_course_handicap(self):
+        self.assertEqual(course_handicap(10.0, 113, 72.0, 72), 10)
+        self.assertEqual(course_handicap(10.0, 130, 73.5, 72), 13)
+        self.assertEqual(course_handicap(None, 130, 73.5, 72), 0)
+
+    def test_what_if_matches_recalculating(self):
+        """Test the vectorized evaluation against recalculating each index"""
+        generator = random.Random(7)
+        candidates = [generator.uniform(-5, 40) for _ in range(50)]
+        for rounds in range(0, 25):
+            differentials = [generator.uniform(0, 36) for _ in range(rounds)]
+            expected = [handicap_index([c] + differentials) for c in candidates]
+            results = what_if(differentials, candidates)
+            for result, value in zip(results, expected):
+                if value is None:
+                    self.assertIsNone(result)
+                else:
+                    self.assertAlmostEqual(result, value, places=6)
+
+if __name__ == "__main__":
+    unittest.main()
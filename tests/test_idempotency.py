@@ -0,0 +1,133 @@
+import datetime, unittest
+from flask_app import create_app, db, idempotency
+from flask_app.models import Course, Hole, IdempotencyKey, Round, Tee, User
+
+
+class IdempotencyTestCase(unittest.TestCase):
+    """Class for testing POST requests sent with an Idempotency-Key"""
+
+    def setUp(self):
+        """Set up for tests"""
+        self.app = create_app({'TEST_DB_URI': 'postgresql://test:password@db:5432/testdb'})
+        self.client = self.app.test_client
+        self.db = db
+        self.db.create_all()
+        course = Course(name="Fake golf course", location="fake location")
+        tee = Tee(course=course, colour="white")
+        user = User(name="Jon Snow")
+        self.db.session.add_all([course, tee, Hole(course=course, number=1, par=4), user])
+        self.db.session.commit()
+        self.course_id, self.tee_id, self.user_id = course.id, tee.id, user.id
+        self.db.session.remove()
+
+    def tearDown(self):
+        """Test teardown"""
+        self.db.session.remove()
+        self.db.drop_all()
+
+    def post_course(self, key, name="New course"):
+        return self.client().post(
+            "/courses", json={'name': name, 'location': "Somewhere"},
+            headers={idempotency.HEADER: key}
+        )
+
+    def test_replayed(self):
+        """Test a retry gets the first response and creates nothing"""
+        first = self.post_course("abc")
+        self.assertEqual(first.status_code, 201)
+        self.assertNotIn(idempotency.REPLAYED_HEADER, first.headers)
+        retry = self.post_course("abc")
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.headers['Location'], first.headers['Location'])
+        self.assertEqual(retry.headers[idempotency.REPLAYED_HEADER], 'true')
+        self.assertEqual(self.post_course("def").status_code, 201)
+        with self.app.app_context():
+            self.assertEqual(Course.query.filter_by(name="New course").count(), 2)
+            self.assertEqual(IdempotencyKey.query.count(), 2)
+
+    def test_different_request(self):
+        """Test a key reused with another body is refused"""
+        self.assertEqual(self.post_course("abc").status_code, 201)
+        res = self.post_course("abc", name="Other course")
+        self.assertEqual(res.status_code, 422)
+        with self.app.app_context():
+            self.assertEqual(Course.query.filter_by(name="Other course").count(), 0)
+
+    def test_in_progress(self):
+        """Test a retry while the first request runs is a conflict, until
+        the claim goes stale"""
+        body = b'{"name": "New course", "location": "Somewhere"}'
+        with self.app.test_request_context("/courses", method="POST", data=body):
+            key = idempotency.digest("/courses", "abc")
+            fingerprint = idempotency.digest("POST", "/courses", body)
+            now = datetime.datetime.utcnow()
+            self.assertTrue(idempotency.claim(key, fingerprint, now))
+            self.assertFalse(idempotency.claim(key, fingerprint, now))
+        res = self.client().post("/courses", data=body, headers={idempotency.HEADER: "abc"})
+        self.assertEqual(res.status_code, 409)
+        with self.app.app_context():
+            IdempotencyKey.query.update({'created_at': now - datetime.timedelta(minutes=5)})
+            db.session.commit()
+        res = self.client().post("/courses", data=body, headers={idempotency.HEADER: "abc"})
+        self.assertEqual(res.status_code, 201)
+
+    def test_failure_not_stored(self):
+        """Test a refused request can be retried with the same key"""
+        res = self.client().post("/courses", json={'name': "No location"}, headers={idempotency.HEADER: "abc"})
+        self.assertEqual(res.status_code, 400)
+        with self.app.app_context():
+            self.assertEqual(IdempotencyKey.query.count(), 0)
+        res = self.client().post("/courses", json={'name': "No location"}, headers={idempotency.HEADER: "abc"})
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(self.client().post("/courses", json={}, headers={idempotency.HEADER: ""}).status_code, 400)
+
+    def test_round(self):
+        """Test a retried round is saved once, and keys are scoped to the path"""
+        payload = {'course_id': self.course_id, 'tee_id': self.tee_id, 'score_by_hole': [4]}
+        url = f"/users/{self.user_id}/rounds"
+        first = self.client().post(url, json=payload, headers={idempotency.HEADER: "abc"})
+        self.assertEqual(first.status_code, 201)
+        retry = self.client().post(url, json=payload, headers={idempotency.HEADER: "abc"})
+        self.assertEqual(retry.headers['Location'], first.headers['Location'])
+        self.assertEqual(self.post_course("abc").status_code, 201)
+        with self.app.app_context():
+            self.assertEqual(Round.query.filter_by(user_id=self.user_id).count(), 1)
+
+    def test_without_key(self):
+        """Test requests without the header, or with the feature off, run
+        every time"""
+        for _ in range(2):
+            self.assertEqual(self.client().post("/courses", json={'name': "New", 'location': "x"}).status_code, 201)
+        app = create_app({
+            'TEST_DB_URI': 'postgresql://test:password@db:5432/testdb',
+            'IDEMPOTENCY_ENABLED': False,
+        })
+        for _ in range(2):
+            res = app.test_client().post("/courses", json={'name': "New", 'location': "x"}, headers={idempotency.HEADER: "abc"})
+            self.assertEqual(res.status_code, 201)
+        with self.app.app_context():
+            self.assertEqual(Course.query.filter_by(name="New").count(), 4)
+            self.assertEqual(IdempotencyKey.query.count(), 0)
+
+    def test_expired(self):
+        """Test an expired key runs the request again and is purged"""
+        self.assertEqual(self.post_course("abc").status_code, 201)
+        self.assertEqual(self.post_course("def").status_code, 201)
+        with self.app.app_context():
+            IdempotencyKey.query.filter_by(key=idempotency.digest("/courses", "abc")).update(
+                {'expires_at': datetime.datetime.utcnow()}
+            )
+            db.session.commit()
+        res = self.post_course("abc")
+        self.assertNotIn(idempotency.REPLAYED_HEADER, res.headers)
+        with self.app.app_context():
+            IdempotencyKey.query.update({'expires_at': datetime.datetime.utcnow()})
+            db.session.commit()
+        result = self.app.test_cli_runner().invoke(args=['idempotency', 'purge'])
+        self.assertIn("Removed 2 expired", result.output)
+        with self.app.app_context():
+            self.assertEqual(IdempotencyKey.query.count(), 0)
+            self.assertEqual(Course.query.filter_by(name="New course").count(), 3)
+
+if __name__ == "__main__":
+    unittest.main()
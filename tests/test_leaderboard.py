@@ -0,0 +1,229 @@
+import json, unittest
+from flask_app import create_app, db
+from flask_app.leaderboard import RESET, Leaderboard
+from flask_app.models import Course, Hole, Tee, User
+
+PARS = [4, 4, 3, 5, 4, 4, 3, 5, 4]
+
+def sample_board(n=5):
+    board = Leaderboard(1, PARS)
+    for i in range(1, n + 1):
+        board.put(i, i, f"Player {i}", [4 + i % 3] * 9, handicap=i)
+    return board
+
+
+class LeaderboardTestCase(unittest.TestCase):
+    """Class for testing the in-memory leaderboard"""
+
+    def test_orders(self):
+        """Test entries are ranked in each order"""
+        board = Leaderboard(1, PARS)
+        board.put(1, 1, "Low gross", [4] * 9, handicap=0)
+        board.put(2, 2, "Low net", [5] * 9, handicap=18)
+        self.assertEqual([e['round_id'] for e in board.top('gross', 2)], [1, 2])
+        self.assertEqual([e['round_id'] for e in board.top('net', 2)], [2, 1])
+        self.assertEqual(board.top('to_par', 1)[0]['to_par'], 0)
+        self.assertEqual(board.top('net', 1)[0]['net'], -9)
+
+    def test_in_progress(self):
+        """Test holes not yet played count towards neither gross nor par"""
+        board = Leaderboard(1, PARS)
+        entry = board.put(1, 1, "Player", [3, 4, None], handicap=18)
+        self.assertEqual(entry['thru'], 2)
+        self.assertEqual(entry['gross'], 7)
+        self.assertEqual(entry['to_par'], -1)
+        self.assertEqual(entry['net'], -5)
+
+    def test_incremental_update(self):
+        """Test updating a round moves only its entry and keeps ranks exact"""
+        board = sample_board(50)
+        version = board.version
+        entry = board.put(7, 7, "Player 7", [2] * 9, handicap=7)
+        self.assertEqual(entry['ranks']['gross'], 1)
+        self.assertEqual(board.version, version + 1)
+        self.assertEqual(len(board), 50)
+        self.assertTrue(board.score(7, [9] * 9))
+        self.assertEqual(board.rank('gross', 7), 50)
+        self.assertFalse(board.score(99, [4] * 9))
+        ranked = board.top('gross', 50)
+        self.assertEqual([e['rank'] for e in ranked], list(range(1, 51)))
+        self.assertEqual(
+            [e['gross'] for e in ranked], sorted(e['gross'] for e in ranked)
+        )
+
+    def test_around(self):
+        """Test the window around a round"""
+        board = sample_board(20)
+        rank = board.rank('net', 10)
+        window = board.around('net', 10, 2)
+        self.assertEqual([e['rank'] for e in window], list(range(rank - 2, rank + 3)))
+        self.assertIn(10, [e['round_id'] for e in window])
+        self.assertEqual(board.around('net', board.top('net', 1)[0]['round_id'], 2)[0]['rank'], 1)
+        self.assertIsNone(board.around('net', 99, 2))
+
+    def test_remove(self):
+        board = sample_board(3)
+        board.remove(2)
+        self.assertNotIn(2, board)
+        self.assertEqual(len(board.top('gross', 10)), 2)
+
+    def test_subscribers(self):
+        """Test subscribers receive changes and slow subscribers are dropped"""
+        board = Leaderboard(1, PARS, queue_size=2)
+        subscriber = board.subscribe()
+        board.put(1, 1, "Player", [4], handicap=0)
+        version, event, data = subscriber.get_nowait()
+        self.assertEqual((version, event, data['round_id']), (1, 'score', 1))
+        for i in range(3):
+            board.put(1, 1, "Player", [4, 4 + i], handicap=0)
+        self.assertFalse(board.subscribed(subscriber))
+
+    def test_close(self):
+        """Test closing a board tells its subscribers to reset and lets them go"""
+        board = Leaderboard(1, PARS, queue_size=1)
+        waiting, behind = board.subscribe(), board.subscribe()
+        board.put(1, 1, "Player", [4], handicap=0)
+        waiting.get_nowait()
+        board.close()
+        for subscriber in (waiting, behind):
+            self.assertFalse(board.subscribed(subscriber))
+            self.assertEqual(subscriber.get_nowait(), (1, RESET, {'event_id': 1}))
+            self.assertTrue(subscriber.empty())
+
+
+class EventEndpointTestCase(unittest.TestCase):
+    """Class for testing the event and leaderboard endpoints"""
+
+    def setUp(self):
+        """Set up for tests"""
+        test_config = {
+            'TEST_DB_URI': 'postgresql://test:password@db:5432/testdb',
+            'LEADERBOARD_KEEPALIVE_SECONDS': 0.01
+        }
+        self.app = create_app(test_config)
+        self.client = self.app.test_client
+        self.db = db
+        self.db.create_all()
+        course = Course(name="Fake golf course", location="fake location")
+        self.db.session.add(course)
+        self.db.session.flush()
+        for number, par in enumerate(PARS, 1):
+            self.db.session.add(Hole(course_id=course.id, number=number, par=par))
+        tee = Tee(course_id=course.id, colour="white", course_rating=35.0, slope_rating=113)
+        self.db.session.add(tee)
+        self.db.session.commit()
+        self.course_id, self.tee_id = course.id, tee.id
+
+    def tearDown(self):
+        """Test teardown"""
+        self.db.session.remove()
+        self.db.drop_all()
+
+    def add_event(self):
+        res = self.client().post(
+            "/events", data=json.dumps({'name': "Club championship", 'course_id': self.course_id})
+        )
+        self.assertEqual(res.status_code, 201, res.data)
+        return int(res.headers['Location'].rsplit('/', 1)[1])
+
+    def add_player(self, event_id, name, scores):
+        user = User(name=name)
+        self.db.session.add(user)
+        self.db.session.commit()
+        user_id = user.id
+        payload = {
+            'course_id': self.course_id, 'tee_id': self.tee_id,
+            'event_id': event_id, 'score_by_hole': scores
+        }
+        res = self.client().post(f"/users/{user_id}/rounds", data=json.dumps(payload))
+        self.assertEqual(res.status_code, 201, res.data)
+        return user_id, int(res.headers['Location'].rsplit('/', 1)[1])
+
+    def test_create_event_fail(self):
+        res = self.client().post("/events", data=json.dumps({'name': "No course"}))
+        self.assertEqual(res.status_code, 400)
+        res = self.client().get("/events/1/leaderboard")
+        self.assertEqual(res.status_code, 404)
+
+    def test_leaderboard(self):
+        """Test the leaderboard follows hole by hole scoring"""
+        event_id = self.add_event()
+        self.add_player(event_id, "Early", [4, 4, 3, 5])
+        res = self.client().get(f"/events/{event_id}/leaderboard?order=to_par")
+        self.assertEqual(json.loads(res.data)['size'], 1)
+        user_id, round_id = self.add_player(event_id, "Late", [None] * 9)
+        res = self.client().patch(
+            f"/users/{user_id}/rounds/{round_id}/holes/1", data=json.dumps({'score': 2})
+        )
+        self.assertEqual(res.status_code, 200, res.data)
+        res = self.client().get(f"/events/{event_id}/leaderboard?order=to_par")
+        data = json.loads(res.data)
+        self.assertEqual(data['size'], 2)
+        self.assertEqual(data['entries'][0]['round_id'], round_id)
+        self.assertEqual(data['entries'][0]['to_par'], -2)
+        res = self.client().get(
+            f"/events/{event_id}/leaderboard?order=to_par&around={round_id}&radius=0"
+        )
+        self.assertEqual([e['round_id'] for e in json.loads(res.data)['entries']], [round_id])
+        res = self.client().get(f"/events/{event_id}/leaderboard?order=fastest")
+        self.assertEqual(res.status_code, 400)
+
+    def test_round_on_other_course(self):
+        event_id = self.add_event()
+        course = Course(name="Other course", location="elsewhere")
+        user = User(name="Lost")
+        self.db.session.add_all([course, user])
+        self.db.session.commit()
+        tee = Tee(course_id=course.id, colour="red")
+        self.db.session.add(tee)
+        self.db.session.commit()
+        payload = {
+            'course_id': course.id, 'tee_id': tee.id,
+            'event_id': event_id, 'score_by_hole': [4] * 9
+        }
+        res = self.client().post(f"/users/{user.id}/rounds", data=json.dumps(payload))
+        self.assertEqual(res.status_code, 400)
+
+    def test_stream(self):
+        """Test the stream opens with a snapshot then pushes each change"""
+        event_id = self.add_event()
+        user_id, round_id = self.add_player(event_id, "Streamer", [None] * 9)
+        res = self.client().get(f"/events/{event_id}/leaderboard/stream", buffered=False)
+        self.assertEqual(res.mimetype, 'text/event-stream')
+        chunks = iter(res.response)
+        snapshot = next(chunks)
+        snapshot = snapshot.decode() if isinstance(snapshot, bytes) else snapshot
+        self.assertIn("event: snapshot", snapshot)
+        self.client().patch(
+            f"/users/{user_id}/rounds/{round_id}/holes/1", data=json.dumps({'score': 3})
+        )
+        update = next(chunks)
+        update = update.decode() if isinstance(update, bytes) else update
+        self.assertIn("event: score", update)
+        data = json.loads(update.split("data: ", 1)[1])
+        self.assertEqual((data['round_id'], data['gross']), (round_id, 3))
+        res.close()
+
+    def test_stream_reset(self):
+        """Test a stream is told to reset when its board is dropped"""
+        event_id = self.add_event()
+        self.add_player(event_id, "Streamer", [None] * 9)
+        res = self.client().get(f"/events/{event_id}/leaderboard/stream", buffered=False)
+        chunks = iter(res.response)
+        next(chunks)
+        # a new hole changes the course's pars, which drops its boards
+        added = self.client().post(
+            f"/courses/{self.course_id}/holes", data=json.dumps([{'number': 10, 'par': 4}])
+        )
+        self.assertEqual(added.status_code, 201, added.data)
+        chunk = next(chunks)
+        while (chunk.decode() if isinstance(chunk, bytes) else chunk).startswith(": keepalive"):
+            chunk = next(chunks)
+        chunk = chunk.decode() if isinstance(chunk, bytes) else chunk
+        self.assertIn(f"event: {RESET}", chunk)
+        with self.assertRaises(StopIteration):
+            next(chunks)
+        res.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+from flask import g
+from sqlalchemy import event
+from sqlalchemy.exc import DBAPIError
+from flask_app import create_app, db
+from flask_app.models import Course
+from flask_app.metrics import QUERY_COUNT_HEADER, DB_TIME_HEADER, RequestStats
+
+def sample_course(db, name="Fake golf course", location="fake location"):
+    course = Course(name=name, location=location)
+    db.session.add(course)
+    db.session.commit()
+    return course.id
+
+class MetricsTestCase(unittest.TestCase):
+    """Class for testing request instrumentation and the /metrics endpoint"""
+
+    def setUp(self):
+        """Set up for tests"""
+        test_config = {'TEST_DB_URI': 'postgresql://test:password@db:5432/testdb'}
+        self.app = create_app(test_config)
+        self.client = self.app.test_client
+        self.db = db
+        self.db.create_all()
+
+    def tearDown(self):
+        """Test teardown"""
+        self.db.session.remove()
+        self.db.drop_all()
+
+    def test_query_headers(self):
+        """Test responses report the query count and database time"""
+        course_id = sample_course(self.db)
+        res = self.client().get(f"/courses/{course_id}")
+        self.assertEqual(res.status_code, 200)
+        self.assertGreaterEqual(int(res.headers[QUERY_COUNT_HEADER]), 1)
+        self.assertGreaterEqual(float(res.headers[DB_TIME_HEADER]), 0)
+
+    def test_metrics_endpoint(self):
+        """Test /metrics exposes per endpoint metrics in Prometheus format"""
+        sample_course(self.db)
+        self.client().get("/courses")
+        res = self.client().get("/metrics")
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.content_type.startswith('text/plain'))
+        body = res.data.decode()
+        self.assertIn('golf_api_request_latency_seconds_bucket', body)
+        self.assertIn('golf_api_request_db_queries_bucket{endpoint="courses.retrieve_courses"', body)
+        self.assertIn('golf_api_db_pool_checkout_wait_seconds', body)
+
+    def test_failed_statement(self):
+        """Test a statement that raises keeps its start time on its own
+        execution context and is not counted"""
+        failed = []
+        def keep_context(exception_context):
+            failed.append(exception_context.execution_context)
+        with self.app.test_request_context(), self.db.engine.connect() as connection:
+            event.listen(self.db.engine, 'handle_error', keep_context)
+            try:
+                g.db_stats = RequestStats()
+                with self.assertRaises(DBAPIError):
+                    connection.execute("SELECT 1 / 0")
+                self.assertEqual(connection.execute("SELECT 1").scalar(), 1)
+            finally:
+                event.remove(self.db.engine, 'handle_error', keep_context)
+            self.assertTrue(hasattr(failed[0], '_metrics_started'))
+            self.assertEqual(g.db_stats.queries, 1)
+            self.assertTrue(0 <= g.db_stats.db_time < 1)
+
+    def test_metrics_disabled(self):
+        """Test no headers are added when metrics are turned off"""
+        app = create_app({
+            'TEST_DB_URI': 'postgresql://test:password@db:5432/testdb',
+            'METRICS_ENABLED': False
+        })
+        res = app.test_client().get("/courses")
+        self.assertNotIn(QUERY_COUNT_HEADER, res.headers)
+
+if __name__ == "__main__":
+    unittest.main()
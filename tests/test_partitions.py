@@ -0,0 +1,91 @@
+import datetime, json, unittest
+from flask_app import create_app, db
+from flask_app.models import Course, Round, Tee, User
+from flask_app.partitions import add_months, create_partitions, existing_partitions
+
+def sample_round(db, user_id, course_id, tee_id, day):
+    new_round = Round(
+        user_id=user_id, course_id=course_id, tee_id=tee_id, date=day,
+        score_by_hole=[4] * 9
+    )
+    db.session.add(new_round)
+    db.session.commit()
+    return new_round.id
+
+
+class PartitionTestCase(unittest.TestCase):
+    """Class for testing the monthly partitions of rounds"""
+
+    def setUp(self):
+        """Set up for tests"""
+        test_config = {'TEST_DB_URI': 'postgresql://test:password@db:5432/testdb'}
+        self.app = create_app(test_config)
+        self.client = self.app.test_client
+        self.db = db
+        self.db.create_all()
+        course = Course(name="Fake golf course", location="fake location")
+        user = User(name="Jon Snow")
+        self.db.session.add_all([course, user])
+        self.db.session.commit()
+        tee = Tee(course_id=course.id, colour="red")
+        self.db.session.add(tee)
+        self.db.session.commit()
+        self.ids = (user.id, course.id, tee.id)
+
+    def tearDown(self):
+        """Test teardown"""
+        self.db.session.remove()
+        self.db.drop_all()
+
+    def partition_of(self, round_id):
+        return self.db.session.execute(
+            "SELECT tableoid::regclass::text FROM rounds WHERE id = :id", {'id': round_id}
+        ).scalar()
+
+    def test_add_months(self):
+        self.assertEqual(add_months(datetime.date(2024, 11, 1), 3), datetime.date(2025, 2, 1))
+
+    def test_create_partitions(self):
+        """Test partitions are created ahead and stranded rows are moved"""
+        today = datetime.date(2024, 5, 17)
+        stranded = sample_round(self.db, *self.ids, datetime.date(2024, 4, 2))
+        self.assertEqual(self.partition_of(stranded), 'rounds_default')
+        self.db.session.remove()
+        created = create_partitions(
+            self.db.engine, start=datetime.date(2024, 3, 9), months_ahead=2, today=today
+        )
+        self.assertEqual(created, [
+            'rounds_y2024m03', 'rounds_y2024m04', 'rounds_y2024m05',
+            'rounds_y2024m06', 'rounds_y2024m07'
+        ])
+        self.assertEqual(self.partition_of(stranded), 'rounds_y2024m04')
+        self.assertEqual(
+            create_partitions(self.db.engine, months_ahead=2, today=today), []
+        )
+        with self.db.engine.connect() as connection:
+            self.assertIn('rounds_default', existing_partitions(connection))
+
+    def test_date_range(self):
+        """Test the rounds endpoint filters by date and only reads those months"""
+        create_partitions(self.db.engine, start=datetime.date(2024, 1, 1), months_ahead=0,
+            today=datetime.date(2024, 6, 1))
+        for month in range(1, 7):
+            sample_round(self.db, *self.ids, datetime.date(2024, month, 10))
+        user_id = self.ids[0]
+        res = self.client().get(f"/users/{user_id}/rounds?from=2024-02-01&to=2024-03-31")
+        self.assertEqual(res.status_code, 200, res.data)
+        self.assertEqual(len(json.loads(res.data)), 2)
+        res = self.client().get(f"/users/{user_id}/rounds?from=2024-03-01&to=2024-02-01")
+        self.assertEqual(res.status_code, 400)
+        res = self.client().get(f"/users/{user_id}/rounds?from=March")
+        self.assertEqual(res.status_code, 400)
+        plan = self.db.session.execute(
+            "EXPLAIN SELECT * FROM rounds WHERE user_id = 1 "
+            "AND date >= '2024-02-01' AND date <= '2024-03-31'"
+        ).fetchall()
+        plan = '\n'.join(row[0] for row in plan)
+        self.assertIn('rounds_y2024m02', plan)
+        self.assertNotIn('rounds_y2024m05', plan)
+
+if __name__ == "__main__":
+    unittest.main()
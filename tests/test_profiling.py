@@ -0,0 +1,96 @@
+import os, shutil, tempfile, unittest
+from flask_app import create_app, db
+from flask_app.models import Course
+from flask_app.profiling import PROFILE_HEADER, TOKEN_HEADER
+
+TOKEN = 'secret-token'
+
+
+class ProfilingTestCase(unittest.TestCase):
+    """Class for testing on demand request profiling"""
+
+    def setUp(self):
+        """Set up for tests"""
+        self.path = tempfile.mkdtemp()
+        self.app = create_app({
+            'TEST_DB_URI': 'postgresql://test:password@db:5432/testdb',
+            'PROFILING_ENABLED': True,
+            'PROFILING_TOKEN': TOKEN,
+            'PROFILING_DIR': self.path,
+            'PROFILING_MAX_PROFILES': 2,
+        })
+        self.client = self.app.test_client
+        self.db = db
+        self.db.create_all()
+        course = Course(name="Fake golf course", location="fake location")
+        self.db.session.add(course)
+        self.db.session.commit()
+        self.course_id = course.id
+
+    def tearDown(self):
+        """Test teardown"""
+        shutil.rmtree(self.path)
+        self.db.session.remove()
+        self.db.drop_all()
+
+    def test_profile_with_token(self):
+        """Test a request with the token is profiled and can be downloaded"""
+        res = self.client().get(f"/courses/{self.course_id}", headers={TOKEN_HEADER: TOKEN})
+        self.assertEqual(res.status_code, 200)
+        name = res.headers[PROFILE_HEADER]
+        self.assertTrue(os.path.exists(os.path.join(self.path, name)))
+
+        res = self.client().get("/admin/profiles", headers={TOKEN_HEADER: TOKEN})
+        self.assertEqual(res.status_code, 200)
+        profile = res.get_json()['profiles'][0]
+        self.assertEqual(profile['name'], name)
+        self.assertEqual(profile['endpoint'], 'courses.course_detail')
+        self.assertEqual(profile['reason'], 'token')
+
+        res = self.client().get(f"/admin/profiles/{name}?format=text", headers={TOKEN_HEADER: TOKEN})
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('function calls', res.data.decode())
+        res = self.client().get(f"/admin/profiles/{name}", headers={TOKEN_HEADER: TOKEN})
+        self.assertEqual(res.status_code, 200)
+        self.assertGreater(len(res.data), 0)
+
+    def test_not_profiled(self):
+        """Test requests without or with a wrong token run unprofiled"""
+        res = self.client().get(f"/courses/{self.course_id}")
+        self.assertNotIn(PROFILE_HEADER, res.headers)
+        res = self.client().get(f"/courses/{self.course_id}", headers={TOKEN_HEADER: 'wrong'})
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn(PROFILE_HEADER, res.headers)
+        self.assertEqual(os.listdir(self.path), [])
+
+    def test_admin_requires_token(self):
+        """Test the profile endpoints reject requests without the token"""
+        self.assertEqual(self.client().get("/admin/profiles").status_code, 401)
+        res = self.client().get("/admin/profiles/../../etc/passwd", headers={TOKEN_HEADER: TOKEN})
+        self.assertEqual(res.status_code, 404)
+
+    def test_ring_is_bounded(self):
+        """Test only the newest PROFILING_MAX_PROFILES profiles are kept"""
+        names = [
+            self.client().get("/courses", headers={TOKEN_HEADER: TOKEN}).headers[PROFILE_HEADER]
+            for _ in range(3)
+        ]
+        res = self.client().get("/admin/profiles", headers={TOKEN_HEADER: TOKEN})
+        self.assertEqual([profile['name'] for profile in res.get_json()['profiles']], names[:0:-1])
+        self.assertEqual(len(os.listdir(self.path)), 4)
+
+    def test_sampling(self):
+        """Test a sample rate of one profiles every request"""
+        self.app.config['PROFILING_SAMPLE_RATE'] = 1.0
+        res = self.client().get("/courses")
+        self.assertIn(PROFILE_HEADER, res.headers)
+
+    def test_disabled(self):
+        """Test nothing is profiled or exposed when profiling is off"""
+        app = create_app({'TEST_DB_URI': 'postgresql://test:password@db:5432/testdb'})
+        res = app.test_client().get("/courses", headers={TOKEN_HEADER: TOKEN})
+        self.assertNotIn(PROFILE_HEADER, res.headers)
+        self.assertEqual(app.test_client().get("/admin/profiles").status_code, 404)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,456 @@
+import json, unittest
+from flask_app import create_app, db, leaderboard, similarity, sketches, stats
+from flask_app.models import Course, Event, Tee, Hole, Yardage, User, Round
+from flask_app.testing import QueryCapture, assert_max_queries
+
+SIZES = (1, 5, 18)
+
+def sample_course(db, name="Fake golf course", location="fake location"):
+    course = Course(name=name, location=location)
+    db.session.add(course)
+    db.session.commit()
+    return course.id
+
+def sample_tees(db, course_id, n):
+    tees = [
+        Tee(course_id=course_id, colour=f"colour {i}", course_rating=70.1, slope_rating=125)
+        for i in range(n)
+    ]
+    db.session.add_all(tees)
+    db.session.commit()
+    return [tee.id for tee in tees]
+
+def sample_holes(db, course_id, n, tee_ids=()):
+    holes = [Hole(course_id=course_id, number=i % 18 + 1, par=4) for i in range(n)]
+    db.session.add_all(holes)
+    db.session.flush()
+    for hole in holes:
+        for tee_id in tee_ids:
+            db.session.add(Yardage(hole_id=hole.id, tee_id=tee_id, yardage=350))
+    db.session.commit()
+    return [hole.id for hole in holes]
+
+def sample_user(db, name="Jon Snow"):
+    user = User(name=name)
+    db.session.add(user)
+    db.session.commit()
+    return user.id
+
+def sample_rounds(db, user_id, n):
+    """Add n rounds for the user, each on a different course and tee"""
+    round_ids = []
+    for i in range(n):
+        course_id = sample_course(db, name=f"Course {i}")
+        tee_id = sample_tees(db, course_id, 1)[0]
+        new_round = Round(
+            user_id=user_id, course_id=course_id, tee_id=tee_id,
+            score_by_hole=[4, 4, 4, 4, 4, 4, 4, 4, 4]
+        )
+        db.session.add(new_round)
+        db.session.commit()
+        round_ids.append(new_round.id)
+    return round_ids
+
+def sample_field(db, course_id, tee_id, n, event_id=None):
+    """Add n players with a round each on the same course and tee"""
+    round_ids = []
+    for i in range(n):
+        user_id = sample_user(db, name=f"Player {i}")
+        new_round = Round(
+            user_id=user_id, course_id=course_id, tee_id=tee_id, event_id=event_id,
+            score_by_hole=[4, 4, 4, 4, 4, 4, 4, 4, 3 + i % 4]
+        )
+        db.session.add(new_round)
+        db.session.commit()
+        round_ids.append(new_round.id)
+    return round_ids
+
+def sample_event(db, course_id):
+    event = Event(name="Fake event", course_id=course_id)
+    db.session.add(event)
+    db.session.commit()
+    return event.id
+
+
+class QueryCountTestCase(unittest.TestCase):
+    """Pin the number of SQL statements each endpoint issues, so that a new
+    lazy load inside a loop fails the build instead of slipping in silently."""
+
+    def setUp(self):
+        """Set up for tests"""
+        test_config = {
+            'TEST_DB_URI': 'postgresql://test:password@db:5432/testdb',
+            'ADMIN_TOKEN': 'secret',
+        }
+        self.app = create_app(test_config)
+        self.client = self.app.test_client
+        self.db = db
+        self.db.create_all()
+
+    def tearDown(self):
+        """Test teardown"""
+        self.db.session.remove()
+        self.db.drop_all()
+
+    def reset(self):
+        """Start every dataset size from an empty database and session"""
+        self.db.session.remove()
+        self.db.drop_all()
+        self.db.create_all()
+
+    def request(self, method, url, payload=None, headers=None):
+        """Send a request, with the session cleared so nothing is served
+        from the identity map of the data setup"""
+        self.db.session.remove()
+        data = json.dumps(payload) if payload is not None else None
+        return getattr(self.client(), method)(url, data=data, headers=headers)
+
+    def assertQueries(self, limit, method, url, payload=None, status=None, headers=None):
+        with assert_max_queries(limit) as capture:
+            res = self.request(method, url, payload, headers)
+        if status is not None:
+            self.assertEqual(res.status_code, status, res.data)
+        return capture.count
+
+    def test_capture_records_statements(self):
+        """Test the capture helper sees every statement and reports overruns"""
+        sample_course(self.db)
+        with QueryCapture() as capture:
+            Course.query.all()
+            Tee.query.all()
+        self.assertEqual(capture.count, 2)
+        with self.assertRaises(AssertionError):
+            with assert_max_queries(1):
+                Course.query.all()
+                Tee.query.all()
+
+    def test_retrieve_courses(self):
+        for n in SIZES:
+            self.reset()
+            for i in range(n):
+                sample_course(self.db, name=f"Course {i}")
+            self.assertQueries(1, 'get', "/courses", status=200)
+
+    def test_course_detail(self):
+        for n in SIZES:
+            self.reset()
+            course_id = sample_course(self.db)
+            sample_holes(self.db, course_id, n, sample_tees(self.db, course_id, n))
+            self.assertQueries(1, 'get', f"/courses/{course_id}", status=200)
+
+
+    def test_retrieve_courses_batch(self):
+        for n in SIZES:
+            self.reset()
+            ids = [sample_course(self.db, name=f"Course {i}") for i in range(n)]
+            ids = ','.join(str(id) for id in ids)
+            self.assertQueries(1, 'get', f"/courses?ids={ids}", status=200)
+
+    def test_retrieve_tees_batch(self):
+        for n in SIZES:
+            self.reset()
+            ids = ','.join(str(id) for id in sample_tees(self.db, sample_course(self.db), n))
+            self.assertQueries(1, 'get', f"/tees?ids={ids}", status=200)
+
+    def test_retrieve_holes(self):
+        for n in SIZES:
+            self.reset()
+            course_id = sample_course(self.db)
+            sample_holes(self.db, course_id, n, sample_tees(self.db, course_id, 2))
+            self.assertQueries(2, 'get', f"/courses/{course_id}/holes", status=200)
+
+    def test_retrieve_holes_include_yardages(self):
+        for n in SIZES:
+            self.reset()
+            course_id = sample_course(self.db)
+            sample_holes(self.db, course_id, n, sample_tees(self.db, course_id, 3))
+            self.assertQueries(
+                3, 'get', f"/courses/{course_id}/holes?include=yardages", status=200
+            )
+
+    def test_hole_detail(self):
+        for n in SIZES:
+            self.reset()
+            course_id = sample_course(self.db)
+            tee_ids = sample_tees(self.db, course_id, n)
+            hole_id = sample_holes(self.db, course_id, 1, tee_ids)[0]
+            self.assertQueries(3, 'get', f"/courses/{course_id}/holes/{hole_id}", status=200)
+
+    def test_retrieve_tees(self):
+        for n in SIZES:
+            self.reset()
+            course_id = sample_course(self.db)
+            sample_tees(self.db, course_id, n)
+            self.assertQueries(2, 'get', f"/courses/{course_id}/tees", status=200)
+
+    def test_tee_detail(self):
+        for n in SIZES:
+            self.reset()
+            course_id = sample_course(self.db)
+            tee_id = sample_tees(self.db, course_id, n)[0]
+            self.assertQueries(2, 'get', f"/courses/{course_id}/tees/{tee_id}", status=200)
+
+    def test_retrieve_rounds(self):
+        for n in SIZES:
+            self.reset()
+            user_id = sample_user(self.db)
+            sample_rounds(self.db, user_id, n)
+            self.assertQueries(2, 'get', f"/users/{user_id}/rounds", status=200)
+
+    def test_retrieve_rounds_include(self):
+        for n in SIZES:
+            self.reset()
+            user_id = sample_user(self.db)
+            sample_rounds(self.db, user_id, n)
+            self.assertQueries(
+                3, 'get', f"/users/{user_id}/rounds?include=course,tee", status=200
+            )
+
+    def test_round_detail(self):
+        for n in SIZES:
+            self.reset()
+            user_id = sample_user(self.db)
+            round_id = sample_rounds(self.db, user_id, n)[0]
+            self.assertQueries(2, 'get', f"/users/{user_id}/rounds/{round_id}", status=200)
+
+    def test_post_course(self):
+        payload = {'name': 'fake course', 'location': 'fake location'}
+        for n in SIZES:
+            self.reset()
+            for i in range(n):
+                sample_course(self.db, name=f"Course {i}")
+            # the course insert, plus its change log entry
+            self.assertQueries(2, 'post', "/courses", payload, status=201)
+
+    def test_post_holes(self):
+        """Adding holes costs one insert per hole, plus a fixed overhead
+        including one change log insert for all of them"""
+        for n in SIZES:
+            self.reset()
+            course_id = sample_course(self.db)
+            sample_tees(self.db, course_id, 3)
+            payload = [
+                {'number': i % 18 + 1, 'par': 4, 'tees': [
+                    {'colour': f"colour {t}", 'yardage': 300} for t in range(3)
+                ]}
+                for i in range(n)
+            ]
+            self.assertQueries(
+                n + 4, 'post', f"/courses/{course_id}/holes", payload, status=201
+            )
+
+    def test_update_hole_yardages(self):
+        for n in SIZES:
+            self.reset()
+            course_id = sample_course(self.db)
+            tee_ids = sample_tees(self.db, course_id, n)
+            hole_id = sample_holes(self.db, course_id, 1, tee_ids[:1])[0]
+            payload = {'tees': [
+                {'colour': f"colour {t}", 'yardage': 400} for t in range(n)
+            ]}
+            self.assertQueries(
+                7, 'patch', f"/courses/{course_id}/holes/{hole_id}", payload, status=201
+            )
+
+    def test_post_tee(self):
+        for n in SIZES:
+            self.reset()
+            course_id = sample_course(self.db)
+            sample_holes(self.db, course_id, 1, sample_tees(self.db, course_id, n))
+            self.assertQueries(
+                3, 'post', f"/courses/{course_id}/tees", {'colour': 'blue'}, status=201
+            )
+
+    def test_update_tee(self):
+        for n in SIZES:
+            self.reset()
+            course_id = sample_course(self.db)
+            tee_id = sample_tees(self.db, course_id, n)[0]
+            sample_holes(self.db, course_id, n, [tee_id])
+            self.assertQueries(
+                4, 'patch', f"/courses/{course_id}/tees/{tee_id}",
+                {'course_rating': 71.2}, status=201
+            )
+
+    def test_post_round(self):
+        for n in SIZES:
+            self.reset()
+            user_id = sample_user(self.db)
+            sample_rounds(self.db, user_id, n)
+            course_id = sample_course(self.db)
+            tee_id = sample_tees(self.db, course_id, 1)[0]
+            payload = {
+                'course_id': course_id,
+                'tee_id': tee_id,
+                'score_by_hole': [4, 4, 4, 4, 4, 4, 4, 4, 4]
+            }
+            # the round insert, plus the upsert of its tee's score distribution
+            # and the round's change log entry
+            self.assertQueries(6, 'post', f"/users/{user_id}/rounds", payload, status=201)
+
+    def test_update_round(self):
+        payload = {'score_by_hole': [5, 5, 5, 5, 5, 5, 5, 5, 5]}
+        for n in SIZES:
+            self.reset()
+            user_id = sample_user(self.db)
+            round_id = sample_rounds(self.db, user_id, n)[0]
+            self.assertQueries(
+                5, 'patch', f"/users/{user_id}/rounds/{round_id}", payload, status=201
+            )
+
+    def test_update_round_hole(self):
+        """Scoring a hole is a single UPDATE ... RETURNING, plus moving the
+        completed round in its tee's score distribution and logging the change"""
+        for n in SIZES:
+            self.reset()
+            user_id = sample_user(self.db)
+            round_id = sample_rounds(self.db, user_id, n)[0]
+            self.assertQueries(
+                3, 'patch', f"/users/{user_id}/rounds/{round_id}/holes/4",
+                {'score': 5, 'version': 1}, status=200
+            )
+
+    def test_update_round_holes(self):
+        """A batch of holes costs the same single UPDATE as one hole"""
+        for n in SIZES:
+            self.reset()
+            user_id = sample_user(self.db)
+            round_id = sample_rounds(self.db, user_id, n)[0]
+            holes = {str(number): {'score': 5} for number in range(1, min(n, 9) + 1)}
+            self.assertQueries(
+                3, 'patch', f"/users/{user_id}/rounds/{round_id}/holes",
+                {'holes': holes, 'version': 1}, status=200
+            )
+
+    def test_handicap_what_if(self):
+        for n in SIZES:
+            self.reset()
+            user_id = sample_user(self.db)
+            sample_rounds(self.db, user_id, n)
+            tee_id = Round.query.first().tee_id
+            payload = {'tee_id': tee_id, 'scores': list(range(60, 120))}
+            self.assertQueries(
+                3, 'post', f"/users/{user_id}/handicap/what-if", payload, status=200
+            )
+
+    def test_competition_handicaps(self):
+        for n in SIZES:
+            self.reset()
+            entries = []
+            for i in range(n):
+                user_id = sample_user(self.db, name=f"Player {i}")
+                sample_rounds(self.db, user_id, 1)
+                entries.append({'user_id': user_id, 'tee_id': Round.query.first().tee_id})
+            self.assertQueries(
+                3, 'post', "/competitions/handicaps", {'entries': entries}, status=200
+            )
+
+    def test_competition_scores(self):
+        for n in SIZES:
+            self.reset()
+            course_id = sample_course(self.db)
+            sample_holes(self.db, course_id, 9)
+            tee_id = sample_tees(self.db, course_id, 1)[0]
+            round_ids = sample_field(self.db, course_id, tee_id, n)
+            self.assertQueries(
+                4, 'post', "/competitions/scores", {'round_ids': round_ids}, status=200
+            )
+
+    def test_score_distribution(self):
+        for n in SIZES:
+            self.reset()
+            course_id = sample_course(self.db)
+            tee_id = sample_tees(self.db, course_id, 1)[0]
+            sample_field(self.db, course_id, tee_id, n)
+            with self.app.app_context():
+                sketches.rebuild()
+            self.assertQueries(
+                1, 'get', f"/courses/{course_id}/scores/distribution?holes=9", status=200
+            )
+            self.assertQueries(
+                1, 'get', f"/courses/{course_id}/scores/percentile?holes=9&score=37",
+                status=200
+            )
+
+    def test_similar_courses(self):
+        """Building the course index reads every course's features at once,
+        later searches only load the courses found"""
+        for n in SIZES:
+            self.reset()
+            for i in range(n):
+                course_id = sample_course(self.db, name=f"Course {i}")
+                sample_holes(self.db, course_id, 9, sample_tees(self.db, course_id, 2))
+            self.app.extensions['similarity'] = similarity.CourseIndex(60)
+            self.assertQueries(3, 'get', f"/courses/{course_id}/similar", status=200)
+            self.assertQueries(1, 'get', f"/courses/{course_id}/similar", status=200)
+
+    def test_sync(self):
+        for n in SIZES:
+            self.reset()
+            user_id = sample_user(self.db)
+            sample_rounds(self.db, user_id, n)
+            self.assertQueries(7, 'get', f"/sync?user_id={user_id}", status=200)
+
+    def test_admin_stats(self):
+        for n in SIZES:
+            self.reset()
+            user_id = sample_user(self.db)
+            sample_rounds(self.db, user_id, n)
+            with self.app.app_context():
+                stats.refresh(self.db.engine)
+            for url in ("rounds", "active-users", "courses", "scores"):
+                self.assertQueries(
+                    2, 'get', f"/admin/stats/{url}", status=200,
+                    headers={stats.TOKEN_HEADER: 'secret'}
+                )
+
+    def test_post_event(self):
+        for n in SIZES:
+            self.reset()
+            course_id = sample_course(self.db)
+            for _ in range(n):
+                sample_event(self.db, course_id)
+            payload = {'name': 'fake event', 'course_id': course_id}
+            self.assertQueries(2, 'post', "/events", payload, status=201)
+
+    def test_event_detail(self):
+        for n in SIZES:
+            self.reset()
+            course_id = sample_course(self.db)
+            event_id = sample_event(self.db, course_id)
+            sample_field(self.db, course_id, sample_tees(self.db, course_id, 1)[0], n, event_id)
+            self.assertQueries(1, 'get', f"/events/{event_id}", status=200)
+
+    def test_event_leaderboard(self):
+        """Loading a board reads the event's rounds with their players and
+        tees at once, later requests are answered from memory"""
+        for n in SIZES:
+            self.reset()
+            course_id = sample_course(self.db)
+            sample_holes(self.db, course_id, 9)
+            event_id = sample_event(self.db, course_id)
+            sample_field(self.db, course_id, sample_tees(self.db, course_id, 1)[0], n, event_id)
+            with self.app.app_context():
+                leaderboard.registry().discard(event_id)
+            self.assertQueries(4, 'get', f"/events/{event_id}/leaderboard", status=200)
+            self.assertQueries(1, 'get', f"/events/{event_id}/leaderboard", status=200)
+
+    def test_event_leaderboard_stream(self):
+        for n in SIZES:
+            self.reset()
+            course_id = sample_course(self.db)
+            sample_holes(self.db, course_id, 9)
+            event_id = sample_event(self.db, course_id)
+            sample_field(self.db, course_id, sample_tees(self.db, course_id, 1)[0], n, event_id)
+            with self.app.app_context():
+                leaderboard.registry().discard(event_id)
+            self.db.session.remove()
+            with assert_max_queries(4):
+                res = self.client().get(
+                    f"/events/{event_id}/leaderboard/stream", buffered=False
+                )
+                next(iter(res.response))
+            res.close()
+
+if __name__ == "__main__":
+    unittest.main()
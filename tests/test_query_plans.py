@@ -0,0 +1,151 @@
+import json, unittest
+from flask_app import create_app, db
+from flask_app.models import Course, Tee, Hole, Yardage, User, Round
+from flask_app.testing import QueryCapture
+
+LARGE_TABLES = ('tees', 'holes', 'yardages', 'rounds')
+COURSES, TEES, USERS, ROUNDS_PER_USER = 40, 3, 40, 25
+
+def seed(db):
+    """Bulk load enough rows that every table has a realistic shape"""
+    db.session.bulk_insert_mappings(Course, [
+        {'id': c, 'name': f"Course {c}", 'location': 'somewhere'}
+        for c in range(1, COURSES + 1)
+    ])
+    db.session.bulk_insert_mappings(Tee, [
+        {'id': (c - 1) * TEES + t, 'course_id': c, 'colour': f"colour {t}",
+            'course_rating': 70.0 + t, 'slope_rating': 120 + t}
+        for c in range(1, COURSES + 1) for t in range(1, TEES + 1)
+    ])
+    db.session.bulk_insert_mappings(Hole, [
+        {'id': (c - 1) * 18 + n, 'course_id': c, 'number': n, 'par': 4}
+        for c in range(1, COURSES + 1) for n in range(1, 19)
+    ])
+    db.session.bulk_insert_mappings(Yardage, [
+        {'hole_id': (c - 1) * 18 + n, 'tee_id': (c - 1) * TEES + t, 'yardage': 300 + t}
+        for c in range(1, COURSES + 1) for n in range(1, 19) for t in range(1, TEES + 1)
+    ])
+    db.session.bulk_insert_mappings(User, [
+        {'id': u, 'name': f"Player {u}"} for u in range(1, USERS + 1)
+    ])
+    db.session.bulk_insert_mappings(Round, [
+        {'user_id': u, 'course_id': (u + r) % COURSES + 1,
+            'tee_id': ((u + r) % COURSES) * TEES + 1, 'score_by_hole': [4] * 18}
+        for u in range(1, USERS + 1) for r in range(ROUNDS_PER_USER)
+    ])
+    db.session.commit()
+    for table in ('courses', 'tees', 'holes', 'users', 'rounds'):
+        db.session.execute(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), MAX(id)) FROM {table}"
+        )
+    db.session.commit()
+    connection = db.engine.raw_connection()
+    connection.set_isolation_level(0)
+    connection.cursor().execute("ANALYZE")
+    connection.close()
+
+def parent_table(relation):
+    """Name the table a partition such as rounds_y2024m05 belongs to"""
+    if relation and relation.startswith('rounds_'):
+        return 'rounds'
+    return relation
+
+def plan_nodes(plan):
+    yield plan
+    for child in plan.get('Plans', ()):
+        yield from plan_nodes(child)
+
+
+class QueryPlanTestCase(unittest.TestCase):
+    """Run EXPLAIN over every SELECT each endpoint issues and fail when one
+    can only be answered by a sequential scan of a large table. Sequential
+    scans are disabled while planning, so the planner only falls back to one
+    when no index serves the access path."""
+
+    def setUp(self):
+        """Set up for tests"""
+        test_config = {'TEST_DB_URI': 'postgresql://test:password@db:5432/testdb'}
+        self.app = create_app(test_config)
+        self.client = self.app.test_client
+        self.db = db
+        self.db.create_all()
+        seed(self.db)
+
+    def tearDown(self):
+        """Test teardown"""
+        self.db.session.remove()
+        self.db.drop_all()
+
+    def explain(self, statement, parameters):
+        connection = self.db.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            cursor.execute("SET enable_seqscan = off")
+            cursor.execute("EXPLAIN (FORMAT JSON) " + statement, parameters)
+            plan = cursor.fetchone()[0]
+            connection.rollback()
+        finally:
+            connection.close()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0]['Plan']
+
+    def assertIndexed(self, method, url, payload=None):
+        self.db.session.remove()
+        data = json.dumps(payload) if payload is not None else None
+        with QueryCapture() as capture:
+            res = getattr(self.client(), method)(url, data=data)
+        self.assertLess(res.status_code, 400, res.data)
+        selects = [
+            (statement, parameters) for statement, parameters in capture.statements
+            if statement.lstrip().upper().startswith('SELECT')
+        ]
+        self.assertTrue(selects)
+        for statement, parameters in selects:
+            for node in plan_nodes(self.explain(statement, parameters)):
+                if node['Node Type'] == 'Seq Scan':
+                    self.assertNotIn(
+                        parent_table(node.get('Relation Name')), LARGE_TABLES,
+                        f"{method.upper()} {url} scans {node.get('Relation Name')}:\n{statement}"
+                    )
+
+    def test_course_endpoints(self):
+        self.assertIndexed('get', "/courses?page=2")
+        self.assertIndexed('get', "/courses/7")
+        self.assertIndexed('get', "/courses/7/holes")
+        self.assertIndexed('get', "/courses/7/holes/110")
+        self.assertIndexed('get', "/courses/7/tees")
+        self.assertIndexed('get', "/courses/7/tees/19")
+
+    def test_course_write_endpoints(self):
+        self.assertIndexed('post', "/courses/7/holes", [
+            {'number': 1, 'par': 4, 'tees': [{'colour': 'colour 1', 'yardage': 300}]}
+        ])
+        self.assertIndexed('patch', "/courses/7/holes/110", {
+            'tees': [{'colour': 'colour 2', 'yardage': 320}]
+        })
+        self.assertIndexed('post', "/courses/7/tees", {'colour': 'gold'})
+        self.assertIndexed('patch', "/courses/7/tees/19", {'slope_rating': 131})
+
+    def test_user_endpoints(self):
+        self.assertIndexed('get', "/users/3/rounds")
+        self.assertIndexed('get', "/users/3/rounds?page=2")
+        round_id = Round.query.filter_by(user_id=3).first().id
+        self.assertIndexed('get', f"/users/3/rounds/{round_id}")
+        self.assertIndexed('post', "/users/3/rounds", {
+            'course_id': 7, 'tee_id': 19, 'score_by_hole': [4] * 18
+        })
+        self.assertIndexed('patch', f"/users/3/rounds/{round_id}", {
+            'score_by_hole': [5] * 18
+        })
+        self.assertIndexed('post', "/users/3/handicap/what-if", {
+            'tee_id': 19, 'scores': [72, 80, 88]
+        })
+
+    def test_competition_endpoints(self):
+        self.assertIndexed('post', "/competitions/handicaps", {'entries': [
+            {'user_id': user_id, 'tee_id': 19} for user_id in range(1, 11)
+        ]})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,212 @@
+import os, tempfile, threading, unittest
+import numpy as np
+from flask_app import create_app, db
+from flask_app.models import Course
+from flask_app.repository import MemoryRepository, RepositoryError, dump
+from flask_app.similarity import course_feature_values, feature_rows
+
+
+class CourseEndpoints:
+    """Course endpoint tests going only through the API, run against each
+    storage backend"""
+
+    def post_course(self, name="Fake golf course"):
+        res = self.client().post("/courses", json={'name': name, 'location': "fake location"})
+        self.assertEqual(res.status_code, 201)
+        return int(res.headers['Location'].rsplit('/', 1)[1])
+
+    def post_tee(self, course_id, colour):
+        res = self.client().post(f"/courses/{course_id}/tees", json={'colour': colour, 'slope_rating': 113})
+        self.assertEqual(res.status_code, 201)
+        return int(res.headers['Location'].rsplit('/', 1)[1])
+
+    def seed(self):
+        course_id = self.post_course()
+        tee_ids = [self.post_tee(course_id, colour) for colour in ('white', 'blue')]
+        res = self.client().post(f"/courses/{course_id}/holes", json=[
+            {'number': number, 'par': 4, 'tees': [
+                {'colour': 'white', 'yardage': 350}, {'colour': 'blue', 'yardage': 380}
+            ]}
+            for number in (1, 2)
+        ])
+        self.assertEqual(res.status_code, 201)
+        return course_id, tee_ids
+
+    def test_courses(self):
+        """Test courses are created, listed and fetched by id"""
+        first, second = self.post_course("First"), self.post_course("Second")
+        self.assertEqual([course['name'] for course in self.client().get("/courses").get_json()], ["First", "Second"])
+        self.assertEqual(self.client().get(f"/courses/{second}").get_json()['name'], "Second")
+        body = self.client().get(f"/courses?ids={second},999,{first}").get_json()
+        self.assertEqual([course['id'] for course in body['data']], [second, first])
+        self.assertEqual(body['missing'], [999])
+        self.assertEqual(self.client().post("/courses", json={'name': "No location"}).status_code, 400)
+        self.assertEqual(len(self.client().get("/courses").get_json()), 2)
+
+    def test_holes_and_yardages(self):
+        """Test holes are added with their yardages and updated"""
+        course_id, tee_ids = self.seed()
+        holes = self.client().get(f"/courses/{course_id}/holes?include=yardages").get_json()
+        self.assertEqual([hole['number'] for hole in holes], [1, 2])
+        self.assertEqual(sorted(tee['yardage'] for tee in holes[0]['tees']), [350, 380])
+        res = self.client().patch(f"/courses/{course_id}/holes/1", json={
+            'par': 5, 'tees': [{'colour': 'white', 'yardage': 510}]
+        })
+        self.assertEqual(res.status_code, 201)
+        hole = self.client().get(f"/courses/{course_id}/holes/1").get_json()
+        self.assertEqual(hole['par'], 5)
+        self.assertEqual(
+            sorted((tee['colour'], tee['yardage']) for tee in hole['tees']),
+            [('blue', 380), ('white', 510)]
+        )
+        res = self.client().patch(f"/courses/{course_id}/holes/1", json={
+            'tees': [{'colour': 'green', 'yardage': 510}]
+        })
+        self.assertEqual(res.status_code, 400)
+
+    def test_tees(self):
+        """Test tees are added, updated and refused twice in one colour"""
+        course_id, tee_ids = self.seed()
+        self.assertEqual(len(self.client().get(f"/courses/{course_id}/tees").get_json()), 2)
+        res = self.client().post(f"/courses/{course_id}/tees", json={'colour': 'white'})
+        self.assertEqual(res.status_code, 400)
+        res = self.client().patch(f"/courses/{course_id}/tees/{tee_ids[1]}", json={'course_rating': 71.5})
+        self.assertEqual(res.status_code, 201)
+        tee = self.client().get(f"/courses/{course_id}/tees/{tee_ids[1]}").get_json()
+        self.assertEqual((tee['colour'], tee['course_rating'], tee['slope_rating']), ('blue', 71.5, 113))
+        body = self.client().get(f"/tees?ids={tee_ids[1]},{tee_ids[0]}").get_json()
+        self.assertEqual([tee['colour'] for tee in body['data']], ['blue', 'white'])
+
+    def test_similar(self):
+        """Test the similar course search reads the backend's courses"""
+        first, _ = self.seed()
+        twin, _ = self.seed()
+        short = self.post_course("Par threes")
+        res = self.client().post(f"/courses/{short}/holes", json=[
+            {'number': number, 'par': 3} for number in (1, 2, 3)
+        ])
+        self.assertEqual(res.status_code, 201)
+        body = self.client().get(f"/courses/{first}/similar?k=2").get_json()
+        self.assertEqual([course['id'] for course in body['similar']], [twin, short])
+        self.assertEqual(body['similar'][0]['distance'], 0.0)
+        self.assertEqual(self.client().get("/courses/999/similar").status_code, 404)
+
+    def test_missing(self):
+        """Test unknown courses, holes and tees are 404s"""
+        course_id, tee_ids = self.seed()
+        self.assertEqual(self.client().get("/courses/999").status_code, 404)
+        self.assertEqual(self.client().get("/courses/999/holes").status_code, 404)
+        self.assertEqual(self.client().get(f"/courses/{course_id}/holes/999").status_code, 404)
+        self.assertEqual(self.client().get(f"/courses/{course_id}/tees/999").status_code, 404)
+
+
+class SqlRepositoryTestCase(CourseEndpoints, unittest.TestCase):
+    """Class for testing the course endpoints against the database"""
+
+    def setUp(self):
+        """Set up for tests"""
+        self.app = create_app({'TEST_DB_URI': 'postgresql://test:password@db:5432/testdb'})
+        self.client = self.app.test_client
+        self.db = db
+        self.db.create_all()
+
+    def tearDown(self):
+        """Test teardown"""
+        self.db.session.remove()
+        self.db.drop_all()
+
+    def test_dump_and_load(self):
+        """Test a dump of the database loads into a read only repository"""
+        course_id, tee_ids = self.seed()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'courses.json')
+            with self.app.app_context():
+                counts = dump(path)
+            self.assertEqual(counts, {'courses': 1, 'tees': 2, 'holes': 2, 'yardages': 4})
+            app = create_app({
+                'TEST_DB_URI': 'postgresql://test:password@db:5432/testdb',
+                'STORAGE_BACKEND': 'memory',
+                'STORAGE_SNAPSHOT': path,
+            })
+        client = app.test_client
+        for url in (f"/courses/{course_id}", f"/courses/{course_id}/holes?include=yardages",
+                    f"/courses/{course_id}/tees/{tee_ids[0]}"):
+            self.assertEqual(client().get(url).get_json(), self.client().get(url).get_json())
+        res = client().post("/courses", json={'name': "New", 'location': "Somewhere"})
+        self.assertEqual(res.status_code, 400)
+
+
+    def test_feature_values(self):
+        """Test the similarity features of loaded courses match the SQL ones"""
+        self.seed()
+        self.post_course("Empty")
+        with self.app.app_context():
+            rows = dict(feature_rows())
+            for course in Course.query:
+                np.testing.assert_allclose(course_feature_values(course), rows[course.id])
+
+
+class MemoryRepositoryTestCase(CourseEndpoints, unittest.TestCase):
+    """Class for testing the course endpoints against the memory backend,
+    without a database"""
+
+    def setUp(self):
+        """Set up for tests"""
+        self.app = create_app({
+            'TEST_DB_URI': 'postgresql://nobody@localhost:1/none',
+            'STORAGE_BACKEND': 'memory',
+        })
+        self.client = self.app.test_client
+
+    def test_refused_write_changes_nothing(self):
+        """Test a write with an invalid value is refused as a whole"""
+        course_id, tee_ids = self.seed()
+        repository = self.app.extensions['repository']
+        tee = repository.get_tee(tee_ids[0])
+        with self.assertRaises(RepositoryError):
+            repository.update_tee(tee, {'course_rating': 70.1, 'slope_rating': "steep"})
+        self.assertIsNone(tee.course_rating)
+        course = repository.get_course(course_id)
+        with self.assertRaises(RepositoryError):
+            repository.create_holes(course, [({'number': 3, 'par': 4}, []), ({'number': 4}, [])])
+        self.assertEqual(len(course.holes), 2)
+
+    def test_database_routes(self):
+        """Test endpoints reading rounds and users are refused without a database"""
+        course_id, _ = self.seed()
+        for url in ("/users/1/rounds", f"/courses/{course_id}/scores/distribution", "/sync"):
+            self.assertEqual(self.client().get(url).status_code, 503, url)
+        repository = self.app.extensions['repository']
+        hole = repository.get_course(course_id).holes[0]
+        self.assertIs(repository.get_hole(str(hole.id)), hole)
+
+    def test_read_only(self):
+        """Test a read only repository refuses writes"""
+        self.app.extensions['repository'] = MemoryRepository(read_only=True)
+        res = self.client().post("/courses", json={'name': "New", 'location': "Somewhere"})
+        self.assertEqual(res.status_code, 400)
+
+    def test_concurrent_writes(self):
+        """Test courses created from several threads all get their own id"""
+        repository = self.app.extensions['repository']
+        def create():
+            for number in range(50):
+                repository.create_course({'name': f"Course {number}", 'location': "fake location"})
+        threads = [threading.Thread(target=create) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(repository.rows['courses']), list(range(1, 201)))
+
+    def test_writable_only_in_tests(self):
+        """Test an empty writable memory backend is refused outside of tests"""
+        with self.assertRaises(ValueError):
+            create_app({
+                'TEST_DB_URI': 'postgresql://nobody@localhost:1/none',
+                'TESTING': False,
+                'STORAGE_BACKEND': 'memory',
+            })
+
+if __name__ == "__main__":
+    unittest.main()
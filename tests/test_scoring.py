@@ -0,0 +1,83 @@
+import math, random, unittest
+import numpy as np
+from flask_app import scoring
+
+nan = float('nan')
+
+
+def reference_strokes(handicap, stroke_index, holes):
+    """Strokes on one hole the way a card is marked, plus handicaps giving
+    strokes back from the easiest hole"""
+    if handicap >= 0:
+        return handicap // holes + (1 if stroke_index <= handicap % holes else 0)
+    return -((-handicap) // holes + (1 if stroke_index > holes - (-handicap) % holes else 0))
+
+
+class ScoringTestCase(unittest.TestCase):
+    """Class for testing the vectorized competition formats"""
+
+    def test_strokes_received(self):
+        """Test strokes per hole against marking each hole in turn"""
+        stroke_indexes = list(range(1, 19))
+        random.Random(3).shuffle(stroke_indexes)
+        handicaps = list(range(-5, 40))
+        strokes = scoring.strokes_received(handicaps, stroke_indexes)
+        for row, handicap in zip(strokes, handicaps):
+            self.assertEqual(row.tolist(), [reference_strokes(handicap, si, 18) for si in stroke_indexes])
+            self.assertEqual(row.sum(), handicap)
+        front_nine = [7, 11, 3, 15, 1, 17, 9, 5, 13]
+        self.assertEqual(scoring.stroke_ranks(front_nine).tolist(), [4, 6, 2, 8, 1, 9, 5, 3, 7])
+        self.assertEqual(scoring.strokes_received([2], front_nine).tolist(), [[0, 0, 1, 0, 1, 0, 0, 0, 0]])
+
+    def test_stableford(self):
+        """Test points per hole against scoring each hole in turn"""
+        generator = random.Random(5)
+        pars = [generator.choice((3, 4, 5)) for _ in range(18)]
+        cards = [[generator.choice([nan] + list(range(2, 10))) for _ in range(18)] for _ in range(50)]
+        handicaps = [generator.randint(-2, 36) for _ in cards]
+        stroke_indexes = list(range(1, 19))
+        strokes = scoring.strokes_received(handicaps, stroke_indexes)
+        points = scoring.stableford(scoring.score_matrix(cards), np.array(pars), strokes)
+        for card, handicap, result in zip(cards, handicaps, points):
+            expected = sum(
+                max(0, 2 + par + reference_strokes(handicap, si, 18) - score)
+                for score, par, si in zip(card, pars, stroke_indexes) if not math.isnan(score)
+            )
+            self.assertEqual(result, expected)
+
+    def test_skins(self):
+        """Test ties carry skins to the next hole won outright"""
+        net = scoring.score_matrix([
+            [4, 3, 4, 4, 5, None],
+            [4, 4, 4, 3, 5, 4],
+            [5, 5, 4, 5, 5, 4],
+        ])
+        counts, won, carried = scoring.skins(net)
+        self.assertEqual(counts.tolist(), [2, 2, 0])
+        self.assertEqual(won, [(1, 0, 2), (3, 1, 2)])
+        self.assertEqual(carried, 2)
+        counts, won, carried = scoring.skins(scoring.score_matrix([[None, 4], [None, 5]]))
+        self.assertEqual((counts.tolist(), won, carried), ([2, 0], [(1, 0, 2)], 0))
+
+    def test_match_play(self):
+        """Test matches close out, go to the last hole or are halved"""
+        holes = 18
+        first = scoring.score_matrix([
+            [3] * 5 + [4] * 13,
+            [4] * 17 + [3],
+            [4] * holes,
+            [4] * 9 + [None] * 9,
+        ])
+        second = scoring.score_matrix([[4] * holes, [4] * holes, [4] * holes, [4] * holes])
+        margins, left = scoring.match_play(first, second)
+        self.assertEqual(
+            [scoring.match_result(margin, holes_left) for margin, holes_left in zip(margins.tolist(), left.tolist())],
+            ['5&4', '1 up', 'halved', '5&4']
+        )
+        # holes without a score are lost
+        self.assertEqual(margins[3], -5)
+        margins, left = scoring.match_play(first[[]], second[[]])
+        self.assertEqual(len(margins), 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,240 @@
+import os, shutil, tempfile, unittest
+from sqlalchemy import text
+from flask_app import create_app, db, shards, snapshot, stats
+from flask_app.models import Course, Hole, Round, ShardBucket, SlowQuery, Tee, User
+from flask_app.routing import UnroutedError
+
+# e.g. postgresql://test:password@db:5432/shard0,postgresql://test:password@db:5432/shard1
+SHARD_URIS = [uri for uri in os.environ.get('TEST_SHARD_DB_URIS', '').split(',') if uri]
+
+
+class BucketTestCase(unittest.TestCase):
+    """Class for testing the shard map without databases"""
+
+    def test_default_map(self):
+        """Test buckets are spread round robin over the shards"""
+        app = create_app({
+            'TEST_DB_URI': 'postgresql://test:password@db:5432/testdb',
+            'SHARD_DATABASE_URIS': ['postgresql://a/shard0', 'postgresql://b/shard1'],
+        })
+        default = app.extensions['shards'].default()
+        self.assertEqual(len(default), shards.BUCKETS)
+        self.assertEqual(default[shards.bucket(1)], 'shard1')
+        self.assertEqual(default[shards.bucket(shards.BUCKETS + 2)], 'shard0')
+        self.assertEqual(app.config['SQLALCHEMY_BINDS']['shard1'], 'postgresql://b/shard1')
+
+    def test_disabled(self):
+        """Test no shard is chosen without shards configured"""
+        app = create_app({'TEST_DB_URI': 'postgresql://test:password@db:5432/testdb'})
+        with app.app_context():
+            self.assertIsNone(shards.shard_for(1))
+            self.assertEqual(list(shards.each()), [None])
+
+
+@unittest.skipUnless(len(SHARD_URIS) >= 2, "TEST_SHARD_DB_URIS needs two shard databases")
+class ShardTestCase(unittest.TestCase):
+    """Class for testing users and rounds spread over shard databases"""
+
+    def setUp(self):
+        """Set up for tests"""
+        self.app = create_app({
+            'TEST_DB_URI': 'postgresql://test:password@db:5432/testdb',
+            'SHARD_DATABASE_URIS': SHARD_URIS[:2],
+            'SHARD_MAP_TTL_SECONDS': 0,
+            'SLOW_QUERY_LOG_ENABLED': True,
+            'SLOW_QUERY_THRESHOLD_MS': 1e9,
+        })
+        self.client = self.app.test_client
+        self.db = db
+        self.db.create_all()
+        shards.create_tables(self.app)
+        course = Course(name="Fake golf course", location="fake location")
+        self.db.session.add(course)
+        self.db.session.flush()
+        for number in range(1, 19):
+            self.db.session.add(Hole(course_id=course.id, number=number, par=4))
+        tee = Tee(course_id=course.id, colour="white", course_rating=72.0, slope_rating=113)
+        self.db.session.add(tee)
+        self.db.session.commit()
+        self.course_id, self.tee_id = course.id, tee.id
+        users = [User(name="Jon Snow"), User(name="Arya Stark")]
+        self.db.session.add_all(users)
+        self.db.session.flush()
+        self.user_ids = [user.id for user in users]
+        self.db.session.commit()
+
+    def tearDown(self):
+        """Test teardown"""
+        self.app.extensions['slow_queries'].wait()
+        self.db.session.remove()
+        shards.drop_tables(self.app)
+        self.db.drop_all()
+
+    def count(self, shard, table, where=''):
+        with db.get_engine(self.app, bind=shard).connect() as connection:
+            return connection.execute(text(f"SELECT count(*) FROM {table} {where}")).scalar()
+
+    def post_round(self, user_id, score=90):
+        return self.client().post(f"/users/{user_id}/rounds", json={
+            'course_id': self.course_id, 'tee_id': self.tee_id,
+            'score_by_hole': [score - 17 * 5] + [5] * 17
+        })
+
+    def test_rows_live_on_their_shard(self):
+        """Test users and rounds are written to the shard of the user id and
+        reference data is replicated to every shard"""
+        for shard in ('shard0', 'shard1'):
+            self.assertEqual(self.count(shard, 'courses'), 1)
+            self.assertEqual(self.count(shard, 'holes'), 18)
+            self.assertEqual(self.count(shard, 'tees'), 1)
+        for user_id in self.user_ids:
+            self.assertEqual(self.post_round(user_id).status_code, 201)
+        with self.app.app_context():
+            homes = [shards.shard_for(user_id) for user_id in self.user_ids]
+        self.assertEqual(sorted(homes), ['shard0', 'shard1'])
+        for user_id, home in zip(self.user_ids, homes):
+            self.assertEqual(self.count(home, 'users', f"WHERE id = {user_id}"), 1)
+            self.assertEqual(self.count(home, 'rounds', f"WHERE user_id = {user_id}"), 1)
+            res = self.client().get(f"/users/{user_id}/rounds")
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(res.get_json()[0]['score'], 90)
+        self.assertEqual(self.count(None, 'rounds'), 0)
+        with db.get_engine(self.app, bind='shard1').connect() as connection:
+            round_id = connection.execute(text("SELECT id FROM rounds")).scalar()
+        self.assertEqual(round_id % shards.MAX_SHARDS, 2)
+
+    def test_queries_across_shards(self):
+        """Test handicaps and score distributions gather every shard"""
+        for user_id in self.user_ids:
+            for score in (90, 92, 94):
+                self.assertEqual(self.post_round(user_id, score).status_code, 201)
+        res = self.client().post("/competitions/handicaps", json={'entries': [
+            {'user_id': user_id, 'tee_id': self.tee_id} for user_id in self.user_ids
+        ]})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([entry['handicap_index'] for entry in res.get_json()['entries']], [16.0, 16.0])
+        res = self.client().get(f"/courses/{self.course_id}/scores/distribution")
+        self.assertEqual(res.get_json()['rounds'], 6)
+
+    def test_stats_across_shards(self):
+        """Test the statistics views are refreshed on every shard and merged"""
+        for user_id in self.user_ids:
+            for score in (90, 92):
+                self.assertEqual(self.post_round(user_id, score).status_code, 201)
+        result = self.app.test_cli_runner().invoke(args=['stats', 'refresh'])
+        self.assertIn("Refreshed shard0", result.output)
+        self.assertIn("Refreshed shard1", result.output)
+        self.app.config['ADMIN_TOKEN'] = 'secret'
+        headers = {stats.TOKEN_HEADER: 'secret'}
+        courses = self.client().get("/admin/stats/courses", headers=headers).get_json()
+        self.assertEqual([(course['rounds'], course['players']) for course in courses], [(4, 2)])
+        scores = self.client().get("/admin/stats/scores", headers=headers).get_json()
+        self.assertEqual([(score['rounds'], score['average']) for score in scores], [(4, 91.0)])
+        self.assertEqual(self.client().get("/admin/stats/active-users", headers=headers).get_json()['day'], 2)
+
+    def test_slow_queries_across_shards(self):
+        """Test statements run on a shard reach the slow query log with a plan"""
+        user_id = self.user_ids[0]
+        self.assertEqual(self.post_round(user_id).status_code, 201)
+        self.app.config['SLOW_QUERY_THRESHOLD_MS'] = 0
+        self.assertEqual(self.client().get(f"/users/{user_id}/rounds").status_code, 200)
+        self.app.config['SLOW_QUERY_THRESHOLD_MS'] = 1e9
+        self.app.extensions['slow_queries'].wait()
+        with self.app.app_context():
+            slow = SlowQuery.query.filter(
+                SlowQuery.endpoint == 'users.retrieve_rounds', SlowQuery.statement.contains('FROM rounds')
+            ).first()
+            self.assertIsNotNone(slow)
+            self.assertIn('Plan', slow.plan[0])
+
+    def test_snapshot_across_shards(self):
+        """Test the snapshot export reads every shard with a cursor each"""
+        for user_id in self.user_ids:
+            self.assertEqual(self.post_round(user_id, 90).status_code, 201)
+        path = tempfile.mkdtemp()
+        try:
+            with self.app.app_context():
+                added = snapshot.export(path)
+                self.assertEqual(sorted(info['shard'] for info in added), ['shard0', 'shard1'])
+                self.assertEqual(self.post_round(self.user_ids[0], 94).status_code, 201)
+                added = snapshot.export(path)
+                home = shards.shard_for(self.user_ids[0])
+                self.assertEqual([(info['shard'], info['rows']) for info in added], [(home, 1)])
+                rounds = snapshot.Snapshot(path)
+                self.assertEqual(len(rounds), 3)
+                self.assertEqual(rounds.group('course_id')[self.course_id], {'rounds': 3, 'mean': 274 / 3})
+        finally:
+            shutil.rmtree(path)
+
+    def test_move_bucket(self):
+        """Test a bucket's users and rounds move to another shard"""
+        user_id = self.user_ids[0]
+        self.assertEqual(self.post_round(user_id).status_code, 201)
+        with self.app.app_context():
+            source = shards.shard_for(user_id)
+            target = 'shard0' if source == 'shard1' else 'shard1'
+            copied = shards.move_bucket(self.app, shards.bucket(user_id), target, wait=0)
+            self.assertEqual(copied, {'users': 1, 'rounds': 1})
+            self.assertEqual(shards.shard_for(user_id), target)
+        self.assertEqual(self.count(source, 'rounds', f"WHERE user_id = {user_id}"), 0)
+        self.assertEqual(self.count(target, 'rounds', f"WHERE user_id = {user_id}"), 1)
+        self.assertEqual(self.count(target, 'score_sketches'), 1)
+        self.assertEqual(len(self.client().get(f"/users/{user_id}/rounds").get_json()), 1)
+        self.assertEqual(self.post_round(user_id).status_code, 201)
+
+    def test_sync_after_move(self):
+        """Test /sync reads rounds from the user's shard and starts them over
+        once the bucket has moved"""
+        user_id = self.user_ids[0]
+        self.assertEqual(self.post_round(user_id).status_code, 201)
+        body = self.client().get(f"/sync?user_id={user_id}").get_json()
+        self.assertEqual([change['type'] for change in body['changes']].count('round'), 1)
+        with self.app.app_context():
+            source = shards.shard_for(user_id)
+            target = 'shard0' if source == 'shard1' else 'shard1'
+            shards.move_bucket(self.app, shards.bucket(user_id), target, wait=0)
+        self.assertEqual(self.count(source, 'round_changes'), 0)
+        changes = self.client().get(f"/sync?user_id={user_id}&since={body['next']}").get_json()['changes']
+        self.assertEqual([change['type'] for change in changes], ['round'])
+        self.assertEqual(changes[0]['data']['score'], 90)
+
+    def test_moving_bucket_refuses_writes(self):
+        """Test writes to a bucket being moved get a 503, reads still work"""
+        user_id = self.user_ids[0]
+        self.assertEqual(self.post_round(user_id).status_code, 201)
+        with self.app.app_context():
+            shard = shards.shard_for(user_id)
+        self.db.session.add(ShardBucket(bucket=shards.bucket(user_id), shard=shard, moving=True))
+        self.db.session.commit()
+        res = self.post_round(user_id)
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(res.headers['Retry-After'], '5')
+        self.assertEqual(self.client().get(f"/users/{user_id}/rounds").status_code, 200)
+
+    def test_saturated_shard_pool(self):
+        """Test requests for users on a shard whose pool is exhausted get a
+        503, while users on the other shards are still served"""
+        with self.app.app_context():
+            homes = {shards.shard_for(user_id): user_id for user_id in self.user_ids}
+            pool = db.get_engine(self.app, bind='shard0').pool
+            held = [pool.connect() for _ in range(pool.size() + pool._max_overflow)]
+        try:
+            res = self.post_round(homes['shard0'])
+            self.assertEqual(res.status_code, 503)
+            self.assertIn('Retry-After', res.headers)
+            self.assertEqual(self.post_round(homes['shard1']).status_code, 201)
+        finally:
+            for connection in held:
+                connection.close()
+        self.assertEqual(self.post_round(homes['shard0']).status_code, 201)
+
+    def test_unrouted(self):
+        """Test sharded tables cannot be queried without choosing a shard"""
+        with self.app.app_context():
+            with self.assertRaises(UnroutedError):
+                User.query.all()
+            with shards.routed('shard0'):
+                self.assertEqual(len(Round.query.all()), 0)
+
+if __name__ == "__main__":
+    unittest.main()
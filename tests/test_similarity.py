@@ -0,0 +1,116 @@
+import unittest
+import numpy as np
+from flask_app import create_app, db, similarity
+from flask_app.models import Course, Hole, Tee, Yardage
+
+
+class SimilarityTestCase(unittest.TestCase):
+    """Class for testing the similar courses index"""
+
+    def setUp(self):
+        """Set up for tests"""
+        self.app = create_app({
+            'TEST_DB_URI': 'postgresql://test:password@db:5432/testdb',
+            'SIMILARITY_REFRESH_SECONDS': 0,
+        })
+        self.client = self.app.test_client
+        self.db = db
+        self.db.create_all()
+        self.ids = {}
+        # two long par 72 courses, a short par 72 one and an executive course
+        for name, pars, yardage, rating in (
+            ("Championship", [4, 4, 3, 5] * 4 + [4, 4], 410, 74.0),
+            ("Links", [4, 4, 3, 5] * 4 + [4, 4], 400, 73.5),
+            ("Parkland", [4, 4, 3, 5] * 4 + [4, 4], 330, 69.0),
+            ("Executive", [3] * 9, 150, 55.0),
+        ):
+            self.ids[name] = self.add_course(name, pars, yardage, rating)
+
+    def tearDown(self):
+        """Test teardown"""
+        self.db.session.remove()
+        self.db.drop_all()
+
+    def add_course(self, name, pars, yardage, rating):
+        course = Course(name=name, location="fake location")
+        tee = Tee(course=course, colour="white", course_rating=rating, slope_rating=rating * 1.6)
+        self.db.session.add_all([course, tee])
+        for number, par in enumerate(pars, 1):
+            hole = Hole(course=course, number=number, par=par)
+            self.db.session.add_all([hole, Yardage(hole=hole, tee=tee, yardage=yardage + 40 * (par - 4))])
+        self.db.session.commit()
+        return course.id
+
+    def similar(self, name, k=3):
+        res = self.client().get(f"/courses/{self.ids[name]}/similar?k={k}")
+        self.assertEqual(res.status_code, 200, res.data)
+        return [course['name'] for course in res.get_json()['similar']]
+
+    def test_similar(self):
+        """Test courses come back closest first, without the course itself"""
+        self.assertEqual(self.similar("Championship"), ["Links", "Parkland", "Executive"])
+        self.assertEqual(self.similar("Executive", k=1), ["Parkland"])
+        self.assertEqual(self.client().get("/courses/999/similar").status_code, 404)
+        self.assertEqual(self.client().get(f"/courses/{self.ids['Links']}/similar?k=0").status_code, 400)
+
+    def test_features(self):
+        """Test the raw features of a course"""
+        with self.app.app_context():
+            rows = dict(similarity.feature_rows([self.ids["Executive"]]))
+        self.assertEqual(list(rows), [self.ids["Executive"]])
+        self.assertEqual(rows[self.ids["Executive"]], [27, 9, 1.0, 0.0, 0.0, 9 * 110, 9 * 110, 55.0, 88.0])
+
+    def test_batch_matches_single(self):
+        """Test a batched search answers each course like a single one"""
+        with self.app.app_context():
+            index = similarity.index()
+            index.refresh()
+            ids = list(self.ids.values())
+            batch = index.nearest(ids + [999], 2)
+            self.assertIsNone(batch[-1])
+            for id, found in zip(ids, batch):
+                single = index.nearest([id], 2)[0]
+                self.assertEqual([course_id for course_id, _ in single], [course_id for course_id, _ in found])
+                for (_, expected), (_, distance) in zip(single, found):
+                    self.assertAlmostEqual(distance, expected)
+                self.assertNotIn(id, [course_id for course_id, _ in found])
+
+    def test_follows_writes(self):
+        """Test new courses and changed holes and tees reach the index
+        through the change log, only the touched courses queried again"""
+        self.assertEqual(self.similar("Parkland", k=1), ["Links"])
+        with self.app.app_context():
+            index = similarity.index()
+            self.assertEqual(len(index), 4)
+        self.ids["Pitch and putt"] = self.add_course("Pitch and putt", [3] * 9, 140, 54.0)
+        self.assertEqual(self.similar("Executive", k=1), ["Pitch and putt"])
+        with self.app.app_context():
+            self.assertEqual(index.changed_courses(), set())
+            hole_id = Hole.query.filter_by(course_id=self.ids["Parkland"], number=1).one().id
+        res = self.client().patch(f"/courses/{self.ids['Parkland']}/holes/{hole_id}", json={'par': 5})
+        self.assertEqual(res.status_code, 201)
+        with self.app.app_context():
+            self.assertEqual(index.changed_courses(), {self.ids["Parkland"]})
+            tee = Tee.query.filter_by(course_id=self.ids["Parkland"]).one()
+            tee.course_rating = 55.0
+            db.session.commit()
+            self.assertEqual(index.changed_courses(), {self.ids["Parkland"]})
+        with self.app.app_context():
+            course = Course(name="Closed", location="fake location")
+            db.session.add(course)
+            db.session.commit()
+            index.refresh()
+            self.assertIn(course.id, index.ids.tolist())
+            db.session.delete(course)
+            db.session.commit()
+            index.refresh()
+            self.assertEqual(len(index), 5)
+            self.assertNotIn(course.id, index.ids.tolist())
+
+    def test_scale(self):
+        """Test columns are standardised and missing values are average"""
+        scaled = similarity.scale(np.array([[1.0, 5.0, np.nan], [3.0, 5.0, np.nan], [np.nan, 5.0, np.nan]]))
+        self.assertTrue(np.allclose(scaled, [[-1, 0, 0], [1, 0, 0], [0, 0, 0]]))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,156 @@
+import json, random, unittest
+from flask_app import create_app, db
+from flask_app.models import Course, ScoreSketch, Tee, User
+from flask_app.sketches import Sketch, rebuild
+
+def nine(total):
+    """Nine hole scores adding up to total"""
+    return [total - 8 * 4] + [4] * 8
+
+
+class SketchTestCase(unittest.TestCase):
+    """Class for testing the score histogram"""
+
+    def sketch(self, totals, holes=9):
+        sketch = Sketch(holes)
+        for total in totals:
+            index = sketch.bin(total)
+            sketch.counts.extend([0] * (index + 1 - len(sketch.counts)))
+            sketch.counts[index] += 1
+        return sketch
+
+    def test_rank_and_percentile(self):
+        """Test ranks are exact against sorting every total"""
+        generator = random.Random(3)
+        totals = [generator.randint(30, 60) for _ in range(500)]
+        sketch = self.sketch(totals)
+        for score in (29, 35, 41, 44, 61):
+            below = len([t for t in totals if t < score])
+            ties = len([t for t in totals if t == score])
+            self.assertEqual(sketch.rank(score), (below, ties, 500 - below - ties))
+        self.assertEqual(sketch.quantile(0.5), sorted(totals)[249])
+
+    def test_merge(self):
+        """Test merged sketches equal the sketch of all totals"""
+        first, second = [36, 40, 41, 52], [38, 40, 70]
+        merged = self.sketch(first).merge(self.sketch(second))
+        self.assertEqual(merged.counts, self.sketch(first + second).counts)
+        self.assertEqual(merged.total, 7)
+
+    def test_clamped(self):
+        """Test totals beyond the top counter are pooled"""
+        sketch = self.sketch([95, 120])
+        self.assertEqual(sketch.rank(100), (0, 2, 0))
+        self.assertEqual(sketch.histogram(), [{'score': 90, 'count': 2}])
+
+
+class SketchEndpointTestCase(unittest.TestCase):
+    """Class for testing the score distributions kept with the rounds"""
+
+    def setUp(self):
+        """Set up for tests"""
+        test_config = {'TEST_DB_URI': 'postgresql://test:password@db:5432/testdb'}
+        self.app = create_app(test_config)
+        self.client = self.app.test_client
+        self.db = db
+        self.db.create_all()
+        course = Course(name="Fake golf course", location="fake location")
+        user = User(name="Jon Snow")
+        self.db.session.add_all([course, user])
+        self.db.session.commit()
+        tees = [Tee(course_id=course.id, colour=colour) for colour in ("blue", "red")]
+        self.db.session.add_all(tees)
+        self.db.session.commit()
+        self.course_id, self.user_id = course.id, user.id
+        self.blue, self.red = [tee.id for tee in tees]
+
+    def tearDown(self):
+        """Test teardown"""
+        self.db.session.remove()
+        self.db.drop_all()
+
+    def post_round(self, tee_id, scores):
+        payload = {'course_id': self.course_id, 'tee_id': tee_id, 'score_by_hole': scores}
+        res = self.client().post(f"/users/{self.user_id}/rounds", data=json.dumps(payload))
+        self.assertEqual(res.status_code, 201, res.data)
+        return int(res.headers['Location'].rsplit('/', 1)[1])
+
+    def counts(self):
+        return {
+            (sketch.tee_id, sketch.holes): (sketch.total, [c or 0 for c in sketch.counts])
+            for sketch in ScoreSketch.query
+        }
+
+    def test_distribution(self):
+        """Test rounds are counted as they complete and endpoints read them"""
+        for total in (36, 38, 38, 41):
+            self.post_round(self.blue, nine(total))
+        self.post_round(self.red, nine(45))
+        round_id = self.post_round(self.blue, [None] * 9)
+        base = f"/rounds/{round_id}/holes"
+        res = self.client().patch(
+            f"/users/{self.user_id}{base}",
+            data=json.dumps({'holes': {str(n): {'score': 4} for n in range(1, 10)}})
+        )
+        self.assertEqual(res.status_code, 200, res.data)
+        res = self.client().get(
+            f"/courses/{self.course_id}/scores/percentile?score=38&holes=9&tee_id={self.blue}"
+        )
+        data = json.loads(res.data)
+        self.assertEqual((data['rounds'], data['lower'], data['ties'], data['higher']), (5, 2, 2, 1))
+        self.assertEqual(data['beats'], 20.0)
+        res = self.client().get(f"/courses/{self.course_id}/scores/distribution?holes=9")
+        data = json.loads(res.data)
+        self.assertEqual(data['rounds'], 6)
+        self.assertEqual(data['histogram'][-1], {'score': 45, 'count': 1})
+        res = self.client().get(f"/courses/{self.course_id}/scores/distribution")
+        self.assertEqual(res.status_code, 404)
+
+    def test_corrections_match_rebuild(self):
+        """Test corrected scores move bins and agree with a full rebuild"""
+        round_id = self.post_round(self.blue, nine(40))
+        self.post_round(self.blue, nine(40))
+        res = self.client().patch(
+            f"/users/{self.user_id}/rounds/{round_id}/holes/1", data=json.dumps({'score': 3})
+        )
+        self.assertEqual(res.status_code, 200, res.data)
+        res = self.client().patch(
+            f"/users/{self.user_id}/rounds/{round_id}", data=json.dumps({'score_by_hole': [5] * 18})
+        )
+        self.assertEqual(res.status_code, 201, res.data)
+        incremental = self.counts()
+        self.assertEqual(incremental[(self.blue, 9)][0], 1)
+        self.assertEqual(incremental[(self.blue, 18)][0], 1)
+        rebuild()
+        rebuilt = self.counts()
+        for key, (total, counts) in incremental.items():
+            self.assertEqual(rebuilt[key][0], total)
+            self.assertEqual(rebuilt[key][1], counts[:len(rebuilt[key][1])])
+            self.assertFalse(any(counts[len(rebuilt[key][1]):]))
+
+    def test_moved_between_tees(self):
+        """Test a round patched onto another tee moves to that tee's sketch"""
+        round_id = self.post_round(self.blue, nine(40))
+        res = self.client().patch(
+            f"/users/{self.user_id}/rounds/{round_id}", data=json.dumps({'tee_id': self.red})
+        )
+        self.assertEqual(res.status_code, 201, res.data)
+        counts = self.counts()
+        self.assertEqual(counts[(self.blue, 9)][0], 0)
+        self.assertEqual(counts[(self.red, 9)][0], 1)
+        res = self.client().get(f"/courses/{self.course_id}/scores/distribution?holes=9&tee_id={self.red}")
+        self.assertEqual(json.loads(res.data)['rounds'], 1)
+        res = self.client().patch(
+            f"/users/{self.user_id}/rounds/{round_id}",
+            data=json.dumps({'tee_id': self.blue, 'score_by_hole': nine(44)})
+        )
+        self.assertEqual(res.status_code, 201, res.data)
+        incremental = self.counts()
+        self.assertEqual((incremental[(self.blue, 9)][0], incremental[(self.red, 9)][0]), (1, 0))
+        rebuild()
+        rebuilt = self.counts()
+        self.assertEqual(rebuilt[(self.blue, 9)][0], 1)
+        self.assertEqual(incremental[(self.blue, 9)][1][:len(rebuilt[(self.blue, 9)][1])], rebuilt[(self.blue, 9)][1])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+import unittest
+from sqlalchemy import event
+from sqlalchemy.exc import DBAPIError
+from flask_app import create_app, db
+from flask_app.models import Course, SlowQuery
+from flask_app.slow_queries import redact, top
+
+
+class SlowQueryTestCase(unittest.TestCase):
+    """Class for testing the slow query log"""
+
+    def setUp(self):
+        """Set up for tests"""
+        self.app = create_app({
+            'TEST_DB_URI': 'postgresql://test:password@db:5432/testdb',
+            'SLOW_QUERY_LOG_ENABLED': True,
+            'SLOW_QUERY_THRESHOLD_MS': 1e9,
+            'SLOW_QUERY_EXPLAIN_RATE': 0.0,
+        })
+        self.client = self.app.test_client
+        self.recorder = self.app.extensions['slow_queries']
+        self.db = db
+        self.db.create_all()
+        course = Course(name="Fake golf course", location="fake location")
+        self.db.session.add(course)
+        self.db.session.commit()
+        self.course_id = course.id
+
+    def tearDown(self):
+        """Test teardown"""
+        self.app.config['SLOW_QUERY_THRESHOLD_MS'] = 1e9
+        self.recorder.wait()
+        self.db.session.remove()
+        self.db.drop_all()
+
+    def record(self, path, times=1):
+        self.app.config['SLOW_QUERY_THRESHOLD_MS'] = 0
+        for _ in range(times):
+            self.assertEqual(self.client().get(path).status_code, 200)
+        self.app.config['SLOW_QUERY_THRESHOLD_MS'] = 1e9
+        self.recorder.wait()
+
+    def test_records_and_explains(self):
+        """Test slow statements are aggregated per endpoint with a plan"""
+        self.record(f"/courses/{self.course_id}", times=2)
+        queries = SlowQuery.query.filter_by(endpoint='courses.course_detail').all()
+        self.assertEqual(len(queries), 1)
+        slow = queries[0]
+        self.assertIn('FROM courses', slow.statement)
+        self.assertEqual(slow.calls, 2)
+        self.assertGreaterEqual(slow.total_ms, slow.max_ms)
+        self.assertEqual(slow.parameters, {'param_1': 'int'})
+        self.assertIn('course_views.py', slow.stack)
+        self.assertIn('Plan', slow.plan[0])
+
+    def test_top_and_bounded(self):
+        """Test top orders by total time and the log keeps the worst entries"""
+        self.app.config['SLOW_QUERY_MAX_ENTRIES'] = 1
+        self.record("/courses")
+        self.record(f"/courses/{self.course_id}")
+        self.assertEqual(SlowQuery.query.count(), 1)
+        self.assertEqual(len(top()), 1)
+
+    def test_not_recorded_below_threshold(self):
+        """Test fast statements are not recorded"""
+        self.client().get("/courses")
+        self.recorder.wait()
+        self.assertEqual(SlowQuery.query.count(), 0)
+
+    def test_failed_statement(self):
+        """Test a statement that raises is not recorded, its start time went on
+        its own execution context"""
+        failed = []
+        def keep_context(exception_context):
+            failed.append(exception_context.execution_context)
+        self.app.config['SLOW_QUERY_THRESHOLD_MS'] = 0
+        with self.app.app_context(), self.db.engine.connect() as connection:
+            event.listen(self.db.engine, 'handle_error', keep_context)
+            try:
+                with self.assertRaises(DBAPIError):
+                    connection.execute("SELECT 1 / 0")
+            finally:
+                event.remove(self.db.engine, 'handle_error', keep_context)
+        self.app.config['SLOW_QUERY_THRESHOLD_MS'] = 1e9
+        self.recorder.wait()
+        self.assertEqual(failed[0]._slow_query_started[1], "SELECT 1 / 0")
+        self.assertFalse(any('1 / 0' in slow.statement for slow in SlowQuery.query))
+
+    def test_explained_bounded(self):
+        """Test only the most recently seen fingerprints are remembered"""
+        self.app.config['SLOW_QUERY_EXPLAINED_SIZE'] = 2
+        self.assertEqual([self.recorder.first_explain(key) for key in 'abac'], [True, True, False, True])
+        self.assertEqual(list(self.recorder.explained), ['a', 'c'])
+        self.assertTrue(self.recorder.first_explain('b'))
+
+    def test_redact(self):
+        """Test parameter values are replaced by their types"""
+        self.assertEqual(
+            redact({'name': 'Jon', 'ids': [1, 2], 'date': None}),
+            {'name': 'str', 'ids': 'list[2]', 'date': 'null'}
+        )
+        self.assertEqual(redact((1, 'a')), ['int', 'str'])
+
+if __name__ == "__main__":
+    unittest.main()
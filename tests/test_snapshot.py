@@ -0,0 +1,132 @@
+import datetime, os, shutil, tempfile, unittest
+import numpy as np
+from sqlalchemy import text
+from flask_app import create_app, db
+from flask_app.models import Course, Round, Tee, User
+from flask_app.snapshot import Snapshot, export, handicap_band, month
+
+
+class SnapshotTestCase(unittest.TestCase):
+    """Class for testing the columnar rounds snapshot"""
+
+    def setUp(self):
+        """Set up for tests"""
+        test_config = {'TEST_DB_URI': 'postgresql://test:password@db:5432/testdb'}
+        self.app = create_app(test_config)
+        self.db = db
+        self.db.create_all()
+        self.path = tempfile.mkdtemp()
+        course = Course(name="Fake golf course", location="fake location")
+        user = User(name="Jon Snow")
+        self.db.session.add_all([course, user])
+        self.db.session.commit()
+        tee = Tee(course_id=course.id, colour="blue", course_rating=70.0, slope_rating=113)
+        self.db.session.add(tee)
+        self.db.session.commit()
+        self.ids = {'user_id': user.id, 'course_id': course.id, 'tee_id': tee.id}
+
+    def tearDown(self):
+        """Test teardown"""
+        shutil.rmtree(self.path)
+        self.db.session.remove()
+        self.db.drop_all()
+
+    def add_rounds(self, *rounds):
+        for day, scores in rounds:
+            self.db.session.add(Round(date=day, score_by_hole=scores, **self.ids))
+        self.db.session.commit()
+
+    def test_export_and_query(self):
+        """Test columns, the per hole block and grouped aggregates"""
+        self.add_rounds(
+            (datetime.date(2024, 1, 5), [4] * 18),
+            (datetime.date(2024, 1, 20), [5] * 18),
+            (datetime.date(2024, 2, 3), [4, 3, None]),
+        )
+        [info] = export(self.path)
+        self.assertEqual(info['rows'], 3)
+        snapshot = Snapshot(self.path)
+        self.assertEqual(len(snapshot), 3)
+        totals = snapshot.column('total')[0]
+        self.assertIsInstance(totals, np.memmap)
+        self.assertEqual(totals.tolist(), [72, 90, 7])
+        self.assertEqual(snapshot.column('complete')[0].tolist(), [True, True, False])
+        self.assertEqual(snapshot.group(month), {
+            '2024-01': {'rounds': 2, 'mean': 81.0},
+            '2024-02': {'rounds': 1, 'mean': 7.0},
+        })
+        bands = snapshot.group(handicap_band(5), value='differential')
+        self.assertEqual(sorted(bands), [0, 20])
+        rows, numbers, scores = snapshot.segments[0].hole_scores()
+        self.assertEqual(scores[rows == 2].tolist(), [4, 3, 0])
+        self.assertEqual(numbers[rows == 2].tolist(), [1, 2, 3])
+        averages = snapshot.hole_averages(self.ids['course_id'])
+        self.assertEqual(averages[1], 4.5)
+
+    def test_incremental_and_full_export(self):
+        """Test exports append new rounds and --full compacts the segments"""
+        self.add_rounds((datetime.date(2024, 3, 1), [4] * 9))
+        export(self.path)
+        self.assertEqual(export(self.path), [])
+        self.add_rounds((datetime.date(2024, 3, 2), [5] * 9), (datetime.date(2024, 3, 3), [6] * 9))
+        self.assertEqual(export(self.path)[0]['rows'], 2)
+        snapshot = Snapshot(self.path)
+        self.assertEqual([segment.rows for segment in snapshot.segments], [1, 2])
+        self.assertEqual(snapshot.group('course_id')[self.ids['course_id']]['rounds'], 3)
+        export(self.path, full=True)
+        snapshot = Snapshot(self.path)
+        self.assertEqual([segment.rows for segment in snapshot.segments], [3])
+        self.assertEqual(
+            len([entry for entry in os.listdir(self.path) if entry.startswith('segment-')]), 1
+        )
+
+    def test_out_of_order_commit(self):
+        """Test a round committed after a round with a higher id is exported"""
+        self.add_rounds((datetime.date(2024, 3, 1), [4] * 9))
+        export(self.path)
+        with self.db.engine.connect() as connection:
+            transaction = connection.begin()
+            round_id = connection.execute(text(
+                "INSERT INTO rounds (user_id, course_id, tee_id, date, score_by_hole)"
+                " VALUES (:user_id, :course_id, :tee_id, '2024-03-02', ARRAY[5,5,5,5,5,5,5,5,5])"
+                " RETURNING id"
+            ), **self.ids).scalar()
+            connection.execute(text(
+                "INSERT INTO round_changes (user_id, round_id, op) VALUES (:user_id, :round_id, 'upsert')"
+            ), user_id=self.ids['user_id'], round_id=round_id)
+            self.add_rounds((datetime.date(2024, 3, 3), [6] * 9))
+            # held back until the older transaction finishes
+            self.assertEqual(export(self.path), [])
+            transaction.commit()
+        self.assertEqual(export(self.path)[0]['rows'], 2)
+        snapshot = Snapshot(self.path)
+        self.assertEqual(sorted(np.concatenate(snapshot.column('total')).tolist()), [36, 45, 54])
+
+    def test_changed_and_deleted_rounds(self):
+        """Test changed rounds shadow their earlier rows and deleted ones go away"""
+        self.add_rounds(
+            (datetime.date(2024, 3, 1), [4] * 9),
+            (datetime.date(2024, 3, 2), [5] * 9),
+            (datetime.date(2024, 3, 3), [4, 4, None]),
+        )
+        export(self.path)
+        _, second_id, playing_id = [round.id for round in Round.query.order_by(Round.id)]
+        res = self.app.test_client().patch(
+            f"users/{self.ids['user_id']}/rounds/{playing_id}/holes/3", json={'score': 6}
+        )
+        self.assertEqual(res.status_code, 200, res.data)
+        self.db.session.delete(Round.query.get(second_id))
+        self.db.session.commit()
+        [info] = export(self.path)
+        self.assertEqual((info['rows'], info['replaced']), (1, 2))
+        snapshot = Snapshot(self.path)
+        self.assertEqual(len(snapshot), 2)
+        self.assertEqual(sorted(np.concatenate(snapshot.column('total')).tolist()), [14, 36])
+        self.assertEqual(snapshot.group('course_id')[self.ids['course_id']], {'rounds': 2, 'mean': 25.0})
+        export(self.path, full=True)
+        snapshot = Snapshot(self.path)
+        self.assertEqual([segment.rows for segment in snapshot.segments], [2])
+        self.assertIsNone(snapshot.segments[0].live)
+
+if __name__ == "__main__":
+    unittest.main()
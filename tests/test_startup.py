@@ -0,0 +1,50 @@
+import unittest
+from flask_app import create_app, db
+
+TEST_DB_URI = 'postgresql://test:password@db:5432/testdb'
+
+class StartupTestCase(unittest.TestCase):
+    """Class for testing the warm-up phase and startup timing report"""
+
+    def setUp(self):
+        """Set up for tests"""
+        self.app = create_app({'TEST_DB_URI': TEST_DB_URI})
+        self.db = db
+        self.db.create_all()
+
+    def tearDown(self):
+        """Test teardown"""
+        self.db.session.remove()
+        self.db.drop_all()
+
+    def test_warmup_disabled_when_testing(self):
+        """Test the warm-up phase is skipped by default in tests"""
+        report = self.app.extensions['startup_report']
+        self.assertEqual(report.warmup, {})
+
+    def test_warmup_opens_connections(self):
+        """Test warm-up configures mappers, fills the pool and times each phase"""
+        app = create_app({
+            'TEST_DB_URI': TEST_DB_URI,
+            'WARMUP_ENABLED': True,
+            'WARMUP_CONNECTIONS': 2
+        })
+        report = app.extensions['startup_report']
+        self.assertIn('mappers', report.warmup)
+        self.assertIn('database', report.warmup)
+        with app.app_context():
+            self.assertGreaterEqual(self.db.engine.pool.checkedin(), 2)
+
+    def test_first_request_timed_once(self):
+        """Test only the first request's latency is recorded"""
+        report = self.app.extensions['startup_report']
+        self.assertIsNone(report.first_request_seconds)
+        self.app.test_client().get("/courses")
+        first = report.first_request_seconds
+        self.assertIsNotNone(first)
+        self.app.test_client().get("/courses")
+        self.assertEqual(report.first_request_seconds, first)
+        self.assertGreater(report.as_dict()['import'], 0)
+
+if __name__ == "__main__":
+    unittest.main()
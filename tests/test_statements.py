@@ -0,0 +1,79 @@
+import unittest
+from sqlalchemy import event, text
+from flask_app import create_app, db, statements
+from flask_app.models import Course, Hole, Round, Tee, User, Yardage
+from flask_app.testing import QueryCapture
+
+
+class StatementTestCase(unittest.TestCase):
+    """Class for testing the cached and prepared lookups"""
+
+    def setUp(self):
+        """Set up for tests"""
+        self.app = create_app({'TEST_DB_URI': 'postgresql://test:password@db:5432/testdb'})
+        self.client = self.app.test_client
+        self.db = db
+        self.db.create_all()
+        course = Course(name="Fake golf course", location="fake location")
+        tee = Tee(course=course, colour="white")
+        hole = Hole(course=course, number=1, par=4)
+        user = User(name="Jon Snow")
+        self.db.session.add_all([course, tee, hole, Yardage(hole=hole, tee=tee, yardage=400), user])
+        self.db.session.flush()
+        round = Round(user=user, course=course, tee=tee, score_by_hole=[4])
+        self.db.session.add(round)
+        self.db.session.flush()
+        self.ids = {'course': course.id, 'hole': hole.id, 'round': round.id, 'user': user.id}
+        self.db.session.commit()
+        self.db.session.remove()
+
+    def tearDown(self):
+        """Test teardown"""
+        self.db.session.remove()
+        self.db.drop_all()
+
+    def test_get(self):
+        """Test lookups load like Query.get, options included, and use the
+        identity map"""
+        with self.app.app_context():
+            round = statements.get(Round, self.ids['round'], statements.ROUND_WITH_TEE)
+            self.assertEqual(round.score_by_hole, [4])
+            with QueryCapture() as capture:
+                self.assertEqual(round.tee.colour, "white")
+                self.assertIs(statements.get(Round, self.ids['round']), round)
+            self.assertEqual(capture.count, 0)
+            hole = statements.get(Hole, self.ids['hole'], statements.HOLE_WITH_YARDAGES)
+            self.assertEqual(hole.detail_format()['tees'][0]['yardage'], 400)
+            self.assertIsNone(statements.get(Course, 999))
+            self.assertIsNone(statements.get(Course, None))
+
+    def test_prepared_on_the_server(self):
+        """Test a lookup is prepared once per connection and executed after"""
+        sent = []
+        with self.app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', lambda *args: sent.append(args[2]))
+        for _ in range(2):
+            self.assertEqual(self.client().get(f"/courses/{self.ids['course']}").status_code, 200)
+        self.assertTrue(all(statement.startswith('EXECUTE golf_api_') for statement in sent), sent)
+        with self.app.app_context():
+            prepared = db.session.execute(text(
+                "SELECT statement FROM pg_prepared_statements WHERE name LIKE 'golf_api_%'"
+            )).fetchall()
+        self.assertEqual(len(prepared), 1)
+        self.assertIn('FROM courses', prepared[0][0])
+
+    def test_disabled(self):
+        """Test statements are sent as they are when preparing is disabled"""
+        app = create_app({
+            'TEST_DB_URI': 'postgresql://test:password@db:5432/testdb',
+            'PREPARED_STATEMENTS_ENABLED': False,
+        })
+        url = f"/users/{self.ids['user']}/rounds/{self.ids['round']}"
+        self.assertEqual(app.test_client().get(url).status_code, 200)
+        with app.app_context():
+            prepared = db.session.execute(text("SELECT count(*) FROM pg_prepared_statements")).scalar()
+        self.assertEqual(prepared, 0)
+
+if __name__ == "__main__":
+    unittest.main()
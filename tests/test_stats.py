@@ -0,0 +1,120 @@
+import datetime, unittest
+from flask_app import create_app, db, stats
+from flask_app.models import Course, Hole, Round, Tee, User
+
+TOKEN = 'secret'
+
+
+class StatsTestCase(unittest.TestCase):
+    """Class for testing the statistics views and admin endpoints"""
+
+    def setUp(self):
+        """Set up for tests"""
+        self.app = create_app({
+            'TEST_DB_URI': 'postgresql://test:password@db:5432/testdb',
+            'ADMIN_TOKEN': TOKEN,
+        })
+        self.client = self.app.test_client
+        self.db = db
+        self.db.create_all()
+        course = Course(name="Fake golf course", location="fake location")
+        other = Course(name="Other course", location="fake location")
+        white, blue = Tee(course=course, colour="white"), Tee(course=course, colour="blue")
+        other_tee = Tee(course=other, colour="red")
+        users = [User(name="Jon Snow"), User(name="Arya Stark")]
+        self.db.session.add_all([course, other, white, blue, other_tee] + users)
+        self.db.session.add_all([Hole(course=course, number=number, par=4) for number in range(1, 10)])
+        self.db.session.flush()
+        today = datetime.date.today()
+        jon, arya = users
+        rounds = [
+            (jon, course, white, today, [5] * 9),
+            (jon, course, white, today - datetime.timedelta(days=3), [4] * 9),
+            (arya, course, blue, today, [6] * 9),
+            (arya, course, blue, today - datetime.timedelta(days=3), [6] * 8),
+            (arya, other, other_tee, today - datetime.timedelta(days=60), [3] * 18),
+        ]
+        for user, played, tee, day, scores in rounds:
+            self.db.session.add(Round(user_id=user.id, course_id=played.id, tee_id=tee.id, date=day, score_by_hole=scores))
+        self.db.session.commit()
+        self.ids = {'course': course.id, 'other': other.id, 'white': white.id, 'blue': blue.id}
+        self.today = today
+        self.db.session.remove()
+
+    def tearDown(self):
+        """Test teardown"""
+        self.db.session.remove()
+        self.db.drop_all()
+
+    def get(self, url):
+        res = self.client().get(url, headers={stats.TOKEN_HEADER: TOKEN})
+        self.assertEqual(res.status_code, 200, res.data)
+        return res.get_json()
+
+    def refresh(self):
+        with self.app.app_context():
+            return stats.refresh(db.engine)
+
+    def test_refresh(self):
+        """Test the views show the rounds as of their last refresh"""
+        self.assertEqual(self.get("/admin/stats/rounds"), [])
+        self.assertEqual(set(self.refresh()), set(stats.VIEWS))
+        days = self.get("/admin/stats/rounds")
+        self.assertEqual([day['date'] for day in days], [
+            (self.today - datetime.timedelta(days=3)).isoformat(), self.today.isoformat()
+        ])
+        self.assertEqual([(day['rounds'], day['players']) for day in days], [(2, 2), (2, 2)])
+        start = (self.today - datetime.timedelta(days=90)).isoformat()
+        self.assertEqual(len(self.get(f"/admin/stats/rounds?from={start}")), 3)
+
+    def test_active_users(self):
+        """Test users are counted once per window they played in"""
+        self.assertEqual(self.get("/admin/stats/active-users")['year'], 0)
+        self.refresh()
+        body = self.get("/admin/stats/active-users")
+        self.assertEqual([body[window] for window in ('day', 'week', 'month', 'year')], [2, 2, 2, 2])
+        self.assertIsNotNone(body['refreshed_at'])
+
+    def test_most_played(self):
+        """Test courses are ranked by rounds played"""
+        self.refresh()
+        courses = self.get("/admin/stats/courses")
+        self.assertEqual([(course['name'], course['rounds'], course['players']) for course in courses], [
+            ("Fake golf course", 4, 2), ("Other course", 1, 1)
+        ])
+        self.assertEqual(len(self.get("/admin/stats/courses?limit=1")), 1)
+        res = self.client().get("/admin/stats/courses?limit=0", headers={stats.TOKEN_HEADER: TOKEN})
+        self.assertEqual(res.status_code, 400)
+
+    def test_average_scores(self):
+        """Test averages only count completed rounds, per tee and holes"""
+        self.refresh()
+        scores = self.get(f"/admin/stats/scores?course_id={self.ids['course']}")
+        self.assertEqual([(score['colour'], score['holes'], score['rounds'], score['average']) for score in scores], [
+            ('white', 9, 2, 40.5), ('blue', 9, 1, 54.0)
+        ])
+        self.assertEqual(len(self.get("/admin/stats/scores")), 3)
+
+    def test_token(self):
+        """Test the endpoints need the admin token"""
+        for token in (None, 'wrong'):
+            headers = {stats.TOKEN_HEADER: token} if token else {}
+            self.assertEqual(self.client().get("/admin/stats/courses", headers=headers).status_code, 401)
+        app = create_app({'TEST_DB_URI': 'postgresql://test:password@db:5432/testdb'})
+        res = app.test_client().get("/admin/stats/courses", headers={stats.TOKEN_HEADER: TOKEN})
+        self.assertEqual(res.status_code, 401)
+
+    def test_refresh_command(self):
+        """Test the command refreshes every view, and skips a database
+        another refresh holds"""
+        result = self.app.test_cli_runner().invoke(args=['stats', 'refresh', '--view', 'stats_daily_rounds'])
+        self.assertIn("Refreshed default: stats_daily_rounds in", result.output)
+        self.assertNotIn("stats_tee_scores", result.output)
+        with self.app.app_context():
+            with db.engine.connect() as connection:
+                connection.execute("SELECT pg_advisory_lock(%s)", stats.LOCK_ID)
+                self.assertIsNone(stats.refresh(db.engine))
+                connection.execute("SELECT pg_advisory_unlock(%s)", stats.LOCK_ID)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,158 @@
+import unittest
+from sqlalchemy import text
+from flask_app import create_app, db
+from flask_app.models import Course, Hole, Tee, User
+
+
+class SyncTestCase(unittest.TestCase):
+    """Class for testing the /sync delta feed"""
+
+    def setUp(self):
+        """Set up for tests"""
+        self.app = create_app({'TEST_DB_URI': 'postgresql://test:password@db:5432/testdb'})
+        self.client = self.app.test_client
+        self.db = db
+        self.db.create_all()
+        course = Course(name="Fake golf course", location="fake location")
+        self.db.session.add(course)
+        self.db.session.flush()
+        self.course_id = course.id
+        self.db.session.commit()
+        res = self.client().post(f"/courses/{self.course_id}/tees", json={'colour': 'white'})
+        self.assertEqual(res.status_code, 201)
+        res = self.client().post(f"/courses/{self.course_id}/holes", json=[
+            {'number': 1, 'par': 4, 'tees': [{'colour': 'white', 'yardage': 400}]},
+            {'number': 2, 'par': 3, 'tees': [{'colour': 'white', 'yardage': 180}]},
+        ])
+        self.assertEqual(res.status_code, 201)
+        self.tee_id = Tee.query.filter_by(course_id=self.course_id).one().id
+        self.hole_ids = [hole.id for hole in Hole.query.order_by(Hole.number)]
+
+    def tearDown(self):
+        """Test teardown"""
+        self.db.session.remove()
+        self.db.drop_all()
+
+    def sync(self, since=None, **args):
+        if since:
+            args['since'] = since
+        res = self.client().get("/sync", query_string=args)
+        self.assertEqual(res.status_code, 200, res.data)
+        return res.get_json()
+
+    def kinds(self, body):
+        return sorted((change['type'], str(change['id'])) for change in body['changes'])
+
+    def test_initial_sync(self):
+        """Test a client without a token gets all the reference data"""
+        body = self.sync()
+        self.assertFalse(body['more'])
+        self.assertEqual(len(body['changes']), 6)
+        by_type = {}
+        for change in body['changes']:
+            self.assertEqual(change['op'], 'upsert')
+            by_type.setdefault(change['type'], []).append(change)
+        self.assertEqual(by_type['course'][0]['data']['name'], "Fake golf course")
+        self.assertEqual(by_type['tee'][0]['data']['colour'], 'white')
+        self.assertEqual(sorted(change['data']['par'] for change in by_type['hole']), [3, 4])
+        self.assertEqual(
+            sorted(change['data']['yardage'] for change in by_type['yardage']), [180, 400]
+        )
+        self.assertEqual(self.sync(body['next'])['changes'], [])
+
+    def test_changes_since_token(self):
+        """Test only rows changed after the token are returned, once each"""
+        token = self.sync()['next']
+        for rating in (70.1, 71.2):
+            res = self.client().patch(
+                f"/courses/{self.course_id}/tees/{self.tee_id}", json={'course_rating': rating}
+            )
+            self.assertEqual(res.status_code, 201)
+        body = self.sync(token)
+        self.assertEqual(len(body['changes']), 1)
+        self.assertEqual(body['changes'][0]['id'], self.tee_id)
+        self.assertEqual(body['changes'][0]['data']['course_rating'], 71.2)
+
+    def test_deletes(self):
+        """Test deleted rows are reported without data"""
+        token = self.sync()['next']
+        hole = Hole.query.get(self.hole_ids[1])
+        for yardage in hole.tees:
+            self.db.session.delete(yardage)
+        self.db.session.delete(hole)
+        self.db.session.commit()
+        changes = self.sync(token)['changes']
+        self.assertEqual(
+            sorted((change['type'], change['op'], change['data']) for change in changes),
+            [('hole', 'delete', None), ('yardage', 'delete', None)]
+        )
+
+    def test_paging(self):
+        """Test pages follow on from each other until more is false"""
+        seen, token, pages = [], None, 0
+        while True:
+            body = self.sync(token, limit=4)
+            seen.extend(body['changes'])
+            token, pages = body['next'], pages + 1
+            if not body['more']:
+                break
+        self.assertEqual(pages, 2)
+        self.assertEqual(len(seen), 6)
+
+    def test_rounds(self):
+        """Test a user's rounds are included only for that user, hole updates
+        included"""
+        users = [User(name="Jon Snow"), User(name="Arya Stark")]
+        self.db.session.add_all(users)
+        self.db.session.flush()
+        user_ids = [user.id for user in users]
+        self.db.session.commit()
+        for user_id in user_ids:
+            res = self.client().post(f"/users/{user_id}/rounds", json={
+                'course_id': self.course_id, 'tee_id': self.tee_id, 'score_by_hole': [4, 3]
+            })
+            self.assertEqual(res.status_code, 201)
+        self.assertNotIn('round', [change['type'] for change in self.sync()['changes']])
+        body = self.sync(user_id=user_ids[0])
+        rounds = [change for change in body['changes'] if change['type'] == 'round']
+        self.assertEqual(len(rounds), 1)
+        self.assertEqual(rounds[0]['data']['user_id'], user_ids[0])
+        round_id = rounds[0]['id']
+        res = self.client().patch(
+            f"/users/{user_ids[0]}/rounds/{round_id}/holes/2", json={'score': 5}
+        )
+        self.assertEqual(res.status_code, 200)
+        changes = self.sync(body['next'], user_id=user_ids[0])['changes']
+        self.assertEqual(len(changes), 1)
+        self.assertEqual(changes[0]['data']['score_by_hole'], [4, 5])
+        other = self.sync(body['next'], user_id=user_ids[1])['changes']
+        self.assertEqual([change['data']['user_id'] for change in other], [user_ids[1]])
+
+    def test_waits_for_running_transactions(self):
+        """Test changes committed after an older transaction began are held
+        back until it ends, so the token cannot skip its changes"""
+        token = self.sync()['next']
+        with self.app.app_context():
+            connection = db.engine.connect()
+        transaction = connection.begin()
+        connection.execute(text("SELECT txid_current()"))
+        try:
+            res = self.client().post("/courses", json={'name': "New", 'location': "Somewhere"})
+            self.assertEqual(res.status_code, 201)
+            body = self.sync(token)
+            self.assertEqual(body['changes'], [])
+            self.assertEqual(body['next'], token)
+        finally:
+            transaction.rollback()
+            connection.close()
+        self.assertEqual([change['type'] for change in self.sync(token)['changes']], ['course'])
+
+    def test_invalid_token(self):
+        """Test a malformed token is rejected"""
+        for token in ("not a token", "eyJjIjoxfQ"):
+            res = self.client().get("/sync", query_string={'since': token})
+            self.assertEqual(res.status_code, 400)
+        self.assertEqual(self.client().get("/sync?limit=0").status_code, 400)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -74,6 +74,20 @@ class UserTestCase(unittest.TestCase):
         self.assertEqual(len(data), 2)
         #TODO more assertions
 
+    def test_retrieve_rounds_include(self):
+        """Test embedding each round's course and tee with ?include="""
+        course_id = sample_course(self.db)
+        tee_id = sample_tee(self.db, course_id, colour='blue')
+        user_id = sample_user(self.db)
+        sample_round(self.db, user_id, course_id, tee_id)
+        res = self.client().get(f"users/{user_id}/rounds?include=course,tee")
+        self.assertEqual(res.status_code, 200)
+        data = json.loads(res.data)
+        self.assertEqual(data[0]['course']['id'], course_id)
+        self.assertEqual(data[0]['tee']['colour'], 'blue')
+        res = self.client().get(f"users/{user_id}/rounds?include=holes")
+        self.assertEqual(res.status_code, 400)
+
     def test_post_partial_round_success(self):
         """Test posting a round with just score is successful"""
         course_id = sample_course(db)
@@ -166,6 +180,111 @@ class UserTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 201)
         self.assertCountEqual(round.score_by_hole, payload['score_by_hole'])
 
+    def test_update_round_hole(self):
+        """Test setting a single hole only changes that hole and bumps the version"""
+        course_id = sample_course(self.db)
+        tee_id = sample_tee(self.db, course_id)
+        user_id = sample_user(self.db)
+        round_id = sample_round(self.db, user_id, course_id, tee_id)
+        res = self.client().patch(
+            f"users/{user_id}/rounds/{round_id}/holes/3",
+            data=json.dumps({'score': 6, 'putts': 3, 'version': 1})
+        )
+        self.assertEqual(res.status_code, 200, res.data)
+        data = json.loads(res.data)
+        self.assertEqual(data['version'], 2)
+        self.assertEqual(data['score_by_hole'], [4, 4, 6, 4, 4, 4, 4, 4, 4])
+        self.assertEqual(data['putts'], [None, None, 3])
+        round = Round.query.get(round_id)
+        self.assertEqual(round.score, 38)
+
+    def test_update_round_holes_in_progress(self):
+        """Test scoring holes of an unscored round as they are played"""
+        course_id = sample_course(self.db)
+        tee_id = sample_tee(self.db, course_id)
+        user_id = sample_user(self.db)
+        new_round = Round(
+            course_id=course_id, tee_id=tee_id, user_id=user_id, score_by_hole=[None] * 9
+        )
+        self.db.session.add(new_round)
+        self.db.session.commit()
+        round_id = new_round.id
+        res = self.client().patch(
+            f"users/{user_id}/rounds/{round_id}/holes",
+            data=json.dumps({'version': 1, 'holes': {'1': {'score': 5}, '2': {'score': 3}}})
+        )
+        self.assertEqual(res.status_code, 200, res.data)
+        self.assertEqual(json.loads(res.data)['score_by_hole'], [5, 3] + [None] * 7)
+        res = self.client().get(f"users/{user_id}/rounds/{round_id}")
+        data = json.loads(res.data)
+        self.assertEqual(data['score'], 8)
+        self.assertIsNone(data['handicap'])
+
+    def test_update_round_hole_conflict(self):
+        """Test an update against a stale version is rejected"""
+        course_id = sample_course(self.db)
+        tee_id = sample_tee(self.db, course_id)
+        user_id = sample_user(self.db)
+        round_id = sample_round(self.db, user_id, course_id, tee_id)
+        url = f"users/{user_id}/rounds/{round_id}/holes/1"
+        res = self.client().patch(url, data=json.dumps({'score': 3, 'version': 1}))
+        self.assertEqual(res.status_code, 200)
+        res = self.client().patch(url, data=json.dumps({'score': 5, 'version': 1}))
+        self.assertEqual(res.status_code, 409)
+        self.assertEqual(Round.query.get(round_id).score_by_hole[0], 3)
+
+    def test_update_round_hole_fail(self):
+        """Test invalid hole updates are rejected"""
+        course_id = sample_course(self.db)
+        tee_id = sample_tee(self.db, course_id)
+        user_id = sample_user(self.db)
+        round_id = sample_round(self.db, user_id, course_id, tee_id)
+        url = f"users/{user_id}/rounds/{round_id}/holes"
+        res = self.client().patch(f"{url}/19", data=json.dumps({'score': 3}))
+        self.assertEqual(res.status_code, 400)
+        res = self.client().patch(f"{url}/1", data=json.dumps({'strokes': 3}))
+        self.assertEqual(res.status_code, 400)
+        res = self.client().patch(f"{url}/1", data=json.dumps([3]))
+        self.assertEqual(res.status_code, 400)
+        # past the end of the nine hole round
+        res = self.client().patch(f"{url}/12", data=json.dumps({'score': 3}))
+        self.assertEqual(res.status_code, 400)
+        holes = {'2': {'score': 3}, '10': {'score': 4}}
+        res = self.client().patch(url, data=json.dumps({'holes': holes}))
+        self.assertEqual(res.status_code, 400)
+        round = Round.query.get(round_id)
+        self.assertEqual((round.score_by_hole, round.version), ([4] * 9, 1))
+        res = self.client().patch(url, data=json.dumps("holes"))
+        self.assertEqual(res.status_code, 400)
+        res = self.client().patch(f"users/{user_id}/rounds/{round_id + 1}/holes/1", data=json.dumps({'score': 3}))
+        self.assertEqual(res.status_code, 404)
+
+    def test_handicap_what_if(self):
+        """Test evaluating hypothetical scores against the user's rounds"""
+        course_id = sample_course(self.db)
+        tee = Tee(course_id=course_id, colour="white", course_rating=72.0, slope_rating=113)
+        self.db.session.add(tee)
+        user_id = sample_user(self.db)
+        self.db.session.flush()
+        for score in (80, 84, 88):
+            self.db.session.add(Round(
+                course_id=course_id, tee_id=tee.id, user_id=user_id,
+                score_by_hole=[score - 17 * 4] + [4] * 17
+            ))
+        self.db.session.commit()
+        payload = {'tee_id': tee.id, 'scores': [76, 90]}
+        res = self.client().post(f"users/{user_id}/handicap/what-if", data=json.dumps(payload))
+        self.assertEqual(res.status_code, 200, res.data)
+        data = json.loads(res.data)
+        self.assertEqual(data['handicap_index'], 6.0)
+        self.assertEqual(data['rounds'], 3)
+        self.assertEqual([r['handicap_index'] for r in data['results']], [3.0, 7.0])
+        payload = {'tee_ids': [tee.id + 1], 'scores': [76]}
+        res = self.client().post(f"users/{user_id}/handicap/what-if", data=json.dumps(payload))
+        self.assertEqual(res.status_code, 400)
+        res = self.client().post(f"users/{user_id}/handicap/what-if", data=json.dumps([76]))
+        self.assertEqual(res.status_code, 400)
+
     def test_update_round_fail(self): #TODO might change functionality to let this happen
         """Test trying to change tee id or course id for a roumd fails"""
         course1_id = sample_course(self.db)